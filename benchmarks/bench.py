@@ -0,0 +1,194 @@
+#!/usr/bin/env python
+# coding: utf-8
+# vim:et:sta:sts=2:sw=2:ts=2:tw=0:
+"""
+Benchmarks of the BootSetup gather and install paths, against the simulated libsalt backend (simsalt).
+No disk nor root privileges are needed: the host devices, sysfs and grub files are never read.
+
+  bench.py [--scales=1,10,50,100,500] [--partitions-per-disk=4] [--kernels=2] [--workers=N]
+           [--latency=NAME:SECONDS]... [--repeat=3] [--save=FILE] [--compare=FILE [--tolerance=1.5]]
+
+--latency could be given for getDiskInfo, getPartitionInfo, mountDevice, umountDevice, exec (execCall/execGetOutput) and probe (each os-probes test).
+--save writes the results as JSON, --compare fails (exit code 1) if a timing is more than tolerance times the one in FILE.
+"""
+from __future__ import unicode_literals, print_function, division, absolute_import
+
+import os
+import sys
+import json
+import time
+import stat
+import shutil
+import codecs
+import tempfile
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+import simsalt  # noqa
+simsalt.setup(simsalt.Simulation())
+from bootsetup.config import Config  # noqa
+from bootsetup import lilo as liloModule  # noqa
+from bootsetup import extfs  # noqa
+from bootsetup.lilo import Lilo  # noqa
+from bootsetup.grub2 import Grub2  # noqa
+from bootsetup.mountpool import pool  # noqa
+
+OPERATIONS = ('gather', 'lilo', 'grub2')
+
+
+def create_os_probes(latency):
+  """
+  Create a fake os-probes directory, which mounted test detects a Linux on every partition.
+  """
+  probesDir = tempfile.mkdtemp(prefix='bootsetup.bench-probes-')
+  os.makedirs(os.path.join(probesDir, 'mounted'))
+  test = os.path.join(probesDir, 'mounted', '90linux-distro')
+  with open(test, 'w') as f:
+    f.write('#!/bin/sh\nsleep {0}\necho "$1:Simulated Linux:SimLinux:linux"\n'.format(latency))
+  os.chmod(test, stat.S_IRWXU)
+  return probesDir
+
+
+class NoExtFs:
+  """
+  Replace extfs.ExtFs: the simulated partitions cannot be read without mounting them, like non-ext ones.
+  """
+
+  def __init__(self, path):
+    raise EnvironmentError("{0} is simulated".format(path))
+
+
+def isolate_from_host(fakeDir):
+  """
+  Point the paths of the host read by Lilo and Grub2 to fakeDir, which is empty,
+  and stub what reads the devices directly: the ext filesystems, their change indicators and the MBR.
+  """
+  Config.inventory_backend = 'libsalt'
+  Lilo.uuidDir = os.path.join(fakeDir, 'by-uuid')
+  Lilo.fbSysfsDir = os.path.join(fakeDir, 'fb0')
+  Lilo._hasLiloBootSector = lambda self: False
+  liloModule.change_indicator = lambda devicePath: None
+  extfs.ExtFs = NoExtFs
+  Grub2.grubLibDir = os.path.join(fakeDir, 'grub')
+  Grub2.efiSysfsDir = os.path.join(fakeDir, 'efi')
+  Grub2._isCoreImageInstalled = lambda self, device, grubDir: False
+
+
+def best_time(fct, repeat):
+  best = None
+  for n in range(repeat):
+    start = time.time()
+    fct()
+    duration = time.time() - start
+    if best is None or duration < best:
+      best = duration
+  return best
+
+
+def run_scale(partitions, partitionsPerDisk, kernels, latencies, repeat):
+  disks = max(1, -(-partitions // partitionsPerDisk))
+  simsalt.setup(simsalt.Simulation(disks=disks, partitions_per_disk=min(partitions, partitionsPerDisk), kernels_per_partition=kernels, latencies=latencies))
+  results = {}
+  cfgs = []
+
+  def gather():
+    cfgs.append(Config(None, None, False, False))
+  results['gather'] = best_time(gather, repeat)
+  cfg = cfgs[-1]
+  liloPartitions = [[bp.device, bp.fstype, bp.boot_type, "L{0}".format(n)] for (n, bp) in enumerate(cfg.boot_partitions[:partitions])]
+
+  def lilo():
+    Lilo(False).createConfiguration(cfg.disks[0].device, liloPartitions[0][0], liloPartitions)
+  results['lilo'] = best_time(lilo, repeat)
+
+  def grub2():
+    Grub2(False).install(cfg.disks[0].device, cfg.partitions[0].device)
+  results['grub2'] = best_time(grub2, repeat)
+  pool.close()
+  simsalt.teardown()
+  return results
+
+
+def parse_args(args):
+  options = {
+      'scales': [1, 10, 50, 100, 500],
+      'partitions-per-disk': 4,
+      'kernels': 2,
+      'workers': None,
+      'latencies': {},
+      'repeat': 3,
+      'save': None,
+      'compare': None,
+      'tolerance': 1.5,
+    }
+  for arg in args:
+    if arg in ('-h', '--help'):
+      print(__doc__)
+      sys.exit(0)
+    if not arg.startswith('--') or '=' not in arg:
+      raise SystemExit("Unrecognized parameter '{0}'".format(arg))
+    (name, value) = arg[2:].split('=', 1)
+    if name == 'scales':
+      options['scales'] = [int(v) for v in value.split(',')]
+    elif name in ('partitions-per-disk', 'kernels', 'workers', 'repeat'):
+      options[name] = int(value)
+    elif name == 'tolerance':
+      options[name] = float(value)
+    elif name in ('save', 'compare'):
+      options[name] = value
+    elif name == 'latency':
+      (fct, seconds) = value.split(':', 1)
+      options['latencies'][fct] = float(seconds)
+    else:
+      raise SystemExit("Unrecognized parameter '{0}'".format(arg))
+  return options
+
+
+def compare(results, reference, tolerance):
+  """
+  Return the list of regressions: (scale, operation, reference time, time).
+  """
+  regressions = []
+  for (scale, timings) in sorted(results.items(), key=lambda i: int(i[0])):
+    for op in OPERATIONS:
+      ref = reference.get(scale, {}).get(op)
+      if ref and timings[op] > ref * tolerance:
+        regressions.append((scale, op, ref, timings[op]))
+  return regressions
+
+
+def main(args=sys.argv[1:]):
+  options = parse_args(args)
+  if options['workers']:
+    Config.workers = options['workers']
+  Config.quiet = True
+  Config.probe_cache_dir = None
+  probesDir = create_os_probes(options['latencies'].get('probe', simsalt.Simulation().latencies['exec']))
+  Config.os_probes_dirs = (probesDir,)
+  fakeDir = tempfile.mkdtemp(prefix='bootsetup.bench-host-')
+  isolate_from_host(fakeDir)
+  results = {}
+  print("{0:>10} {1:>10} {2:>10} {3:>10}".format('partitions', *OPERATIONS))
+  try:
+    for scale in options['scales']:
+      timings = run_scale(scale, options['partitions-per-disk'], options['kernels'], options['latencies'], options['repeat'])
+      results["{0}".format(scale)] = timings
+      print("{0:>10} {1:>10.3f} {2:>10.3f} {3:>10.3f}".format(scale, *[timings[op] for op in OPERATIONS]))
+  finally:
+    shutil.rmtree(probesDir, True)
+    shutil.rmtree(fakeDir, True)
+  if options['save']:
+    with codecs.open(options['save'], 'w', 'utf-8') as f:
+      json.dump(results, f, indent=2, sort_keys=True)
+  if options['compare']:
+    with codecs.open(options['compare'], 'r', 'utf-8') as f:
+      reference = json.load(f)
+    regressions = compare(results, reference, options['tolerance'])
+    for (scale, op, ref, t) in regressions:
+      print("Regression: {0} with {1} partitions took {2:.3f}s instead of {3:.3f}s".format(op, scale, t, ref))
+    if regressions:
+      sys.exit(1)
+
+
+if __name__ == '__main__':
+  main()
@@ -0,0 +1,198 @@
+#!/usr/bin/env python
+# coding: utf-8
+# vim:et:sta:sts=2:sw=2:ts=2:tw=0:
+"""
+Simulated libsalt backend for the benchmarks.
+Disks, partitions and mounts are fake, each call only sleeps for a configurable latency.
+Mount points are real temporary directories with a /boot holding kernels and initrds, so LiLo can scan them.
+
+Call setup() before importing any bootsetup module: it registers this module as libsalt.
+"""
+from __future__ import unicode_literals, print_function, division, absolute_import
+
+import os
+import sys
+import time
+import shutil
+import subprocess
+import tempfile
+import threading
+
+
+class mounting:
+  _tempMountDir = None
+
+
+class Simulation:
+  """
+  Parameters of the simulated system.
+  latencies: seconds per call, by function name. 'exec' is used for execCall and execGetOutput.
+  """
+  disks = 1
+  partitions_per_disk = 1
+  kernels_per_partition = 1
+  latencies = None
+
+  def __init__(self, disks=1, partitions_per_disk=1, kernels_per_partition=1, latencies=None):
+    self.disks = disks
+    self.partitions_per_disk = partitions_per_disk
+    self.kernels_per_partition = kernels_per_partition
+    self.latencies = {
+        'getDiskInfo': 0.001,
+        'getPartitionInfo': 0.001,
+        'mountDevice': 0.002,
+        'umountDevice': 0.002,
+        'exec': 0.002,
+      }
+    if latencies:
+      self.latencies.update(latencies)
+
+
+_sim = Simulation()
+_root = None
+_mounted = {}
+_lock = threading.Lock()
+
+
+def _sleep(name):
+  latency = _sim.latencies.get(name, 0)
+  if latency:
+    time.sleep(latency)
+
+
+def _disk_name(n):
+  name = ''
+  n += 1
+  while n:
+    (n, r) = divmod(n - 1, 26)
+    name = chr(ord('a') + r) + name
+  return 'sd' + name
+
+
+def setup(simulation):
+  """
+  Use simulation and register this module as libsalt.
+  """
+  global _sim, _root
+  _sim = simulation
+  if _root and os.path.exists(_root):
+    shutil.rmtree(_root, True)
+  _root = tempfile.mkdtemp(prefix='bootsetup.bench-')
+  _mounted.clear()
+  sys.modules['libsalt'] = sys.modules[__name__]
+
+
+def teardown():
+  global _root
+  if _root:
+    shutil.rmtree(_root, True)
+    _root = None
+
+
+def _populate(mp):
+  boot = os.path.join(mp, 'boot')
+  if not os.path.isdir(boot):
+    os.makedirs(boot)
+    os.makedirs(os.path.join(mp, 'etc'))
+    for k in range(_sim.kernels_per_partition):
+      version = "4.4.{0}".format(k)
+      for name in ('vmlinuz-' + version, 'initrd-' + version + '.gz', 'System.map-' + version, 'config-' + version):
+        with open(os.path.join(boot, name), 'w') as f:
+          f.write(name)
+
+
+def isSaLTLiveEnv():
+  return False
+
+
+def getDisks():
+  return [_disk_name(n) for n in range(_sim.disks)]
+
+
+def getPartitions(disk):
+  return ["{0}{1}".format(disk, n + 1) for n in range(_sim.partitions_per_disk)]
+
+
+def getDiskInfo(disk):
+  _sleep('getDiskInfo')
+  return {'type': 'msdos', 'model': 'SIM' + disk, 'sizeHuman': '500GB'}
+
+
+def getPartitionInfo(partition):
+  _sleep('getPartitionInfo')
+  return {'fstype': 'ext4', 'label': 'Sim' + partition, 'sizeHuman': '20GB'}
+
+
+def getFsType(partition):
+  return 'ext4'
+
+
+def isMounted(device):
+  with _lock:
+    return device in _mounted
+
+
+def getMountPoint(device):
+  with _lock:
+    return _mounted.get(device)
+
+
+def mountDevice(device, fsType=None, mountPoint=None):
+  _sleep('mountDevice')
+  if not mountPoint:
+    mountPoint = os.path.join(_root, os.path.basename(device))
+  _populate(mountPoint)
+  with _lock:
+    _mounted[device] = mountPoint
+  return mountPoint
+
+
+def _unmount(mountPoints, deleteMountPoint):
+  """
+  Forget the mounts and remove their simulated content.
+  """
+  with _lock:
+    for (device, mp) in list(_mounted.items()):
+      if mp in mountPoints:
+        del _mounted[device]
+  for mp in mountPoints:
+    shutil.rmtree(mp, True)
+    if not deleteMountPoint:
+      os.makedirs(mp)
+
+
+def umountDevice(mountPoint, deleteMountPoint=True):
+  _sleep('umountDevice')
+  _unmount([mountPoint], deleteMountPoint)
+
+
+def execGetOutput(cmd, shell=True):
+  if isinstance(cmd, (list, tuple)) and cmd[0].startswith(tempfile.gettempdir()):  # a real script, like a simulated os-probes test
+    output = subprocess.Popen(cmd, stdout=subprocess.PIPE).communicate()[0].decode('utf-8')
+    return [l for l in output.splitlines() if l.strip()]
+  _sleep('exec')
+  line = cmd if not isinstance(cmd, (list, tuple)) else ' '.join(cmd)
+  if 'readlink' in line:
+    return ['/dev/sda1']
+  elif 'blkid' in line:
+    return ['{0}: UUID="0000-{1}"'.format(d, os.path.basename(d)) for d in line.split() if d.startswith('/dev/')]
+  elif 'fbset' in line:
+    return ['    geometry 1024 768 1024 768 32']
+  else:
+    return []
+
+
+def execCall(cmd, shell=True, env=None):
+  _sleep('exec')
+  if isinstance(cmd, (list, tuple)) and cmd and cmd[0] == 'umount':
+    _unmount(cmd[1:], False)
+  elif isinstance(cmd, (list, tuple)) and list(cmd[:2]) == ['mount', '--move']:
+    with _lock:
+      for (device, mp) in list(_mounted.items()):
+        if mp == cmd[2]:
+          _mounted[device] = cmd[3]
+    shutil.rmtree(cmd[3], True)  # the content of the simulated mount replaces the one of the directory
+    shutil.move(cmd[2], cmd[3])
+  elif isinstance(cmd, (list, tuple)) and cmd and cmd[0] == 'mount':  # mount [-o options] device mountpoint
+    mountDevice(cmd[-2], mountPoint=cmd[-1])
+  return True
@@ -13,6 +13,7 @@ import abc
 import os
 import sys
 import gettext
+from .workers import DEFAULT_WORKERS
 
 
 class BootSetup:
@@ -56,20 +57,25 @@ def usage():
 {license}
 {author}
 
-  bootsetup.py [--help] [--version] [--test [--data]] [bootloader] [partition]
+  bootsetup.py [--help] [--version] [--test [--data]] [--workers=N] [--inventory=BACKEND] [--rescan] [--hotplug] [--profile[=FILE]] [bootloader] [partition]
 
 Parameters:
   --help: Show this help message
   --version: Show the BootSetup version
   --test: Run it in test mode
     --data: Run it with some pre-filled data
+  --workers=N: Number of devices queried or mounted at the same time (default {workers})
+  --inventory=BACKEND: How disks and partitions are listed: libsalt (default) or sysfs
+  --rescan: Probe every partition for operating systems, ignoring the probe cache
+  --hotplug: Watch for disks being plugged or unplugged and update the lists
+  --profile[=FILE]: Time every phase and external command, write a JSON report to FILE on exit (default bootsetup-profile.json)
   bootloader: could be lilo or grub2, by default nothing is proposed. You could use "_" to tell it's undefined.
   partition: target partition to install the bootloader.
     The disk of that partition is, by default, where the bootloader will be installed
     The partition will be guessed by default if not specified:
       ⋅ First Linux selected partition of the selected disk for LiLo.
       ⋅ First Linux partition, in order, of the selected disk for Grub2. This could be changed in the UI.
-""".format(ver=__version__, copyright=__copyright__, license=__license__, author=__author__))
+""".format(ver=__version__, copyright=__copyright__, license=__license__, author=__author__, workers=DEFAULT_WORKERS))
 
 
 def print_err(*args):
@@ -90,6 +96,7 @@ def find_locale_dir():
 
 
 def main(args=sys.argv[1:]):
+  cwd = os.getcwd()
   if os.path.dirname(__file__):
     os.chdir(os.path.dirname(__file__))
   is_graphic = bool(os.environ.get('DISPLAY'))
@@ -97,6 +104,11 @@ def main(args=sys.argv[1:]):
   use_test_data = False
   bootloader = None
   target_partition = None
+  workers = None
+  inventory = None
+  rescan = False
+  hotplug = False
+  profile_path = None
   gettext.install(domain=__app__, localedir=find_locale_dir(), unicode=True)
   for arg in args:
     if arg:
@@ -112,6 +124,23 @@ def main(args=sys.argv[1:]):
       elif is_test and arg == '--data':
         use_test_data = True
         print_err("*** Test data mode ***")
+      elif arg.startswith('--workers='):
+        try:
+          workers = int(arg.split('=', 1)[1])
+        except ValueError:
+          workers = 0
+        if workers < 1:
+          die(_("workers parameter should be a positive number, given {0}.").format(arg.split('=', 1)[1]))
+      elif arg == '--rescan':
+        rescan = True
+      elif arg == '--hotplug':
+        hotplug = True
+      elif arg == '--profile' or arg.startswith('--profile='):
+        profile_path = os.path.join(cwd, arg.split('=', 1)[1] if '=' in arg else 'bootsetup-profile.json')
+      elif arg.startswith('--inventory='):
+        inventory = arg.split('=', 1)[1]
+        if inventory not in ('libsalt', 'sysfs'):
+          die(_("inventory parameter should be libsalt or sysfs, given {0}.").format(inventory))
       elif arg[0] == '-':
         die(_("Unrecognized parameter '{0}'.").format(arg))
       else:
@@ -127,12 +156,33 @@ def main(args=sys.argv[1:]):
     bootloader = None
   if target_partition and not os.path.exists(target_partition):
     die(_("Partition {0} not found.").format(target_partition))
+  if profile_path:
+    import atexit
+    import libsalt as slt
+    from .profiler import profiler
+    profiler.enable()
+    profiler.instrument_libsalt(slt)
+    atexit.register(profiler.write, profile_path)
+  if workers or inventory or rescan or hotplug:
+    from .config import Config
+    Config.rescan = rescan
+    Config.hotplug = hotplug
+    if workers:
+      from .lilo import Lilo
+      Config.workers = workers
+      Lilo.workers = workers
+    if inventory:
+      Config.inventory_backend = inventory
   if is_graphic:
     from .bootsetup_gtk import BootSetupGtk as BootSetupImpl
   else:
     from .bootsetup_curses import BootSetupCurses as BootSetupImpl
+  from .mountpool import pool
   bootsetup = BootSetupImpl(__app__, bootloader, target_partition, is_test, use_test_data)
-  bootsetup.run_setup()
+  try:
+    bootsetup.run_setup()
+  finally:
+    pool.close()  # unmount the partitions kept mounted for the session
 
 
 if __name__ == '__main__':
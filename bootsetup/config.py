@@ -10,12 +10,70 @@ import sys
 import re
 import codecs
 import os
+import glob
+import threading
+import time
+import tempfile
+import subprocess as sp
 import libsalt as slt
+from .workers import parallel_map, DEFAULT_WORKERS
+from . import sysfs
+from .probecache import ProbeCache
+from .profiler import profiler, command_name
+
+
+class Record(object):
+  """
+  Compact record with named fields, that could still be used like the list it replaces:
+  indexing, slicing, iterating, len() and comparison with a list.
+  """
+  __slots__ = ()
+
+  def __init__(self, *values):
+    for (name, value) in zip(self.__slots__, values):
+      setattr(self, name, value)
+
+  def __getitem__(self, index):
+    if isinstance(index, slice):
+      return [getattr(self, name) for name in self.__slots__[index]]
+    return getattr(self, self.__slots__[index])
+
+  def __setitem__(self, index, value):
+    setattr(self, self.__slots__[index], value)
+
+  def __len__(self):
+    return len(self.__slots__)
+
+  def __iter__(self):
+    return (getattr(self, name) for name in self.__slots__)
+
+  def __eq__(self, other):
+    return list(self) == list(other)
+
+  def __ne__(self, other):
+    return not self == other
+
+  def __repr__(self):
+    return "{0}({1})".format(self.__class__.__name__, ", ".join(map(repr, self)))
+
+
+class Disk(Record):
+  __slots__ = ('device', 'type', 'description')
+
+
+class Partition(Record):
+  __slots__ = ('device', 'fstype', 'description')
+
+
+class BootEntry(Record):
+  __slots__ = ('device', 'fstype', 'boot_type', 'os', 'label')
 
 
 class Config:
   """
   Configuration for BootSetup
+  disks, partitions and boot_partitions are lists of Disk, Partition and BootEntry.
+  disk_by_device, partition_by_device and boot_partition_by_device index them by device name.
   """
   disks = []
   partitions = []
@@ -26,108 +84,450 @@ class Config:
   is_test = False
   use_test_data = False
   is_live = False
+  workers = DEFAULT_WORKERS
+  inventory_backend = 'libsalt'
+  sysfs_root = '/'
+  probe_cache_dir = '/var/cache/bootsetup'
+  rescan = False
+  on_boot_partition = None
+  quiet = False
+  hotplug = False
+  os_probes_dirs = ('/usr/lib64/os-probes', '/usr/lib/os-probes')
+  os_prober_paths = ('/usr/bin/os-prober', '/usr/sbin/os-prober')
 
-  def __init__(self, bootloader, target_partition, is_test, use_test_data):
+  def __init__(self, bootloader, target_partition, is_test, use_test_data, on_boot_partition=None, gather=True):
+    """
+    on_boot_partition, if specified, is called with each boot partition as soon as it is found by the probes,
+    before the whole configuration is gathered. It could be called from another thread.
+    If gather is False, the configuration is not gathered until gather() is called, for instance from another thread.
+    """
     self.cur_bootloader = bootloader
     self.cur_boot_partition = target_partition and re.sub(r'/dev/', '', target_partition) or ''
     self.cur_mbr_device = ''
     self.is_test = is_test
     self.use_test_data = use_test_data
+    self.on_boot_partition = on_boot_partition
+    self._publish_lock = threading.Lock()
+    self._set_disks_and_partitions([], [])
+    self._set_boot_partitions([])
+    if gather:
+      self.gather()
+
+  def gather(self):
+    """
+    Gather the current configuration: disks, partitions and boot partitions.
+    """
     self._get_current_config()
 
+  def summary(self):
+    return """
+bootloader         = {bootloader}
+target partition   = {partition}
+MBR device         = {mbr}
+disks:{disks}
+partitions:{partitions}
+boot partitions:{boot_partitions}
+""".format(bootloader=self.cur_bootloader, partition=self.cur_boot_partition, mbr=self.cur_mbr_device, disks="\n - " + "\n - ".join(map(" ".join, self.disks)), partitions="\n - " + "\n - ".join(map(" ".join, self.partitions)), boot_partitions="\n - " + "\n - ".join(map(" ".join, self.boot_partitions)))
+
   def __debug(self, msg):
     if self.is_test:
       print("Debug: " + msg)
       with codecs.open("bootsetup.log", "a+", "utf-8") as fdebug:
         fdebug.write("Debug: {0}\n".format(msg))
 
+  def _set_disks_and_partitions(self, disks, partitions):
+    self.disks = [d if isinstance(d, Disk) else Disk(*d) for d in disks]
+    self.partitions = [p if isinstance(p, Partition) else Partition(*p) for p in partitions]
+    self.disk_by_device = dict((d.device, d) for d in self.disks)
+    self.partition_by_device = dict((p.device, p) for p in self.partitions)
+
+  def _set_boot_partitions(self, boot_partitions):
+    self.boot_partitions = [bp if isinstance(bp, BootEntry) else BootEntry(*bp) for bp in boot_partitions]
+    self._number_labels(self.boot_partitions)
+    self.boot_partition_by_device = {}
+    for bp in self.boot_partitions:
+      self.boot_partition_by_device.setdefault(bp.device, bp)  # first entry wins, like a linear search
+
+  def _number_labels(self, boot_partitions):
+    """
+    Make the labels of boot_partitions unique, numbering them in order like os-prober does: Windows, Windows1, Windows2…
+    The numbers given by os-prober cannot be trusted: its counter is shared by the tests run concurrently,
+    and some labels come from the probe cache. So the labels only differing by their number are numbered again.
+    """
+    stems = [re.sub(r'[0-9]+$', '', bp.label) or bp.label for bp in boot_partitions]
+    stem_counts = {}
+    for stem in stems:
+      stem_counts[stem] = stem_counts.get(stem, 0) + 1
+    used = set()
+    numbers = {}
+    for (bp, stem) in zip(boot_partitions, stems):
+      label = stem if stem_counts[stem] > 1 else bp.label
+      n = numbers.get(stem, 0)
+      while label in used:
+        n += 1
+        label = "{0}{1}".format(stem, n)
+      numbers[stem] = n
+      used.add(label)
+      bp.label = label
+
+  def _get_fstype(self, device):
+    p = self.partition_by_device.get(device)
+    return p.fstype if p else ''
+
+  def _get_disk(self, disk_device):
+    di = slt.getDiskInfo(disk_device)
+    return Disk(disk_device, di['type'], "{0} ({1})".format(di['model'], di['sizeHuman']))
+
+  def _get_partition(self, partition_device):
+    pi = slt.getPartitionInfo(partition_device)
+    return Partition(partition_device, pi['fstype'], "{0} ({1})".format(pi['label'], pi['sizeHuman']))
+
+  @profiler.profiled('config.inventory')
+  def _get_disks_and_partitions(self):
+    """
+    Fill disks and partitions using the selected inventory backend.
+    libsalt is used if the sysfs backend cannot read the block devices.
+    """
+    if self.inventory_backend == 'sysfs':
+      try:
+        self._set_disks_and_partitions(*sysfs.get_inventory(self.sysfs_root))
+        return
+      except EnvironmentError as e:
+        self.__debug("sysfs inventory failed, fallback to libsalt: {0}".format(e))
+    self._get_disks_and_partitions_from_libsalt()
+
+  def _get_disks_and_partitions_from_libsalt(self):
+    """
+    Fill disks and partitions, querying every device concurrently.
+    The order is the same as the one given by libsalt.
+    """
+    disk_devices = slt.getDisks()
+    partitions_per_disk = parallel_map(slt.getPartitions, disk_devices, self.workers)
+    partition_devices = [p for partitions in partitions_per_disk for p in partitions]
+    self.__debug("Inventory of {0} disks and {1} partitions with {2} workers".format(len(disk_devices), len(partition_devices), self.workers))
+    self._set_disks_and_partitions(parallel_map(self._get_disk, disk_devices, self.workers), parallel_map(self._get_partition, partition_devices, self.workers))
+
+  def _find_path(self, paths):
+    for p in paths:
+      if os.path.exists(p):
+        return p
+    return None
+
+  @profiler.profiled('config.probe.slash')
+  def _probe_slash(self, slashDevice):
+    """
+    Return the probe lines for /, os-prober doesn't want to probe for /
+    """
+    slashFS = slt.getFsType(re.sub(r'^/dev/', '', slashDevice))
+    osProbesPath = self._find_path([os.path.join(d, 'mounted/90linux-distro') for d in self.os_probes_dirs])
+    if osProbesPath:
+      self.__debug("Root device {0} ({1})".format(slashDevice, slashFS))
+      self.__debug(osProbesPath + " " + slashDevice + " / " + slashFS)
+      slashDistro = slt.execGetOutput([osProbesPath, slashDevice, '/', slashFS])
+      if slashDistro:
+        return slashDistro
+    return []
+
+  def _run_probe(self, cmd):
+    """
+    Run an os-probes test and return (detected, output lines).
+    """
+    with profiler.phase('cmd:' + command_name(cmd)):
+      try:
+        proc = sp.Popen(cmd, stdout=sp.PIPE)
+      except OSError:
+        return (False, [])
+      output = proc.communicate()[0].decode('utf-8', 'replace')
+    return (proc.returncode == 0, [l for l in output.splitlines() if l.strip()])
+
+  def _mount_read_only(self, dev, fstype):
+    """
+    Mount dev read-only on a new temporary directory, like os-prober does, and return the mount point, or None.
+    The journal of ext3 and ext4 filesystems is not replayed, so nothing is written on the probed partitions.
+    """
+    options = 'ro,noload' if fstype in ('ext3', 'ext4') else 'ro'
+    mp = tempfile.mkdtemp(prefix='bootsetup.probe-')
+    try:
+      slt.execCall(['mount', '-o', options, dev, mp], shell=False)
+    except Exception as e:
+      self.__debug("Cannot mount {0} for probing: {1}".format(dev, e))
+    if slt.isMounted(dev):
+      return mp
+    os.rmdir(mp)
+    return None
+
+  @profiler.profiled('config.probe.partition')
+  def _probe_partition(self, device, tests):
+    """
+    Probe one partition for an operating system, like os-prober does:
+    mount it read-only (if not already mounted) and run each os-probes/mounted test, in order, until one succeeds.
+    Return the probe lines, or None if it cannot be mounted, which could be transient and must not be cached.
+    """
+    fstype = self._get_fstype(device)
+    if fstype in ('', 'swap', 'linux-swap', 'extended'):
+      return []
+    dev = os.path.join('/dev', device)
+    if slt.isMounted(dev):
+      mp = slt.getMountPoint(dev)
+      doumount = False
+    else:
+      mp = self._mount_read_only(dev, fstype)
+      doumount = True
+    if not mp:
+      return None
+    probes = []
+    try:
+      for test in tests:
+        (detected, output) = self._run_probe([test, dev, mp, fstype])
+        if detected:
+          self.__debug("{0} detected by {1}".format(dev, test))
+          probes = output
+          break
+    finally:
+      if doumount:
+        slt.umountDevice(mp)
+    return probes
+
+  def _parse_probe(self, probe):
+    """
+    Return a boot partition [device, fs type, boot type, os, label] for an os-prober line,
+    or None if the line is not a boot partition.
+    """
+    probe = unicode(probe).strip()  # ensure clean line
+    if not probe or probe[0] != '/':
+      return None
+    probe_info = probe.split(':')
+    if len(probe_info) < 4:
+      return None
+    probe_dev = re.sub(r'/dev/', '', probe_info[0])
+    probe_os = probe_info[1]
+    probe_label = probe_info[2]
+    probe_boottype = probe_info[3]
+    if probe_boottype == 'efi':  # skip efi entry
+      return None
+    probe_fstype = self._get_fstype(probe_dev)
+    return BootEntry(probe_dev, probe_fstype, probe_boottype, probe_os, probe_label)
+
+  def _publish_probes(self, probes):
+    """
+    Give each boot partition found in probes to the on_boot_partition listener, as soon as it is known.
+    This could be called from any worker thread.
+    """
+    if self.on_boot_partition:
+      for probe in probes:
+        boot_partition = self._parse_probe(probe)
+        if boot_partition:
+          with self._publish_lock:
+            self.on_boot_partition(boot_partition)
+
+  def _stream_os_prober(self, osProberPath):
+    """
+    Run os-prober and yield each line of its output as soon as it is written.
+    """
+    start = time.time()
+    proc = sp.Popen([osProberPath], stdout=sp.PIPE)
+    try:
+      for line in iter(proc.stdout.readline, b''):
+        yield line.decode('utf-8', 'replace').rstrip('\n')
+    finally:
+      proc.stdout.close()
+      proc.wait()
+      if profiler.enabled:
+        profiler.record('cmd:' + command_name(osProberPath), time.time() - start)
+
+  def _get_probe_device(self, probe):
+    return re.sub(r'^/dev/', '', unicode(probe).strip().split(':')[0])
+
+  def _probe_devices(self, devices, cache, publish=True):
+    """
+    Return the os-prober lines for the partitions in devices, in the same order.
+    Results of partitions which did not change since the last run are taken from the probe cache.
+    The other partitions are probed concurrently with the os-probes tests.
+    If the tests cannot be found, os-prober is run instead, if at least one partition is not in the cache.
+    If publish is True, the found boot partitions are given to the on_boot_partition listener.
+    """
+    if publish:
+      publish_probes = self._publish_probes
+    else:
+      publish_probes = lambda probes: None
+    probes = []
+    probesPerDevice = {}
+    if cache and not self.rescan:
+      for d in devices:
+        cached = cache.get(d)
+        if cached is not None:
+          probesPerDevice[d] = cached
+          publish_probes(cached)
+      self.__debug("Probe cache hits: " + unicode(sorted(probesPerDevice.keys())))
+    extraProbes = []
+    missingDevices = [d for d in devices if d not in probesPerDevice]
+    if missingDevices:
+      osProbesDir = self._find_path(self.os_probes_dirs)
+      osProberPath = self._find_path(self.os_prober_paths)
+      if osProbesDir and os.path.isdir(os.path.join(osProbesDir, 'mounted')):
+        testsDir = os.path.join(osProbesDir, 'mounted')
+        tests = [t for t in sorted(glob.glob(os.path.join(testsDir, '*'))) if os.path.isfile(t) and os.access(t, os.X_OK)]
+        self.__debug("Probing {0} partitions with {1} workers".format(len(missingDevices), self.workers))
+
+        def probe_and_publish(d):
+          deviceProbes = self._probe_partition(d, tests)
+          publish_probes(deviceProbes or [])
+          return deviceProbes
+        for (d, deviceProbes) in zip(missingDevices, parallel_map(probe_and_publish, missingDevices, self.workers)):
+          probesPerDevice[d] = deviceProbes or []
+          if cache and deviceProbes is not None:
+            cache.set(d, deviceProbes)
+      elif osProberPath:
+        newProbesPerDevice = dict((d, []) for d in missingDevices)
+        for probe in self._stream_os_prober(osProberPath):
+          d = self._get_probe_device(probe)
+          if d in newProbesPerDevice:
+            newProbesPerDevice[d].append(probe)
+          elif d not in self.partition_by_device:
+            extraProbes.append(probe)
+          else:
+            continue  # already known from the cache
+          publish_probes([probe])
+        for d in missingDevices:
+          probesPerDevice[d] = newProbesPerDevice[d]
+          if cache:
+            cache.set(d, newProbesPerDevice[d])
+    for d in devices:
+      probes.extend(probesPerDevice.get(d, []))
+    probes.extend(extraProbes)
+    return probes
+
+  @profiler.profiled('config.probe')
+  def _probe_os(self):
+    """
+    Return the os-prober lines for / and every partition.
+    """
+    cache = None
+    if self.probe_cache_dir:
+      cache = ProbeCache(self.probe_cache_dir)
+    try:
+      os.remove("/var/lib/os-prober/labels")  # ensure there is no previous labels
+    except:
+      pass
+    probes = []
+    slashDevice = None
+    if not self.is_live:
+      slashDevice = slt.execGetOutput(r"readlink -f $(df / | tail -n 1 | cut -d' ' -f1)")[0]
+      slashProbes = None
+      if cache and not self.rescan:
+        slashProbes = cache.get(re.sub(r'^/dev/', '', slashDevice))
+      if slashProbes is None:
+        slashProbes = self._probe_slash(slashDevice)
+        if cache:
+          cache.set(re.sub(r'^/dev/', '', slashDevice), slashProbes)
+      else:
+        self.__debug("Probe cache hit for " + slashDevice)
+      self._publish_probes(slashProbes)
+      probes.extend(slashProbes)
+      slashDevice = re.sub(r'^/dev/', '', slashDevice)
+    devices = [p.device for p in self.partitions if p.device != slashDevice]
+    probes.extend(self._probe_devices(devices, cache))
+    if cache:
+      cache.save()
+    return probes
+
+  def _get_new_disks_and_partitions(self, added):
+    """
+    Return (disks, partitions) lists after block devices in added appeared, and the new disks and partitions.
+    With libsalt, only the new disks and the disks of the new partitions are queried.
+    """
+    if self.inventory_backend == 'sysfs':
+      try:
+        (disks, partitions) = sysfs.get_inventory(self.sysfs_root)
+        disks = [self.disk_by_device.get(d[0]) or Disk(*d) for d in disks]
+        partitions = [self.partition_by_device.get(p[0]) or Partition(*p) for p in partitions]
+        return (disks, partitions, [d for d in disks if d.device not in self.disk_by_device], [p for p in partitions if p.device not in self.partition_by_device])
+      except EnvironmentError as e:
+        self.__debug("sysfs inventory failed, fallback to libsalt: {0}".format(e))
+    diskDevices = slt.getDisks()
+    newDiskDevices = [d for d in diskDevices if d not in self.disk_by_device]
+    affectedDisks = list(newDiskDevices)
+    for device in added:
+      parents = [d for d in diskDevices if device != d and device.startswith(d)]
+      if parents:
+        parent = max(parents, key=len)
+        if parent not in affectedDisks:
+          affectedDisks.append(parent)
+    partitionsPerDisk = parallel_map(slt.getPartitions, affectedDisks, self.workers)
+    newPartitionDevices = [p for partitions in partitionsPerDisk for p in partitions if p not in self.partition_by_device]
+    newDisks = parallel_map(self._get_disk, newDiskDevices, self.workers)
+    newPartitions = parallel_map(self._get_partition, newPartitionDevices, self.workers)
+    return (self.disks + newDisks, self.partitions + newPartitions, newDisks, newPartitions)
+
+  @profiler.profiled('config.refresh')
+  def refresh(self, added, removed):
+    """
+    Update the configuration after the block devices in added and removed (names like sdb1) appeared or disappeared.
+    Only the new partitions are probed.
+    Return (new disks, new partitions, new boot partitions, names of the removed known devices).
+    """
+    if self.use_test_data:
+      return ([], [], [], set())
+    self.__debug("Refresh, added: {0}, removed: {1}".format(sorted(added), sorted(removed)))
+    knownDevices = set(self.disk_by_device) | set(self.partition_by_device)
+    (disks, partitions, newDisks, newPartitions) = self._get_new_disks_and_partitions(added)
+    currentDevices = set(d.device for d in disks) | set(p.device for p in partitions)
+    goneDevices = (set(removed) & knownDevices) | (knownDevices - currentDevices)
+    self._set_disks_and_partitions([d for d in disks if d.device not in goneDevices], [p for p in partitions if p.device not in goneDevices])
+    cache = None
+    if self.probe_cache_dir:
+      cache = ProbeCache(self.probe_cache_dir)
+    probes = self._probe_devices([p.device for p in newPartitions], cache, publish=False)
+    if cache:
+      cache.save()
+    newBootPartitions = [bp for bp in map(self._parse_probe, probes) if bp]
+    self._set_boot_partitions([bp for bp in self.boot_partitions if bp.device not in goneDevices] + newBootPartitions)
+    if self.cur_mbr_device in goneDevices:
+      self.cur_mbr_device = self.disks[0].device if self.disks else ''
+    return (newDisks, newPartitions, newBootPartitions, goneDevices)
+
+  @profiler.profiled('config.gather')
   def _get_current_config(self):
-    print('Gathering current configuration…', end='')
-    if self.is_test:
-      print('')
-    sys.stdout.flush()
+    if not self.quiet:
+      print('Gathering current configuration…', end='')
+      if self.is_test:
+        print('')
+      sys.stdout.flush()
     if self.is_test:
       self.is_live = False
     else:
       self.is_live = slt.isSaLTLiveEnv()
     if self.use_test_data:
-      self.disks = [
+      self._set_disks_and_partitions([
         ['sda', 'msdos', 'WDC100 (100GB)'],
         ['sdb', 'gpt', 'SGT350 (350GB)']
-      ]
-      self.partitions = [
+      ], [
         ['sda1', 'ntfs', 'WinVista (20GB)'],
         ['sda5', 'ext2', 'Salix (80GB)'],
         ['sdb1', 'fat32', 'Data (300GB)'],
         ['sdb2', 'ext4', 'Debian (50GB)']
-      ]
-      self.boot_partitions = [
+      ])
+      self._set_boot_partitions([
         ['sda5', 'ext2', 'linux', 'Salix', 'Salix 14.0'],
         ['sda1', 'ntfs', 'chain', 'Windows', 'Vista'],
         ['sdb2', 'ext4', 'linux', 'Debian', 'Debian 7']
-      ]
+      ])
+      if self.on_boot_partition:
+        for boot_partition in self.boot_partitions:
+          self.on_boot_partition(boot_partition)
       if not self.cur_boot_partition:
         self.cut_boot_partition = 'sda5'
     else:
-      self.disks = []
-      self.partitions = []
-      for disk_device in slt.getDisks():
-        di = slt.getDiskInfo(disk_device)
-        self.disks.append([disk_device, di['type'], "{0} ({1})".format(di['model'], di['sizeHuman'])])
-        for p in slt.getPartitions(disk_device):
-          pi = slt.getPartitionInfo(p)
-          self.partitions.append([p, pi['fstype'], "{0} ({1})".format(pi['label'], pi['sizeHuman'])])
-      self.boot_partitions = []
-      probes = []
-      if not self.is_live:
-        # os-prober doesn't want to probe for /
-        slashDevice = slt.execGetOutput(r"readlink -f $(df / | tail -n 1 | cut -d' ' -f1)")[0]
-        slashFS = slt.getFsType(re.sub(r'^/dev/', '', slashDevice))
-        osProbesPath = None
-        for p in ("/usr/lib64/os-probes/mounted/90linux-distro", "/usr/lib/os-probes/mounted/90linux-distro"):
-          if os.path.exists(p):
-            osProbesPath = p
-            break
-        if osProbesPath:
-          try:
-            os.remove("/var/lib/os-prober/labels")  # ensure there is no previous labels
-          except:
-            pass
-          self.__debug("Root device {0} ({1})".format(slashDevice, slashFS))
-          self.__debug(osProbesPath + " " + slashDevice + " / " + slashFS)
-          slashDistro = slt.execGetOutput([osProbesPath, slashDevice, '/', slashFS])
-          if slashDistro:
-            probes = slashDistro
+      self._get_disks_and_partitions()
+      probes = self._probe_os()
       self.__debug("Probes: " + unicode(probes))
-      osProberPath = None
-      for p in ('/usr/bin/os-prober', '/usr/sbin/os-prober'):
-        if os.path.exists(p):
-          osProberPath = p
-          break
-      if osProberPath:
-        probes.extend(slt.execGetOutput(osProberPath, shell=False))
-      self.__debug("Probes: " + unicode(probes))
-      for probe in probes:
-        probe = unicode(probe).strip()  # ensure clean line
-        if probe[0] != '/':
-          continue
-        probe_info = probe.split(':')
-        probe_dev = re.sub(r'/dev/', '', probe_info[0])
-        probe_os = probe_info[1]
-        probe_label = probe_info[2]
-        probe_boottype = probe_info[3]
-        if probe_boottype == 'efi':  # skip efi entry
-          continue
-        try:
-          probe_fstype = [p[1] for p in self.partitions if p[0] == probe_dev][0]
-        except IndexError:
-          probe_fstype = ''
-        self.boot_partitions.append([probe_dev, probe_fstype, probe_boottype, probe_os, probe_label])
+      self._set_boot_partitions([bp for bp in map(self._parse_probe, probes) if bp])
     if self.cur_boot_partition:
       # use the disk of that partition.
       self.cur_mbr_device = re.sub(r'^(.+?)[0-9]*$', r'\1', self.cur_boot_partition)
     elif len(self.disks) > 0:
       # use the first disk.
-      self.cur_mbr_device = self.disks[0][0]
-    print(' Done')
-    sys.stdout.flush()
+      self.cur_mbr_device = self.disks[0].device
+    if not self.quiet:
+      print(' Done')
+      sys.stdout.flush()
@@ -0,0 +1,299 @@
+#!/usr/bin/env python
+# coding: utf-8
+# vim:et:sta:sts=2:sw=2:ts=2:tw=0:
+"""
+Read-only ext2/3/4 reader, to list the content of /boot without mounting the partition.
+Only what is needed to walk directories and read small files is supported:
+a filesystem with features it does not know, or a journal to replay, is refused and should be mounted instead.
+"""
+from __future__ import unicode_literals, print_function, division, absolute_import
+
+import os
+import io
+import mmap
+import struct
+
+SUPERBLOCK_OFFSET = 1024
+EXT_MAGIC = 0xEF53
+ROOT_INODE = 2
+EXTENT_MAGIC = 0xF30A
+
+INCOMPAT_FILETYPE = 0x2
+INCOMPAT_RECOVER = 0x4
+INCOMPAT_EXTENTS = 0x40
+INCOMPAT_64BIT = 0x80
+INCOMPAT_MMP = 0x100
+INCOMPAT_FLEX_BG = 0x200
+INCOMPAT_EA_INODE = 0x400
+INCOMPAT_CSUM_SEED = 0x2000
+INCOMPAT_LARGEDIR = 0x4000
+INCOMPAT_INLINE_DATA = 0x8000
+_supportedIncompat = INCOMPAT_FILETYPE | INCOMPAT_EXTENTS | INCOMPAT_64BIT | INCOMPAT_MMP | INCOMPAT_FLEX_BG | INCOMPAT_EA_INODE | INCOMPAT_CSUM_SEED | INCOMPAT_LARGEDIR | INCOMPAT_INLINE_DATA
+
+INODE_FLAG_EXTENTS = 0x80000
+INODE_FLAG_INLINE_DATA = 0x10000000
+
+S_IFMT = 0xF000
+S_IFDIR = 0x4000
+S_IFREG = 0x8000
+S_IFLNK = 0xA000
+
+FILE = 'file'
+DIRECTORY = 'dir'
+SYMLINK = 'symlink'
+OTHER = 'other'
+_direntTypes = {1: FILE, 2: DIRECTORY, 7: SYMLINK}
+_modeTypes = {S_IFREG: FILE, S_IFDIR: DIRECTORY, S_IFLNK: SYMLINK}
+_deviceSpecDirs = {'UUID': '/dev/disk/by-uuid', 'LABEL': '/dev/disk/by-label', 'PARTUUID': '/dev/disk/by-partuuid'}
+
+
+class ExtFs:
+  """
+  An ext2/3/4 filesystem on a block device or an image file, opened read-only.
+  ValueError is raised if it is not an ext filesystem or if it uses unsupported features,
+  EnvironmentError if it cannot be read.
+  """
+  path = None
+  block_size = None
+  _file = None
+  _map = None
+  _inodeSize = None
+  _inodesPerGroup = None
+  _descSize = None
+  _firstDescBlock = None
+  _hasFileType = False
+
+  def __init__(self, path):
+    self.path = path
+    self._file = io.open(path, 'rb')
+    try:
+      self._file.seek(0, os.SEEK_END)
+      size = self._file.tell()
+      try:
+        self._map = mmap.mmap(self._file.fileno(), size, access=mmap.ACCESS_READ)
+      except (EnvironmentError, ValueError, OverflowError):
+        self._map = None  # too big for the address space, read it instead
+      self._read_superblock()
+    except:
+      self.close()
+      raise
+
+  def __enter__(self):
+    return self
+
+  def __exit__(self, excType, excValue, traceback):
+    self.close()
+
+  def close(self):
+    if self._map:
+      self._map.close()
+      self._map = None
+    if self._file:
+      self._file.close()
+      self._file = None
+
+  def _read(self, offset, length):
+    if self._map:
+      data = self._map[offset:offset + length]
+    else:
+      self._file.seek(offset)
+      data = self._file.read(length)
+    if len(data) != length:
+      raise ValueError("{0}: unexpected end of device".format(self.path))
+    return data
+
+  def _read_superblock(self):
+    sb = self._read(SUPERBLOCK_OFFSET, 1024)
+    (magic,) = struct.unpack_from('<H', sb, 0x38)
+    if magic != EXT_MAGIC:
+      raise ValueError("{0}: not an ext filesystem".format(self.path))
+    (firstDataBlock, logBlockSize) = struct.unpack_from('<II', sb, 0x14)
+    (inodesPerGroup,) = struct.unpack_from('<I', sb, 0x28)
+    (revLevel,) = struct.unpack_from('<I', sb, 0x4C)
+    (inodeSize,) = struct.unpack_from('<H', sb, 0x58)
+    (incompat,) = struct.unpack_from('<I', sb, 0x60)
+    (descSize,) = struct.unpack_from('<H', sb, 0xFE)
+    if incompat & INCOMPAT_RECOVER:
+      raise ValueError("{0}: the journal needs to be replayed".format(self.path))
+    if incompat & ~_supportedIncompat:
+      raise ValueError("{0}: unsupported features {1:#x}".format(self.path, incompat & ~_supportedIncompat))
+    self.block_size = 1024 << logBlockSize
+    self._inodesPerGroup = inodesPerGroup
+    self._inodeSize = inodeSize if revLevel >= 1 else 128
+    self._descSize = descSize if incompat & INCOMPAT_64BIT and descSize >= 64 else 32
+    self._firstDescBlock = firstDataBlock + 1
+    self._hasFileType = bool(incompat & INCOMPAT_FILETYPE)
+    if not self._inodesPerGroup or self._inodeSize < 128:
+      raise ValueError("{0}: invalid superblock".format(self.path))
+
+  def _read_inode(self, number):
+    """
+    Return (mode, size, flags, i_block) of the inode.
+    """
+    (group, index) = divmod(number - 1, self._inodesPerGroup)
+    desc = self._read(self._firstDescBlock * self.block_size + group * self._descSize, self._descSize)
+    (table,) = struct.unpack_from('<I', desc, 0x8)
+    if self._descSize >= 64:
+      (tableHigh,) = struct.unpack_from('<I', desc, 0x28)
+      table |= tableHigh << 32
+    inode = self._read(table * self.block_size + index * self._inodeSize, 128)
+    (mode, sizeLow) = struct.unpack_from('<HxxI', inode, 0)
+    (flags,) = struct.unpack_from('<I', inode, 0x20)
+    (sizeHigh,) = struct.unpack_from('<I', inode, 0x6C)
+    return (mode, sizeLow | sizeHigh << 32, flags, inode[0x28:0x28 + 60])
+
+  def _extent_blocks(self, node):
+    """
+    Yield (logical block, physical block, length) of the extent tree node.
+    """
+    (magic, entries, maxEntries, depth) = struct.unpack_from('<HHHH', node, 0)
+    if magic != EXTENT_MAGIC:
+      raise ValueError("{0}: corrupted extent tree".format(self.path))
+    for n in range(entries):
+      offset = 12 + n * 12
+      if depth == 0:
+        (logical, length, startHigh, startLow) = struct.unpack_from('<IHHI', node, offset)
+        if length > 32768:  # uninitialized extent, reads as zeros
+          continue
+        yield (logical, startHigh << 32 | startLow, length)
+      else:
+        (logical, leafLow, leafHigh) = struct.unpack_from('<IIH', node, offset)
+        for extent in self._extent_blocks(self._read((leafHigh << 32 | leafLow) * self.block_size, self.block_size)):
+          yield extent
+
+  def _indirect_blocks(self, block, level):
+    if not block:
+      return
+    if level == 0:
+      yield block
+      return
+    pointers = struct.unpack('<{0}I'.format(self.block_size // 4), self._read(block * self.block_size, self.block_size))
+    for pointer in pointers:
+      for b in self._indirect_blocks(pointer, level - 1):
+        yield b
+
+  def _read_data(self, number):
+    """
+    Return (mode, content) of the inode. Holes are not supported, they are skipped.
+    """
+    (mode, size, flags, iblock) = self._read_inode(number)
+    if flags & INODE_FLAG_INLINE_DATA:
+      if mode & S_IFMT == S_IFREG and size <= len(iblock):
+        return (mode, iblock[:size])
+      raise ValueError("{0}: inline data is not supported".format(self.path))
+    count = -(-size // self.block_size)
+    chunks = []
+    if flags & INODE_FLAG_EXTENTS:
+      for (logical, physical, length) in sorted(self._extent_blocks(iblock)):
+        if logical < count:
+          length = min(length, count - logical)
+          chunks.append(self._read(physical * self.block_size, length * self.block_size))
+    else:
+      pointers = struct.unpack('<15I', iblock)
+      blocks = [b for b in pointers[:12] if b]
+      for (level, pointer) in enumerate(pointers[12:], 1):
+        if len(blocks) >= count:
+          break
+        blocks.extend(self._indirect_blocks(pointer, level))
+      chunks = [self._read(b * self.block_size, self.block_size) for b in blocks[:count]]
+    return (mode, b''.join(chunks)[:size])
+
+  def read_dir(self, number):
+    """
+    Return the list of (name, inode number, type) of the directory inode, without . and ..
+    """
+    (mode, data) = self._read_data(number)
+    if mode & S_IFMT != S_IFDIR:
+      raise ValueError("{0}: inode {1} is not a directory".format(self.path, number))
+    entries = []
+    offset = 0
+    while offset + 8 <= len(data):
+      if self._hasFileType:
+        (inode, recLen, nameLen, fileType) = struct.unpack_from('<IHBB', data, offset)
+      else:
+        (inode, recLen, nameLen) = struct.unpack_from('<IHH', data, offset)
+        fileType = 0
+      if recLen < 8:
+        raise ValueError("{0}: corrupted directory".format(self.path))
+      if inode:
+        name = data[offset + 8:offset + 8 + nameLen].decode('utf-8', 'replace')
+        if name not in ('.', '..'):
+          entryType = _direntTypes.get(fileType)
+          if not entryType:
+            entryType = _modeTypes.get(self._read_inode(inode)[0] & S_IFMT, OTHER)
+          entries.append((name, inode, entryType))
+      offset += recLen
+    return entries
+
+  def lookup(self, path):
+    """
+    Return (inode number, type) of path, symbolic links are not followed.
+    """
+    number = ROOT_INODE
+    entryType = DIRECTORY
+    for part in [p for p in path.split('/') if p]:
+      if entryType != DIRECTORY:
+        raise ValueError("{0}: {1} is not a directory".format(self.path, path))
+      for (name, inode, t) in self.read_dir(number):
+        if name == part:
+          (number, entryType) = (inode, t)
+          break
+      else:
+        raise EnvironmentError("{0}: {1} not found".format(self.path, path))
+    return (number, entryType)
+
+  def list_dir(self, path):
+    """
+    Return the list of (name, type) in the directory path. type is one of FILE, DIRECTORY, SYMLINK or OTHER.
+    """
+    (number, entryType) = self.lookup(path)
+    if entryType != DIRECTORY:
+      raise ValueError("{0}: {1} is not a directory".format(self.path, path))
+    return [(name, t) for (name, inode, t) in self.read_dir(number)]
+
+  def read_file(self, path):
+    (number, entryType) = self.lookup(path)
+    if entryType != FILE:
+      raise ValueError("{0}: {1} is not a regular file".format(self.path, path))
+    return self._read_data(number)[1]
+
+
+def find_boot_entry(lines):
+  """
+  Return (device, fs type) of the /boot entry in the fstab lines, or (None, None) if there is none.
+  """
+  for line in lines:
+    fields = line.split()
+    if len(fields) >= 3 and not fields[0].startswith('#') and fields[1].rstrip('/') == '/boot':
+      return (fields[0], fields[2])
+  return (None, None)
+
+
+def resolve_device(spec):
+  """
+  Return the device path of a fstab device specification, like UUID=… or /dev/sda1.
+  """
+  if '=' in spec:
+    (kind, value) = spec.split('=', 1)
+    if kind in _deviceSpecDirs:
+      return os.path.realpath(os.path.join(_deviceSpecDirs[kind], value.strip('"')))
+  return spec
+
+
+def list_boot(device):
+  """
+  Return (boot device, entries) for the ext filesystem on device, without mounting it.
+  entries is the list of (name, type) in its /boot.
+  If /boot is a separate partition in etc/fstab, boot device is its path and its root is listed instead, else boot device is None.
+  """
+  with ExtFs(device) as fs:
+    try:
+      fstab = fs.read_file('etc/fstab').decode('utf-8', 'replace')
+    except EnvironmentError:
+      fstab = ''
+    (bootSpec, bootType) = find_boot_entry(fstab.splitlines())
+    if not bootSpec:
+      return (None, fs.list_dir('boot'))
+  bootDevice = resolve_device(bootSpec)
+  with ExtFs(bootDevice) as fs:
+    return (bootDevice, fs.list_dir('/'))
@@ -13,10 +13,18 @@ import gettext  # noqa
 import urwidm
 import re
 import os
+import threading
+try:
+  import Queue
+except ImportError:
+  import queue as Queue
 import libsalt as slt
-from .config import Config
+from .config import Config, Record
+from .hotplug import DeviceWatcher
+from .mountpool import pool
 from .lilo import Lilo
-from .grub2 import Grub2
+from .liloconf import MAX_LABEL_LENGTH
+from .grub2 import Grub2, getCapabilities, invalidateCapabilities
 
 
 class GatherCurses:
@@ -59,37 +67,130 @@ class GatherCurses:
   _editing = False
   _custom_lilo = False
   _grub2_cfg = False
-  _liloMaxChars = 15
+  _liloMaxChars = MAX_LABEL_LENGTH
+  _liloTable = None
+  _liloDevPositions = {}
+  _gathering = False
+  _watcher = None
+  _gatheringSpinner = '|/-\\'
+  _gatheringStep = 0
   _editors = ['vim', 'nano']
 
   def __init__(self, bootsetup, bootloader=None, target_partition=None, is_test=False, use_test_data=False):
     self._bootsetup = bootsetup
-    self.cfg = Config(bootloader, target_partition, is_test, use_test_data)
-    print("""
-bootloader         = {bootloader}
-target partition   = {partition}
-MBR device         = {mbr}
-disks:{disks}
-partitions:{partitions}
-boot partitions:{boot_partitions}
-""".format(bootloader=self.cfg.cur_bootloader, partition=self.cfg.cur_boot_partition, mbr=self.cfg.cur_mbr_device, disks="\n - " + "\n - ".join(map(" ".join, self.cfg.disks)), partitions="\n - " + "\n - ".join(map(" ".join, self.cfg.partitions)), boot_partitions="\n - " + "\n - ".join(map(" ".join, self.cfg.boot_partitions))))
+    self.cfg = Config(bootloader, target_partition, is_test, use_test_data, on_boot_partition=self._onBootPartitionFound, gather=False)
+    self.cfg.quiet = True  # the configuration is gathered while the screen is shown
+    self._foundBootPartitions = []
+    self._uiQueue = Queue.Queue()
     self.ui = urwidm.raw_display.Screen()
     self.ui.set_mouse_tracking()
     self._palette.extend(bootsetup._palette)
 
   def run(self):
+    self._gathering = True
     self._createMainView()
     self._createHelpView()
     self._createAboutView()
     self._changeBootloaderSection()
     self._loop = urwidm.MainLoop(self._mainView, self._palette, handle_mouse=True, unhandled_input=self._handleKeys, pop_ups=True)
+    if self.cfg.cur_bootloader == 'lilo':
+      # show the LiLo table right away, it is filled while the boot partitions are found
+      self._radioLiLo.set_state(True)
+    self._uiPipe = self._loop.watch_pipe(self._onUiPipe)
+    self._loop.set_alarm_in(0.2, self._updateGatheringProgress)
+    gatherThread = threading.Thread(target=self._gatherConfig)
+    gatherThread.daemon = True
+    gatherThread.start()
+    self._loop.run()
+    print(self.cfg.summary())
+
+  def _updateUiAsync(self, fct, *args):
+    """
+    Call fct(*args) in the urwid main loop. Could be called from any thread.
+    """
+    self._uiQueue.put((fct, args))
+    os.write(self._uiPipe, b'.')
+
+  def _onUiPipe(self, data):
+    while not self._uiQueue.empty():
+      (fct, args) = self._uiQueue.get()
+      fct(*args)
+    self._updateScreen()
+    return True
+
+  def _gatherConfig(self):
+    """
+    Run in a worker thread, the UI is updated in the urwid main loop.
+    """
+    try:
+      self.cfg.gather()
+      self._updateUiAsync(self._onConfigGathered)
+    except Exception as e:
+      self._updateUiAsync(self._onConfigError, e)
+
+  def _onBootPartitionFound(self, p):
+    self._updateUiAsync(self._addFoundBootPartition, p)
+
+  def _addFoundBootPartition(self, p):
+    if self._gathering:
+      self._foundBootPartitions.append(p)
+      self._addLiLoTableLine(p)
+
+  def _updateGatheringProgress(self, loop, data=None):
+    if self._gathering:
+      self._gatheringStep = (self._gatheringStep + 1) % len(self._gatheringSpinner)
+      self._txtProgress.set_text(('strong', "{0} {1}".format(_("Gathering current configuration…"), self._gatheringSpinner[self._gatheringStep])))
+      loop.set_alarm_in(0.2, self._updateGatheringProgress)
+
+  def _onConfigGathered(self):
+    """
+    Rebuild the main view with the gathered configuration.
+    """
+    self._gathering = False
+    self._createMainView()
+    self._changeBootloaderSection()
+    if self._mode == 'main':
+      self._loop.widget = self._mainView
     if self.cfg.cur_bootloader == 'lilo':
       self._radioLiLo.set_state(True)
       self._mainView.body.set_focus(self._mbrDeviceSectionPosition)
     elif self.cfg.cur_bootloader == 'grub2':
       self._radioGrub2.set_state(True)
       self._mainView.body.set_focus(self._mbrDeviceSectionPosition)
-    self._loop.run()
+    if self.cfg.hotplug:
+      self._watcher = DeviceWatcher(self._onDevicesChanged)
+      self._watcher.start()
+
+  def _onDevicesChanged(self, added, removed):
+    """
+    Called by the device watcher thread.
+    """
+    try:
+      changes = self.cfg.refresh(added, removed)
+      self._updateUiAsync(self._applyDevicesChanges, *changes)
+    except Exception as e:
+      self._updateUiAsync(self._errorDialog, _("Cannot refresh the configuration:\n{0}").format(e))
+
+  def _applyDevicesChanges(self, newDisks, newPartitions, newBootPartitions, removedDevices):
+    """
+    Update the views in place: the MBR device list, the LiLo table or the Grub2 partition list.
+    """
+    for device in removedDevices:
+      invalidateCapabilities(os.path.join("/dev", device))
+    if newDisks or removedDevices:
+      self._mainView.body.body[self._mbrDeviceSectionPosition] = self._createMbrDeviceSectionView()
+    if self.cfg.cur_bootloader == 'lilo':
+      for device in removedDevices:
+        self._removeLiLoTableLine(device)
+      for p in newBootPartitions:
+        self._addLiLoTableLine(p)
+    elif self.cfg.cur_bootloader == 'grub2' and (newPartitions or removedDevices):
+      self._changeBootloaderSection()
+
+  def _onConfigError(self, error):
+    self._gathering = False
+    self._errorDialog(_("Cannot gather the current configuration:\n{0}").format(error))
+    self.main_quit()
 
   def _infoDialog(self, message):
     self._bootsetup.info_dialog(message, parent=self._loop.widget)
@@ -114,14 +215,14 @@ boot partitions:{boot_partitions}
     urwidm.connect_signal(widget, 'focuslost', self._onHelpFocusLost)
 
   def _createComboBox(self, label, elements):
-    l = [urwidm.TextMultiValues(el) if isinstance(el, list) else el for el in elements]
+    l = [urwidm.TextMultiValues(list(el)) if isinstance(el, (list, Record)) else el for el in elements]
     comboBox = urwidm.ComboBox(label, l)
     comboBox.set_combo_attrs('combobody', 'combofocus')
     comboBox.cbox.sensitive_attr = ('focusable', 'focus_combo')
     return comboBox
 
   def _createComboBoxEdit(self, label, elements):
-    l = [urwidm.TextMultiValues(el) if isinstance(el, list) else el for el in elements]
+    l = [urwidm.TextMultiValues(list(el)) if isinstance(el, (list, Record)) else el for el in elements]
     comboBox = urwidm.ComboBoxEdit(label, l)
     comboBox.set_combo_attrs('combobody', 'combofocus')
     comboBox.cbox.sensitive_attr = ('focusable', 'focus_edit')
@@ -168,7 +269,8 @@ boot partitions:{boot_partitions}
     """
     # header
     txtTitle = urwidm.Text(_("BootSetup curses, version {ver}").format(ver=__version__), align="center")
-    header = urwidm.PileMore([urwidm.Divider(), txtTitle, urwidm.Text('─' * (len(txtTitle.text) + 2), align="center")])
+    self._txtProgress = urwidm.Text(('strong', _("Gathering current configuration…")) if self._gathering else "", align="center")
+    header = urwidm.PileMore([urwidm.Divider(), txtTitle, urwidm.Text('─' * (len(txtTitle.text) + 2), align="center"), self._txtProgress])
     header.attr = 'header'
     # footer
     keys = [
@@ -193,6 +295,8 @@ a boot menu if several operating systems are available on the same computer.")
     radioGroupBootloader = []
     self._radioLiLo = self._createRadioButton(radioGroupBootloader, "LiLo", state=False, on_state_change=self._onLiLoChange)
     self._radioGrub2 = self._createRadioButton(radioGroupBootloader, "Grub2", state=False, on_state_change=self._onGrub2Change)
+    self._radioLiLo.sensitive = not self._gathering
+    self._radioGrub2.sensitive = not self._gathering
     bootloaderTypeSection = urwidm.ColumnsMore([lblBootloader, self._radioLiLo, self._radioGrub2], focus_column=1)
     self._installHelpContext(bootloaderTypeSection, 'type')
     # mbr device section
@@ -278,26 +382,11 @@ a boot menu if several operating systems are available on the same computer.")
       for l in (listDev, listFS, listType, listLabel, listActionUp, listActionDown):
         l[0].sensitive_attr = 'strong'
       self._labelPerDevice = {}
-      for p in self.cfg.boot_partitions:
-        dev = p[0]
-        fs = p[1]
-        ostype = p[3]
-        label = re.sub(r'[()]', '', re.sub(r'_\(loader\)', '', re.sub(' ', '_', p[4])))  # lilo does not like spaces and pretty print the label
-        listDev.append(urwidm.TextMore(dev))
-        listFS.append(urwidm.TextMore(fs))
-        listType.append(urwidm.TextMore(ostype))
-        self._labelPerDevice[dev] = label
-        editLabel = self._createEdit(edit_text=label, wrap=urwidm.CLIP)
-        urwidm.connect_signal(editLabel, 'change', self._onLabelChange, dev)
-        urwidm.connect_signal(editLabel, 'focusgain', self._onHelpFocusGain, 'lilotable')
-        urwidm.connect_signal(editLabel, 'focuslost', self._onLabelFocusLost, dev)
-        listLabel.append(editLabel)
-        btnUp = self._createButton("↑", on_press=self._moveLineUp, user_data=p[0])
-        self._installHelpContext(btnUp, 'liloup')
-        listActionUp.append(btnUp)
-        btnDown = self._createButton("↓", on_press=self._moveLineDown, user_data=p[0])
-        self._installHelpContext(btnDown, 'lilodown')
-        listActionDown.append(btnDown)
+      self._liloDevPositions = {}
+      for p in self._foundBootPartitions if self._gathering else self.cfg.boot_partitions:
+        self._liloDevPositions[p[0]] = len(listDev)
+        for (l, w) in zip((listDev, listFS, listType, listLabel, listActionUp, listActionDown), self._createLiLoTableLine(p)):
+          l.append(w)
       colDev = urwidm.PileMore(listDev)
       colFS = urwidm.PileMore(listFS)
       colType = urwidm.PileMore(listType)
@@ -331,6 +420,50 @@ a boot menu if several operating systems are available on the same computer.")
     else:
       return urwidm.Text("")
 
+  def _createLiLoTableLine(self, p):
+    """
+    Return the widgets of a LiLo table line for the boot partition p: dev, fs, type, label, up button, down button.
+    """
+    dev = p[0]
+    fs = p[1]
+    ostype = p[3]
+    label = re.sub(r'[()]', '', re.sub(r'_\(loader\)', '', re.sub(' ', '_', p[4])))  # lilo does not like spaces and pretty print the label
+    self._labelPerDevice[dev] = label
+    editLabel = self._createEdit(edit_text=label, wrap=urwidm.CLIP)
+    urwidm.connect_signal(editLabel, 'change', self._onLabelChange, dev)
+    urwidm.connect_signal(editLabel, 'focusgain', self._onHelpFocusGain, 'lilotable')
+    urwidm.connect_signal(editLabel, 'focuslost', self._onLabelFocusLost, dev)
+    btnUp = self._createButton("↑", on_press=self._moveLineUp, user_data=p[0])
+    self._installHelpContext(btnUp, 'liloup')
+    btnDown = self._createButton("↓", on_press=self._moveLineDown, user_data=p[0])
+    self._installHelpContext(btnDown, 'lilodown')
+    return (urwidm.TextMore(dev), urwidm.TextMore(fs), urwidm.TextMore(ostype), editLabel, btnUp, btnDown)
+
+  def _addLiLoTableLine(self, p):
+    """
+    Add a boot partition at the end of the LiLo table, if the table is shown.
+    """
+    if self.cfg.cur_bootloader == 'lilo' and self._liloTable:
+      self._liloDevPositions[p[0]] = len(self._liloTable.widget_list[0].widget_list)
+      for ((col, types), w) in zip(self._liloTable.contents, self._createLiLoTableLine(p)):
+        col.widget_list.append(w)
+      self._updateLiLoButtons()
+
+  def _removeLiLoTableLine(self, device):
+    """
+    Remove the line of device from the LiLo table, if present.
+    """
+    pos = self._findDevPosition(device)
+    if pos is None:
+      return
+    for col, types in self._liloTable.contents:
+      del col.widget_list[pos]
+    del self._liloDevPositions[device]
+    self._labelPerDevice.pop(device, None)
+    for (d, p) in self._liloDevPositions.items():
+      if p > pos:
+        self._liloDevPositions[d] = p - 1
+
   def _onLiloColumnFocusLost(self, widget, columnWidgets):
     pos = widget.get_focus_pos()
     for cw in columnWidgets:
@@ -481,29 +614,27 @@ click on this button to install your bootloader.")
     return not self._showLabelError(self._isLabelValid(editLabel.edit_text), editLabel)
 
   def _findDevPosition(self, device):
+    return self._liloDevPositions.get(device)
+
+  def _swapLines(self, pos, otherPos):
     colDevice = self._liloTable.widget_list[0]
-    for i, line in enumerate(colDevice.widget_list):
-      if i == 0:  # skip header
-        continue
-      if line.text == device:
-        return i
-    return None
+    (device, otherDevice) = (colDevice.widget_list[pos].text, colDevice.widget_list[otherPos].text)
+    for col, types in self._liloTable.contents:
+      old = col.widget_list[pos]
+      del col.widget_list[pos]
+      col.widget_list.insert(otherPos, old)
+    self._liloDevPositions[device] = otherPos
+    self._liloDevPositions[otherDevice] = pos
 
   def _moveLineUp(self, button, device):
     pos = self._findDevPosition(device)
     if pos > 1:  # 0 = header
-      for col, types in self._liloTable.contents:
-        old = col.widget_list[pos]
-        del col.widget_list[pos]
-        col.widget_list.insert(pos - 1, old)
+      self._swapLines(pos, pos - 1)
 
   def _moveLineDown(self, button, device):
     pos = self._findDevPosition(device)
     if pos < len(self._liloTable.widget_list[0].item_types) - 1:
-      for col, types in self._liloTable.contents:
-        old = col.widget_list[pos]
-        del col.widget_list[pos]
-        col.widget_list.insert(pos + 1, old)
+      self._swapLines(pos, pos + 1)
 
   def _create_lilo_config(self):
     partitions = []
@@ -522,6 +653,8 @@ click on this button to install your bootloader.")
       self._errorDialog(_("Sorry, BootSetup is unable to find a Linux filesystem on your choosen boot entries, so cannot install LiLo.\n"))
 
   def _editLiLoConf(self, button):
+    if self._gathering:
+      return
     lilocfg = self._lilo.getConfigurationPath()
     if not os.path.exists(lilocfg):
       self._custom_lilo = True
@@ -538,8 +671,18 @@ click on this button to install your bootloader.")
       if not launched:
         self._custom_lilo = False
         self._errorDialog(_("Sorry, BootSetup is unable to find a suitable text editor in your system. You will not be able to manually modify the LiLo configuration.\n"))
+      else:
+        self._checkLiLoConf()
     self._updateLiLoButtons()
 
+  def _checkLiLoConf(self):
+    """
+    Show the problems found in the edited LiLo configuration file, if any.
+    """
+    problems = self._lilo.checkConfiguration()
+    if problems:
+      self._errorDialog(_("The LiLo configuration file contains errors:\n\n{errors}\n\nPlease edit it again to correct them.\n").format(errors="\n".join(problems)))
+
   def _cancelLiLoConf(self, button):
     lilocfg = self._lilo.getConfigurationPath()
     if os.path.exists(lilocfg):
@@ -557,8 +700,8 @@ click on this button to install your bootloader.")
         self._set_sensitive_rec(w2, state)
 
   def _updateLiLoButtons(self):
-    self._set_sensitive_rec(self._liloTable, not self._custom_lilo)
-    self._liloTableLines.sensitive = not self._custom_lilo
+    self._set_sensitive_rec(self._liloTable, not self._custom_lilo and not self._gathering)
+    self._liloTableLines.sensitive = not self._custom_lilo and not self._gathering
     self._updateScreen()
 
   def _onGrub2FilesChange(self, combo, partition, pos):
@@ -572,16 +715,7 @@ click on this button to install your bootloader.")
 
   def _updateGrub2EditButton(self, doTest=True):
     if doTest:
-      partition = os.path.join("/dev", self.cfg.cur_boot_partition)
-      if slt.isMounted(partition):
-        mp = slt.getMountPoint(partition)
-        doumount = False
-      else:
-        mp = slt.mountDevice(partition)
-        doumount = True
-      self._grub2_conf = os.path.exists(os.path.join(mp, "etc/default/grub"))
-      if doumount:
-        slt.umountDevice(mp)
+      (self._grub2_conf, updateGrub) = getCapabilities(os.path.join("/dev", self.cfg.cur_boot_partition))
     else:
       self._grub2_conf = False
     self._grub2BtnEdit.sensitive = self._grub2_conf
@@ -589,42 +723,52 @@ click on this button to install your bootloader.")
 
   def _editGrub2Conf(self, button):
     partition = os.path.join("/dev", self.cfg.cur_boot_partition)
-    if slt.isMounted(partition):
-      mp = slt.getMountPoint(partition)
-      doumount = False
-    else:
-      mp = slt.mountDevice(partition)
-      doumount = True
-    grub2cfg = os.path.join(mp, "etc/default/grub")
-    launched = False
-    for editor in self._editors:
-      try:
-        slt.execCall([editor, grub2cfg], shell=True, env=None)
-        launched = True
-        break
-      except:
-        pass
-    if not launched:
-      self._errorDialog(_("Sorry, BootSetup is unable to find a suitable text editor in your system. You will not be able to manually modify the Grub2 default configuration.\n"))
-    if doumount:
-      slt.umountDevice(mp)
+    with pool.mounted(partition) as mp:
+      if not mp:
+        return
+      grub2cfg = os.path.join(mp, "etc/default/grub")
+      launched = False
+      for editor in self._editors:
+        try:
+          slt.execCall([editor, grub2cfg], shell=True, env=None)
+          launched = True
+          break
+        except:
+          pass
+      if not launched:
+        self._errorDialog(_("Sorry, BootSetup is unable to find a suitable text editor in your system. You will not be able to manually modify the Grub2 default configuration.\n"))
+    invalidateCapabilities(partition)
 
   def _onInstall(self, btnInstall):
+    if self._gathering:
+      return
+    upToDate = False
     if self.cfg.cur_bootloader == 'lilo':
       if not os.path.exists(self._lilo.getConfigurationPath()):
         self._create_lilo_config()
-      self._lilo.install()
+      try:
+        upToDate = self._lilo.install() is False
+      except Exception as e:
+        self._errorDialog(_("Sorry, LiLo could not be installed:\n{error}\n").format(error=e))
+        return
     elif self.cfg.cur_bootloader == 'grub2':
       self._grub2.install(self.cfg.cur_mbr_device, self.cfg.cur_boot_partition)
-    self.installation_done()
+    self.installation_done(upToDate)
 
-  def installation_done(self):
-    print("Bootloader Installation Done.")
-    msg = _("Bootloader installation process completed.")
+  def installation_done(self, upToDate=False):
+    if upToDate:
+      print("Bootloader already up to date.")
+      msg = _("The bootloader is already installed with this configuration, nothing has been changed.")
+    else:
+      print("Bootloader Installation Done.")
+      msg = _("Bootloader installation process completed.")
     self._infoDialog(msg)
     self.main_quit()
 
   def main_quit(self):
+    if self._watcher:
+      self._watcher.stop()
+    pool.close()
     if self._lilo:
       del self._lilo
     if self._grub2:
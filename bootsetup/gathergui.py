@@ -15,10 +15,14 @@ import gtk.glade
 import os
 import sys
 import re
+import threading
 import libsalt as slt
 from .config import Config
+from .hotplug import DeviceWatcher
+from .mountpool import pool
 from .lilo import Lilo
-from .grub2 import Grub2
+from .liloconf import MAX_LABEL_LENGTH
+from .grub2 import Grub2, getCapabilities, invalidateCapabilities
 
 
 class GatherGui:
@@ -29,20 +33,14 @@ class GatherGui:
   _lilo = None
   _grub2 = None
   _editing = False
+  _gathering = False
+  _watcher = None
   _custom_lilo = False
   _editors = ['leafpad', 'gedit', 'geany', 'kate', 'xterm -e nano']
 
   def __init__(self, bootsetup, bootloader=None, target_partition=None, is_test=False, use_test_data=False):
     self._bootsetup = bootsetup
-    self.cfg = Config(bootloader, target_partition, is_test, use_test_data)
-    print("""
-bootloader         = {bootloader}
-target partition   = {partition}
-MBR device         = {mbr}
-disks:{disks}
-partitions:{partitions}
-boot partitions:{boot_partitions}
-""".format(bootloader=self.cfg.cur_bootloader, partition=self.cfg.cur_boot_partition, mbr=self.cfg.cur_mbr_device, disks="\n - " + "\n - ".join(map(" ".join, self.cfg.disks)), partitions="\n - " + "\n - ".join(map(" ".join, self.cfg.partitions)), boot_partitions="\n - " + "\n - ".join(map(" ".join, self.cfg.boot_partitions))))
+    self.cfg = Config(bootloader, target_partition, is_test, use_test_data, on_boot_partition=self._on_boot_partition_found, gather=False)
     builder = gtk.Builder()
     if os.path.exists('bootsetup.glade'):
       builder.add_from_file('bootsetup.glade')
@@ -90,17 +88,98 @@ boot partitions:{boot_partitions}
 A bootloader is required to load the main operating system of a computer and will initially display \
 a boot menu if several operating systems are available on the same computer.")
     self.on_leave_notify_event(None)
-    self.build_data_stores()
-    self.update_buttons()
+    # Progress bar shown while the configuration is gathered
+    self.GatheringProgressBar = gtk.ProgressBar()
+    self.GatheringProgressBar.set_text(_("Gathering current configuration…"))
+    builder.get_object("vbox_main").pack_start(self.GatheringProgressBar, expand=False, fill=False)
+    self.set_gathering_mode(True)
     # Connect signals
     builder.connect_signals(self)
 
   def run(self):
     # indicates to gtk (and gdk) that we will use threads
     gtk.gdk.threads_init()
+    if self.cfg.cur_bootloader == 'lilo':
+      # show the LiLo table right away, it is filled while the boot partitions are found
+      self.LiloPart.show()
+      self.Grub2Part.hide()
+    # gather the configuration in background, the window is already shown
+    gatherThread = threading.Thread(target=self._gather_config)
+    gatherThread.daemon = True
+    gatherThread.start()
     # start the main gtk loop
     gtk.main()
 
+  def _gather_config(self):
+    """
+    Run in a worker thread, the GUI is updated in the main loop.
+    """
+    try:
+      self.cfg.gather()
+      self.update_gui_async(self._on_config_gathered)
+    except Exception as e:
+      self.update_gui_async(self._on_config_error, e)
+
+  def _on_boot_partition_found(self, p):
+    self.update_gui_async(self.add_boot_partition_row, p)
+
+  def _on_config_gathered(self):
+    print(self.cfg.summary())
+    self.set_gathering_mode(False)
+    self.build_data_stores()
+    self.update_buttons()
+    if self.cfg.hotplug:
+      self._watcher = DeviceWatcher(self._on_devices_changed)
+      self._watcher.start()
+    return False
+
+  def _on_devices_changed(self, added, removed):
+    """
+    Called by the device watcher thread.
+    """
+    try:
+      changes = self.cfg.refresh(added, removed)
+      self.update_gui_async(self._apply_devices_changes, *changes)
+    except Exception as e:
+      print("Cannot refresh the configuration: {0}".format(e))
+
+  def _apply_devices_changes(self, new_disks, new_partitions, new_boot_partitions, removed_devices):
+    """
+    Update the lists in place: remove the lines of removed devices and append the new ones.
+    """
+    for device in removed_devices:
+      invalidateCapabilities(os.path.join("/dev", device))
+    for store in (self.DiskListStore, self.PartitionListStore, self.BootPartitionListStore):
+      for row in [row for row in store if row[0] in removed_devices]:
+        store.remove(row.iter)
+    for d in new_disks:
+      self.DiskListStore.append([d[0], d[2]])
+    for p in new_partitions:
+      self.PartitionListStore.append(list(p))
+    for p in new_boot_partitions:
+      self.add_boot_partition_row(p)
+    self.update_buttons()
+    return False
+
+  def _on_config_error(self, error):
+    self._bootsetup.error_dialog(_("Cannot gather the current configuration:\n{0}").format(error))
+    self.gtk_main_quit(self.Window)
+    return False
+
+  def _pulse_gathering_progress(self):
+    if self._gathering:
+      self.GatheringProgressBar.pulse()
+    return self._gathering
+
+  def set_gathering_mode(self, is_gathering):
+    self._gathering = is_gathering
+    if is_gathering:
+      self.GatheringProgressBar.show()
+      gobject.timeout_add(100, self._pulse_gathering_progress)
+    else:
+      self.GatheringProgressBar.hide()
+    self.update_buttons()
+
   def _add_combobox_cell_renderer(self, comboBox, modelPosition, start=False, expand=False, padding=0):
     cell = gtk.CellRendererText()
     cell.set_property('xalign', 0)
@@ -198,13 +277,9 @@ click on this button to install your bootloader."))
     for d in self.cfg.disks:
       self.DiskListStore.append([d[0], d[2]])
     for p in self.cfg.partitions:  # for grub2
-      self.PartitionListStore.append(p)
+      self.PartitionListStore.append(list(p))
     for p in self.cfg.boot_partitions:  # for lilo
-      p2 = list(p)  # copy p
-      del p2[2]  # discard boot type
-      p2[3] = re.sub(r'[()]', '', re.sub(r'_\(loader\)', '', re.sub(' ', '_', p2[3])))  # lilo does not like spaces and pretty print the label
-      p2.append('gtk-edit')  # add a visual
-      self.BootPartitionListStore.append(p2)
+      self.add_boot_partition_row(p)
     self.ComboBoxMbrEntry.set_text(self.cfg.cur_mbr_device)
     self.ComboBoxPartitionEntry.set_text(self.cfg.cur_boot_partition)
     self.LabelCellRendererCombo.set_property("model", self.BootLabelListStore)
@@ -214,6 +289,18 @@ click on this button to install your bootloader."))
     print(' Done')
     sys.stdout.flush()
 
+  def add_boot_partition_row(self, p):
+    """
+    Add a boot partition [device, fs, boot type, os, label] at the end of the LiLo table.
+    Return False, so it could be used with update_gui_async.
+    """
+    p2 = list(p)  # copy p
+    del p2[2]  # discard boot type
+    p2[3] = re.sub(r'[()]', '', re.sub(r'_\(loader\)', '', re.sub(' ', '_', p2[3])))  # lilo does not like spaces and pretty print the label
+    p2.append('gtk-edit')  # add a visual
+    self.BootPartitionListStore.append(p2)
+    return False
+
   # What to do when BootSetup logo is clicked
   def on_about_button_clicked(self, widget, data=None):
     self.AboutDialog.show()
@@ -225,6 +312,9 @@ click on this button to install your bootloader."))
 
   # What to do when the exit X on the main window upper right is clicked
   def gtk_main_quit(self, widget, data=None):
+    if self._watcher:
+      self._watcher.stop()
+    pool.close()
     if self._lilo:
       del self._lilo
     if self._grub2:
@@ -276,7 +366,7 @@ click on this button to install your bootloader."))
 
   def on_label_cellrenderercombo_edited(self, widget, row_number, new_text):
     row_number = int(row_number)
-    max_chars = 15
+    max_chars = MAX_LABEL_LENGTH
     if ' ' in new_text:
       self._bootsetup.error_dialog(_("\nAn Operating System label should not contain spaces.\n\nPlease check and correct.\n"))
     elif len(new_text) > max_chars:
@@ -359,10 +449,8 @@ click on this button to install your bootloader."))
         dev = p[0]
         fs = p[1]
         t = "chain"
-        for p2 in self.cfg.boot_partitions:
-          if p2[0] == dev:
-            t = p2[2]
-            break
+        if dev in self.cfg.boot_partition_by_device:
+          t = self.cfg.boot_partition_by_device[dev].boot_type
         label = p[3]
         if not self.cfg.cur_boot_partition and t == 'linux':
           self.cfg.cur_boot_partition = dev
@@ -391,6 +479,16 @@ click on this button to install your bootloader."))
       if not launched:
         self._custom_lilo = False
         self._bootsetup.error_dialog(_("Sorry, BootSetup is unable to find a suitable text editor in your system. You will not be able to manually modify the LiLo configuration.\n"))
+      else:
+        self._check_lilo_config()
+
+  def _check_lilo_config(self):
+    """
+    Show the problems found in the edited LiLo configuration file, if any.
+    """
+    problems = self._lilo.checkConfiguration()
+    if problems:
+      self._bootsetup.error_dialog(_("The LiLo configuration file contains errors:\n\n{errors}\n\nPlease edit it again to correct them.\n").format(errors="\n".join(problems)))
 
   def on_lilo_undo_button_clicked(self, widget, data=None):
     lilocfg = self._lilo.getConfigurationPath()
@@ -405,27 +503,21 @@ click on this button to install your bootloader."))
 
   def on_grub2_edit_button_clicked(self, widget, data=None):
     partition = os.path.join("/dev", self.cfg.cur_boot_partition)
-    if slt.isMounted(partition):
-      mp = slt.getMountPoint(partition)
-      doumount = False
-    else:
-      mp = slt.mountDevice(partition)
-      doumount = True
-    grub2cfg = os.path.join(mp, "etc/default/grub")
-    if os.path.exists(grub2cfg):
-      launched = False
-      for editor in self._editors:
-        try:
-          cmd = editor.split(' ') + [grub2cfg]
-          slt.execCall(cmd, shell=True, env=None)
-          launched = True
-          break
-        except:
-          pass
-      if not launched:
-        self._bootsetup.error_dialog(_("Sorry, BootSetup is unable to find a suitable text editor in your system. You will not be able to manually modify the Grub2 default configuration.\n"))
-    if doumount:
-      slt.umountDevice(mp)
+    with pool.mounted(partition) as mp:
+      grub2cfg = mp and os.path.join(mp, "etc/default/grub")
+      if grub2cfg and os.path.exists(grub2cfg):
+        launched = False
+        for editor in self._editors:
+          try:
+            cmd = editor.split(' ') + [grub2cfg]
+            slt.execCall(cmd, shell=True, env=None)
+            launched = True
+            break
+          except:
+            pass
+        if not launched:
+          self._bootsetup.error_dialog(_("Sorry, BootSetup is unable to find a suitable text editor in your system. You will not be able to manually modify the Grub2 default configuration.\n"))
+    invalidateCapabilities(partition)
 
   def update_buttons(self):
     install_ok = False
@@ -442,38 +534,39 @@ click on this button to install your bootloader."))
         if self.cfg.cur_boot_partition and os.path.exists("/dev/{0}".format(self.cfg.cur_boot_partition)) and slt.getPartitionInfo(self.cfg.cur_boot_partition):
           install_ok = True
         if install_ok:
-          partition = os.path.join("/dev", self.cfg.cur_boot_partition)
-          if slt.isMounted(partition):
-            mp = slt.getMountPoint(partition)
-            doumount = False
-          else:
-            mp = slt.mountDevice(partition)
-            doumount = True
-          grub2_edit_ok = os.path.exists(os.path.join(mp, "etc/default/grub"))
-          if doumount:
-            slt.umountDevice(mp)
-    self.RadioLilo.set_sensitive(not self._editing)
-    self.RadioGrub2.set_sensitive(not self._editing)
-    self.ComboBoxMbr.set_sensitive(not self._editing)
-    self.BootPartitionTreeview.set_sensitive(not self._custom_lilo)
+          (grub2_edit_ok, updateGrub) = getCapabilities(os.path.join("/dev", self.cfg.cur_boot_partition))
+    self.RadioLilo.set_sensitive(not self._editing and not self._gathering)
+    self.RadioGrub2.set_sensitive(not self._editing and not self._gathering)
+    self.ComboBoxMbr.set_sensitive(not self._editing and not self._gathering)
+    self.ComboBoxPartition.set_sensitive(not self._gathering)
+    self.BootPartitionTreeview.set_sensitive(not self._custom_lilo and not self._gathering)
     self.UpButton.set_sensitive(not self._editing and multiple)
     self.DownButton.set_sensitive(not self._editing and multiple)
     self.LiloUndoButton.set_sensitive(not self._editing and self._custom_lilo)
     self.LiloEditButton.set_sensitive(not self._editing and install_ok)
     self.Grub2EditButton.set_sensitive(grub2_edit_ok)
-    self.ExecuteButton.set_sensitive(not self._editing and install_ok)
+    self.ExecuteButton.set_sensitive(not self._editing and not self._gathering and install_ok)
 
   def on_execute_button_clicked(self, widget, data=None):
+    up_to_date = False
     if self.cfg.cur_bootloader == 'lilo':
       if not os.path.exists(self._lilo.getConfigurationPath()):
         self._create_lilo_config()
-      self._lilo.install()
+      try:
+        up_to_date = self._lilo.install() is False
+      except Exception as e:
+        self._bootsetup.error_dialog(_("Sorry, LiLo could not be installed:\n{error}\n").format(error=e))
+        return
     elif self.cfg.cur_bootloader == 'grub2':
       self._grub2.install(self.cfg.cur_mbr_device, self.cfg.cur_boot_partition)
-    self.installation_done()
+    self.installation_done(up_to_date)
 
-  def installation_done(self):
-    print("Bootloader Installation Done.")
-    msg = "<b>{0}</b>".format(_("Bootloader installation process completed."))
+  def installation_done(self, up_to_date=False):
+    if up_to_date:
+      print("Bootloader already up to date.")
+      msg = "<b>{0}</b>".format(_("The bootloader is already installed with this configuration, nothing has been changed."))
+    else:
+      print("Bootloader Installation Done.")
+      msg = "<b>{0}</b>".format(_("Bootloader installation process completed."))
     self._bootsetup.info_dialog(msg)
     self.gtk_main_quit(self.Window)
@@ -9,15 +9,100 @@ from __future__ import unicode_literals, print_function, division, absolute_impo
 import tempfile
 import os
 import sys
+import io
 import codecs
+import hashlib
+import threading
+import subprocess as sp
 import libsalt as slt
+from .profiler import profiler
+from .mountpool import pool, umount_all
+from . import extfs
+
+_capabilities = {}
+_capabilitiesLock = threading.Lock()
+_chrootBinds = ('dev', 'proc', 'sys')
+_unshareAvailable = None
+_sectorSize = 512
+# part of the boot.img code that grub-install writes unchanged to the MBR:
+# after the BPB, the blocklist and the drive check it patches, and before the partition table
+_bootCodeRange = (0x68, 0x1B8)
+# reed-solomon redundancy length field of the second sector of core.img, that grub-install sets when it embeds core.img
+_redundancyField = (_sectorSize + 0x10, _sectorSize + 0x14)
+_moduleExtensions = ('.mod', '.lst')
+
+
+def _canUnshare():
+  """
+  Return True if a command could be run in a private mount namespace with unshare.
+  Only checked once.
+  """
+  global _unshareAvailable
+  if _unshareAvailable is None:
+    try:
+      with open(os.devnull, 'w') as devnull:
+        _unshareAvailable = sp.call(['unshare', '--mount', 'true'], stdout=devnull, stderr=devnull) == 0
+    except OSError:
+      _unshareAvailable = False
+  return _unshareAvailable
+
+
+def _getDigest(path):
+  """
+  Return the SHA-256 hex digest of the content of the file path.
+  """
+  digest = hashlib.sha256()
+  with io.open(path, 'rb') as f:
+    for chunk in iter(lambda: f.read(1 << 16), b''):
+      digest.update(chunk)
+  return digest.hexdigest()
+
+
+def _getBindCommand(mountPoint):
+  """
+  Return the shell command binding /dev, /proc and /sys into mountPoint.
+  """
+  return " && ".join(["mount -o bind /{d} {mp}/{d}".format(d=d, mp=mountPoint) for d in _chrootBinds])
+
+
+def getCapabilities(partition):
+  """
+  Return (hasDefaultGrub, hasUpdateGrub) for the partition (like /dev/sda1): whether etc/default/grub and usr/sbin/update-grub exist on it.
+  The partition is only mounted the first time, the result is then cached until invalidateCapabilities is called.
+  """
+  with _capabilitiesLock:
+    if partition in _capabilities:
+      return _capabilities[partition]
+  with pool.mounted(partition) as mp:
+    if mp:
+      capabilities = (os.path.exists(os.path.join(mp, 'etc/default/grub')), os.path.exists(os.path.join(mp, 'usr/sbin/update-grub')))
+    else:
+      capabilities = (False, False)
+  with _capabilitiesLock:
+    _capabilities[partition] = capabilities
+  return capabilities
+
+
+def invalidateCapabilities(partition=None):
+  """
+  Forget the cached capabilities of the partition, or of every partition if None.
+  To be called once the partition could have changed, like after editing its grub configuration or installing Grub2.
+  """
+  with _capabilitiesLock:
+    if partition:
+      _capabilities.pop(partition, None)
+    else:
+      _capabilities.clear()
 
 
 class Grub2:
   isTest = False
+  grubLibDir = '/usr/lib/grub'
+  platform = 'i386-pc'
+  efiSysfsDir = '/sys/firmware/efi'
   _prefix = None
   _tmp = None
-  _bootInBootMounted = False
+  _bootInBootDevice = None
   _procInBootMounted = False
 
   def __init__(self, isTest):
@@ -45,40 +130,40 @@ class Grub2:
       with codecs.open("bootsetup.log", "a+", "utf-8") as fdebug:
         fdebug.write("Debug: {0}\n".format(msg))
 
+  @profiler.profiled('grub2.mountBootPartition')
   def _mountBootPartition(self, bootPartition):
     """
     Return the mount point
     """
     self.__debug("bootPartition = " + bootPartition)
-    if slt.isMounted(bootPartition):
-      self.__debug("bootPartition already mounted")
-      return slt.getMountPoint(bootPartition)
-    else:
-      self.__debug("bootPartition not mounted")
-      return slt.mountDevice(bootPartition)
+    return pool.acquire(bootPartition)
 
+  @profiler.profiled('grub2.mountBootInBootPartition')
   def _mountBootInBootPartition(self, mountPoint):
     # assume that if the mount_point is /, any /boot directory is already accessible/mounted
-    if mountPoint != '/' and os.path.exists(os.path.join(mountPoint, 'etc/fstab')):
-      self.__debug("mp != / and etc/fstab exists, will try to mount /boot by chrooting")
+    fstab = os.path.join(mountPoint, 'etc/fstab')
+    bootDir = os.path.join(mountPoint, 'boot')
+    if mountPoint != '/' and os.path.exists(fstab):
+      self.__debug("mp != / and etc/fstab exists, will try to mount /boot by reading fstab")
       try:
-        self.__debug("grep -q /boot {mp}/etc/fstab && chroot {mp} /sbin/mount /boot".format(mp=mountPoint))
-        if slt.execCall("grep -q /boot {mp}/etc/fstab && chroot {mp} /sbin/mount /boot".format(mp=mountPoint)):
-          self.__debug("/boot mounted in " + mountPoint)
-          self._bootInBootMounted = True
+        with codecs.open(fstab, 'r', 'utf-8', 'replace') as f:
+          (bootSpec, bootType) = extfs.find_boot_entry(f)
+        if bootSpec:
+          bootDev = extfs.resolve_device(bootSpec)
+          if (bootDev in pool or not os.path.ismount(bootDir)) and pool.acquire(bootDev, bootType, bootDir):
+            self.__debug("/boot mounted in " + mountPoint)
+            self._bootInBootDevice = bootDev
       except:
         pass
 
   def _bindProcSysDev(self, mountPoint):
     """
-    bind /proc /sys and /dev into the boot partition
+    bind /proc /sys and /dev into the boot partition, with a single helper process
     """
     if mountPoint != "/":
       self.__debug("mount point ≠ / so mount /dev, /proc and /sys in " + mountPoint)
       self._procInBootMounted = True
-      slt.execCall('mount -o bind /dev {mp}/dev'.format(mp=mountPoint))
-      slt.execCall('mount -o bind /proc {mp}/proc'.format(mp=mountPoint))
-      slt.execCall('mount -o bind /sys {mp}/sys'.format(mp=mountPoint))
+      slt.execCall(_getBindCommand(mountPoint))
 
   def _unbindProcSysDev(self, mountPoint):
     """
@@ -86,17 +171,88 @@ class Grub2:
     """
     if self._procInBootMounted:
       self.__debug("mount point ≠ / so umount /dev, /proc and /sys in " + mountPoint)
-      slt.execCall('umount {mp}/dev'.format(mp=mountPoint))
-      slt.execCall('umount {mp}/proc'.format(mp=mountPoint))
-      slt.execCall('umount {mp}/sys'.format(mp=mountPoint))
+      umount_all([os.path.join(mountPoint, d) for d in _chrootBinds])
+      self._procInBootMounted = False
 
+  @profiler.profiled('grub2.execInChroot')
+  def _execInChroot(self, mountPoint, cmd):
+    """
+    Run cmd chrooted in mountPoint, with /dev, /proc and /sys bound into it.
+    When possible, the binds are made in a private mount namespace by the process running cmd,
+    so they vanish with it, without anything to unmount.
+    """
+    chrootCmd = "chroot {mp} {cmd}".format(mp=mountPoint, cmd=cmd)
+    if mountPoint == '/':
+      return slt.execCall(chrootCmd)
+    if _canUnshare():
+      return slt.execCall("unshare --mount sh -c '{binds} && exec {chroot}'".format(binds=_getBindCommand(mountPoint), chroot=chrootCmd))
+    self._bindProcSysDev(mountPoint)
+    try:
+      return slt.execCall(chrootCmd)
+    finally:
+      self._unbindProcSysDev(mountPoint)
+
+  def _isCoreImageInstalled(self, device, grubDir):
+    """
+    Return True if device boots the core image of grubDir: its MBR has the code of boot.img and core.img is embedded right after it.
+    The bytes patched by grub-install are not compared: the first sector of core.img, which holds the location of the rest,
+    and the redundancy field of the second one. The reed-solomon parity appended after core.img is not read.
+    """
+    try:
+      with io.open(os.path.join(grubDir, 'boot.img'), 'rb') as f:
+        bootImg = f.read()
+      with io.open(os.path.join(grubDir, 'core.img'), 'rb') as f:
+        coreImg = f.read()
+      with io.open(device, 'rb') as f:
+        disk = f.read(_sectorSize + len(coreImg))
+    except EnvironmentError:
+      return False
+    if len(bootImg) != _sectorSize or len(coreImg) <= _sectorSize or len(disk) != _sectorSize + len(coreImg):
+      return False
+    (start, end) = _bootCodeRange
+    if disk[start:end] != bootImg[start:end]:
+      return False
+    embedded = disk[_sectorSize:]
+    (start, end) = _redundancyField
+    return embedded[_sectorSize:start] == coreImg[_sectorSize:start] and embedded[end:] == coreImg[end:]
+
+  @profiler.profiled('grub2.isGrub2Installed')
+  def _isGrub2Installed(self, mountPoint, device):
+    """
+    Return True if grub-install would not change anything: the modules and boot.img in boot/grub/<platform> are the ones of the
+    platform directory in grubLibDir, same size and same hash, and device boots the core image installed with them.
+    Only the BIOS platform is checked, False is returned on an EFI system.
+    """
+    if os.path.isdir(self.efiSysfsDir):
+      return False
+    sourceDir = os.path.join(self.grubLibDir, self.platform)
+    grubDir = os.path.join(mountPoint, 'boot/grub', self.platform)
+    try:
+      names = [n for n in os.listdir(sourceDir) if n.endswith(_moduleExtensions) or n == 'boot.img']
+      files = [(os.path.join(sourceDir, n), os.path.join(grubDir, n)) for n in names]
+      # sizes first: a grub upgrade is usually noticed without hashing anything
+      if not names or [os.path.getsize(s) for (s, t) in files] != [os.path.getsize(t) for (s, t) in files]:
+        return False
+      for (source, target) in files:
+        if _getDigest(source) != _getDigest(target):
+          self.__debug(target + " differs from " + source)
+          return False
+    except EnvironmentError:
+      return False
+    return self._isCoreImageInstalled(device, grubDir)
+
+  @profiler.profiled('grub2.copyAndInstallGrub2')
   def _copyAndInstallGrub2(self, mountPoint, device):
+    if self._isGrub2Installed(mountPoint, device):
+      self.__debug("the modules and the core image of Grub2 on {dev} are up to date, grub-install is not run".format(dev=device))
+      return True
     if self.isTest:
       self.__debug("/usr/sbin/grub-install --boot-directory {bootdir} --no-floppy {dev}".format(bootdir=os.path.join(mountPoint, "boot"), dev=device))
       return True
     else:
       return slt.execCall("/usr/sbin/grub-install --boot-directory {bootdir} --no-floppy {dev}".format(bootdir=os.path.join(mountPoint, "boot"), dev=device))
 
+  @profiler.profiled('grub2.installGrub2Config')
   def _installGrub2Config(self, mountPoint):
     if os.path.exists(os.path.join(mountPoint, 'etc/default/grub')) and os.path.exists(os.path.join(mountPoint, 'usr/sbin/update-grub')):
       self.__debug("grub2 package is installed on the target partition, so it will be used to generate the grub.cfg file")
@@ -104,7 +260,7 @@ class Grub2:
       if self.isTest:
         self.__debug("chroot {mp} /usr/sbin/update-grub".format(mp=mountPoint))
       else:
-        slt.execCall("chroot {mp} /usr/sbin/update-grub".format(mp=mountPoint))
+        self._execInChroot(mountPoint, "/usr/sbin/update-grub")
     else:
       self.__debug("grub2 not installed on the target partition, so grub_mkconfig will directly be used to generate the grub.cfg file")
       # tiny OS installed on that mount point, so we cannot chroot on it to install grub2 config.
@@ -113,26 +269,27 @@ class Grub2:
       else:
         slt.execCall("/usr/sbin/grub-mkconfig -o {cfg}".format(cfg=os.path.join(mountPoint, "boot/grub/grub.cfg")))
 
-  def _umountAll(self, mountPoint):
+  @profiler.profiled('grub2.umountAll')
+  def _umountAll(self, mountPoint, bootPartition):
     self.__debug("umountAll")
     if mountPoint:
       self.__debug("umounting main mount point " + mountPoint)
       self._unbindProcSysDev(mountPoint)
-      if self._bootInBootMounted:
-        self.__debut("/boot mounted in " + mountPoint + ", so umount it")
-        slt.execCall("chroot {mp} /sbin/umount /boot".format(mp=mountPoint))
-      if mountPoint != '/':
-        self.__debug("umain mount point ≠ '/' → umount " + mountPoint)
-        slt.umountDevice(mountPoint)
-    self._bootInBootMounted = False
+      if self._bootInBootDevice:
+        self.__debug("/boot mounted in " + mountPoint + ", so release it")
+        pool.release(self._bootInBootDevice)
+      self.__debug("release " + bootPartition + ", the mount pool will unmount it once idle")
+      pool.release(bootPartition)
+    self._bootInBootDevice = None
     self._procInBootMounted = False
 
+  @profiler.profiled('grub2.install')
   def install(self, mbrDevice, bootPartition):
     mbrDevice = os.path.join("/dev", mbrDevice)
     bootPartition = os.path.join("/dev", bootPartition)
     self.__debug("mbrDevice = " + mbrDevice)
     self.__debug("bootPartition = " + bootPartition)
-    self._bootInBootMounted = False
+    self._bootInBootDevice = None
     self._procInBootMounted = False
     mp = None
     try:
@@ -144,4 +301,5 @@ class Grub2:
       else:
         sys.stderr.write("Grub2 cannot be installed on this disk [{0}]\n".format(mbrDevice))
     finally:
-      self._umountAll(mp)
+      self._umountAll(mp, bootPartition)
+      invalidateCapabilities(bootPartition)
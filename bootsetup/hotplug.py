@@ -0,0 +1,108 @@
+#!/usr/bin/env python
+# coding: utf-8
+# vim:et:sta:sts=2:sw=2:ts=2:tw=0:
+"""
+Watch block devices being plugged or unplugged.
+Kernel uevents (netlink) are used to be woken up, with a polling of /proc/partitions as a fallback.
+"""
+from __future__ import unicode_literals, print_function, division, absolute_import
+
+import select
+import socket
+import threading
+import codecs
+
+NETLINK_KOBJECT_UEVENT = 15
+
+
+def read_block_devices(proc_partitions='/proc/partitions'):
+  """
+  Return the set of block device names listed in /proc/partitions.
+  """
+  devices = set()
+  try:
+    with codecs.open(proc_partitions, 'r', 'utf-8') as f:
+      for line in f:
+        fields = line.split()
+        if len(fields) == 4 and fields[0].isdigit():
+          devices.add(fields[3])
+  except EnvironmentError:
+    pass
+  return devices
+
+
+class DeviceWatcher:
+  """
+  Call callback(added, removed) from a background thread each time block devices appear or disappear.
+  added and removed are sets of device names, like sdb or sdb1.
+  """
+  callback = None
+  proc_partitions = None
+  interval = None
+  settle_delay = None
+  _devices = None
+  _thread = None
+  _stop = None
+  _socket = None
+
+  def __init__(self, callback, proc_partitions='/proc/partitions', interval=2, settle_delay=0.5):
+    self.callback = callback
+    self.proc_partitions = proc_partitions
+    self.interval = interval
+    self.settle_delay = settle_delay
+    self._stop = threading.Event()
+
+  def _open_netlink(self):
+    try:
+      sock = socket.socket(socket.AF_NETLINK, socket.SOCK_DGRAM, NETLINK_KOBJECT_UEVENT)
+      sock.bind((0, 1))  # multicast group 1: kernel uevents
+      return sock
+    except (AttributeError, EnvironmentError, socket.error):
+      return None
+
+  def _is_block_uevent(self, data):
+    return b'SUBSYSTEM=block' in data.split(b'\0')
+
+  def _wait_for_event(self):
+    """
+    Wait for a block uevent, or for the polling interval if netlink is not available.
+    """
+    if self._socket:
+      (readable, w, x) = select.select([self._socket], [], [], self.interval)
+      isBlock = False
+      while readable:
+        isBlock = self._is_block_uevent(self._socket.recv(65536)) or isBlock
+        (readable, w, x) = select.select([self._socket], [], [], 0)
+      if isBlock:
+        self._stop.wait(self.settle_delay)  # let the kernel add all partitions of a new disk
+    else:
+      self._stop.wait(self.interval)
+
+  def _run(self):
+    while not self._stop.is_set():
+      self._wait_for_event()
+      if self._stop.is_set():
+        break
+      devices = read_block_devices(self.proc_partitions)
+      added = devices - self._devices
+      removed = self._devices - devices
+      self._devices = devices
+      if added or removed:
+        self.callback(added, removed)
+
+  def start(self):
+    self._devices = read_block_devices(self.proc_partitions)
+    self._socket = self._open_netlink()
+    self._stop.clear()
+    self._thread = threading.Thread(target=self._run)
+    self._thread.daemon = True
+    self._thread.start()
+
+  def stop(self):
+    self._stop.set()
+    if self._thread:
+      self._thread.join(self.interval + 1)
+      self._thread = None
+    if self._socket:
+      self._socket.close()
+      self._socket = None
@@ -10,21 +10,249 @@ import sys
 import tempfile
 import shutil
 import os
-import glob
+import re
+import stat
+import io
+import json
 import codecs
+import subprocess as sp
 import libsalt as slt
-from subprocess import CalledProcessError
 from operator import itemgetter
+from .profiler import profiler
+from .mountpool import pool
+from . import extfs
+from . import liloconf
+from .probecache import read_uuids, change_indicator
+from .workers import DEFAULT_WORKERS, parallel_map
+try:
+  from os import scandir
+except ImportError:
+  try:
+    from scandir import scandir  # python 2 backport
+  except ImportError:
+    scandir = None
+
+_kernelPrefixes = ('vmlinuz',)
+_initrdPrefixes = ('initrd.img', 'initramfs', 'initrd')
+_initrdExtensions = ('.gz', '.img', '.xz', '.lz4', '.lzma', '.bz2', '.zst', '.lzo')
+
+
+def _getVersion(path, prefixes, extensions=()):
+  """
+  Return the version part of a kernel or initrd file name, like 4.4.1-smp for vmlinuz-4.4.1-smp or initrd-4.4.1-smp.gz.
+  """
+  name = os.path.basename(path)
+  for prefix in prefixes:
+    if name.startswith(prefix):
+      name = name[len(prefix):]
+      break
+  stripped = True
+  while stripped:
+    stripped = False
+    for ext in extensions:
+      if name.endswith(ext):
+        name = name[:-len(ext)]
+        stripped = True
+  return name.lstrip('-.')
+
+
+_installedConfigPath = 'etc/bootsetup/lilo.conf'
+_fingerprintsPath = 'etc/bootsetup/lilo.conf.fingerprints'
+_fingerprintedOptions = ('image', 'initrd', 'bitmap', 'message')
+
+
+def _normalizePaths(text, mountPoints):
+  """
+  Replace in text the mount points by the device mounted on them, like <sda1>/boot/vmlinuz,
+  so that configurations generated with different temporary mount points could be compared.
+  mountPoints is a dict device → mount point.
+  """
+  for (dev, mp) in sorted(mountPoints.items(), key=lambda i: len(i[1]), reverse=True):
+    if mp.rstrip('/'):
+      text = text.replace(mp.rstrip('/') + '/', '<{0}>/'.format(dev))
+  return text
+
+
+# (x, y, color depth, vesa mode number) for each known resolution, None if there is no vesa mode.
+_vesaModes = (
+    (320, 200, 4, None),
+    (640, 400, 4, None),
+    (640, 480, 4, None),
+    (800, 500, 4, None),
+    (800, 600, 4, 770),
+    (1024, 640, 4, None),
+    (896, 672, 4, None),
+    (1152, 720, 4, None),
+    (1024, 768, 4, 772),
+    (1440, 900, 4, None),
+    (1280, 1024, 4, 774),
+    (1400, 1050, 4, None),
+    (1600, 1200, 4, None),
+    (1920, 1200, 4, None),
+    (320, 200, 8, None),
+    (640, 400, 8, 768),
+    (640, 480, 8, 769),
+    (800, 500, 8, 879),
+    (800, 600, 8, 771),
+    (1024, 640, 8, 874),
+    (896, 672, 8, 815),
+    (1152, 720, 8, 869),
+    (1024, 768, 8, 773),
+    (1440, 900, 8, 864),
+    (1280, 1024, 8, 775),
+    (1400, 1050, 8, 835),
+    (1600, 1200, 8, 796),
+    (1920, 1200, 8, 893),
+    (320, 200, 15, 781),
+    (640, 400, 15, 801),
+    (640, 480, 15, 784),
+    (800, 500, 15, 880),
+    (800, 600, 15, 787),
+    (1024, 640, 15, 875),
+    (896, 672, 15, 816),
+    (1152, 720, 15, 870),
+    (1024, 768, 15, 790),
+    (1440, 900, 15, 865),
+    (1280, 1024, 15, 793),
+    (1400, 1050, 15, None),
+    (1600, 1200, 15, 797),
+    (1920, 1200, 15, None),
+    (320, 200, 16, 782),
+    (640, 400, 16, 802),
+    (640, 480, 16, 785),
+    (800, 500, 16, 881),
+    (800, 600, 16, 788),
+    (1024, 640, 16, 876),
+    (896, 672, 16, 817),
+    (1152, 720, 16, 871),
+    (1024, 768, 16, 791),
+    (1440, 900, 16, 866),
+    (1280, 1024, 16, 794),
+    (1400, 1050, 16, 837),
+    (1600, 1200, 16, 798),
+    (1920, 1200, 16, None),
+    (320, 200, 24, 783),
+    (640, 400, 24, 803),
+    (640, 480, 24, 786),
+    (800, 500, 24, 882),
+    (800, 600, 24, 789),
+    (1024, 640, 24, 877),
+    (896, 672, 24, 818),
+    (1152, 720, 24, 872),
+    (1024, 768, 24, 792),
+    (1440, 900, 24, 867),
+    (1280, 1024, 24, 795),
+    (1400, 1050, 24, 838),
+    (1600, 1200, 24, 799),
+    (1920, 1200, 24, None),
+    (320, 200, 32, None),
+    (640, 400, 32, 804),
+    (640, 480, 32, 809),
+    (800, 500, 32, 883),
+    (800, 600, 32, 814),
+    (1024, 640, 32, 878),
+    (896, 672, 32, 819),
+    (1152, 720, 32, 873),
+    (1024, 768, 32, 824),
+    (1440, 900, 32, 868),
+    (1280, 1024, 32, 829),
+    (1400, 1050, 32, None),
+    (1600, 1200, 32, 834),
+    (1920, 1200, 32, None),
+  )
+# vesa modes ordered by vertical size desc, horizontal size desc, color depth desc.
+_vesaIndex = tuple(sorted([m for m in _vesaModes if m[3]], key=itemgetter(1, 0, 2), reverse=True))
+_vesaCache = {}
+
+
+def _findVesaMode(xRes, yRes, deep):
+  """
+  Return the biggest vesa mode (x, y, color depth, mode number) fitting in the resolution and color depth, or None.
+  """
+  key = (xRes, yRes, deep)
+  if key not in _vesaCache:
+    _vesaCache[key] = None
+    for vesaMode in _vesaIndex:
+      (x, y, d, m) = vesaMode
+      if y <= yRes and x <= xRes and d <= deep:
+        _vesaCache[key] = vesaMode
+        break
+  return _vesaCache[key]
+
+
+def _listDir(path):
+  """
+  Return the list of (name, type) in the directory path, type being one of extfs.FILE, DIRECTORY, SYMLINK or OTHER.
+  With scandir, the types come from the directory read itself, without a stat per entry.
+  An empty list is returned if path cannot be read.
+  """
+  entries = []
+  try:
+    if scandir:
+      for e in scandir(path):
+        if e.is_symlink():
+          t = extfs.SYMLINK
+        elif e.is_dir(follow_symlinks=False):
+          t = extfs.DIRECTORY
+        elif e.is_file(follow_symlinks=False):
+          t = extfs.FILE
+        else:
+          t = extfs.OTHER
+        entries.append((e.name, t))
+    else:
+      for name in os.listdir(path):
+        mode = os.lstat(os.path.join(path, name)).st_mode
+        if stat.S_ISLNK(mode):
+          t = extfs.SYMLINK
+        elif stat.S_ISDIR(mode):
+          t = extfs.DIRECTORY
+        elif stat.S_ISREG(mode):
+          t = extfs.FILE
+        else:
+          t = extfs.OTHER
+        entries.append((name, t))
+  except OSError:
+    pass
+  return entries
+
+
+def _getBootFiles(bootDir, entries):
+  """
+  Return (kernelList, initrdList), the paths in bootDir of the regular files vmlinuz* and initr* among the (name, type) entries.
+  """
+  kernelList = []
+  initrdList = []
+  for (name, t) in entries:
+    if t == extfs.FILE:
+      if name.startswith('vmlinuz'):
+        kernelList.append(os.path.join(bootDir, name))
+      elif name.startswith('initr'):
+        initrdList.append(os.path.join(bootDir, name))
+  return (sorted(kernelList), sorted(initrdList))
+
+
+def _naturalKey(text):
+  """
+  Sort key comparing the numbers in text by value: 4.4.9 < 4.4.10.
+  """
+  return [(0, int(part), '') if part.isdigit() else (1, 0, part) for part in re.split(r'(\d+)', text)]
 
 
 class Lilo:
   isTest = False
+  workers = DEFAULT_WORKERS
+  uuidDir = '/dev/disk/by-uuid'
+  fbSysfsDir = '/sys/class/graphics/fb0'
   _prefix = None
   _tmp = None
   _mbrDevice = None
   _bootPartition = None
   _partitions = None
-  _bootsMounted = []
+  _mounted = None
+  _bootFiles = None
+  _bootDevices = None
+  _uuids = None
+  _sectionCache = None
   _cfgTemplate = """# LILO configuration file
 # Generated by BootSetup
 #
@@ -91,10 +319,17 @@ vga = {vga}
     self.isTest = isTest
     self._prefix = "bootsetup.lilo-"
     self._tmp = tempfile.mkdtemp(prefix=self._prefix)
+    self._mounted = {}
+    self._bootFiles = {}
+    self._bootDevices = {}
+    self._uuids = {}
+    self._sectionCache = {}
     slt.mounting._tempMountDir = os.path.join(self._tmp, 'mounts')
     self.__debug("tmp dir = " + self._tmp)
 
   def __del__(self):
+    if self._mounted:
+      self._umountAll()
     if self._tmp and os.path.exists(self._tmp):
       self.__debug("cleanning " + self._tmp)
       try:
@@ -119,98 +354,267 @@ vga = {vga}
   def getConfigurationPath(self):
     return os.path.join(self._tmp, "lilo.conf")
 
+  @profiler.profiled('lilo.mountBootPartition')
   def _mountBootPartition(self):
     """
     Return the mount point
     """
     self.__debug("bootPartition = " + self._bootPartition)
-    if slt.isMounted(self._bootPartition):
-      self.__debug("bootPartition already mounted")
-      mp = slt.getMountPoint(self._bootPartition)
-    else:
-      self.__debug("bootPartition not mounted")
-      mp = slt.mountDevice(self._bootPartition)
-    if mp:
-      self._mountBootInPartition(mp)
-    return mp
+    return self._mountPartition(self._bootPartition)
 
-  def _mountBootInPartition(self, mountPoint):
+  def _getBootFromFstab(self, fstab):
+    """
+    Return (device, fs type) of the /boot entry of fstab, or (None, None) if there is none.
+    A UUID=… or LABEL=… device is resolved, so the device has the same key in the mount pool as when /boot is read without mounting it.
+    """
+    with codecs.open(fstab, 'r', 'utf-8', 'replace') as f:
+      (bootSpec, bootType) = extfs.find_boot_entry(f)
+    if bootSpec:
+      return (extfs.resolve_device(bootSpec), bootType)
+    return (None, None)
+
+  def _mountBootInPartition(self, mountPoint, acquired):
+    """
+    Mount the /boot of the partition mounted on mountPoint, if it is a separate partition.
+    The device acquired from the mount pool is added to acquired.
+    """
     # assume that if the mount_point is /, any /boot directory is already accessible/mounted
     fstab = os.path.join(mountPoint, 'etc/fstab')
     bootdir = os.path.join(mountPoint, 'boot')
     if mountPoint != '/' and os.path.exists(fstab) and os.path.exists(bootdir):
       self.__debug("mp != / and etc/fstab + boot exists, will try to mount /boot by reading fstab")
       try:
-        self.__debug('set -- $(grep /boot {fstab}) && echo "$1,$3"'.format(fstab=fstab))
-        (bootDev, bootType) = slt.execGetOutput('set -- $(grep /boot {fstab}) && echo "$1,$3"'.format(fstab=fstab), shell=True)[0].split(',')
-        if bootDev and not os.path.ismount(bootdir):
-          mp = slt.mountDevice(bootDev, fsType=bootType, mountPoint=bootdir)
+        (bootDev, bootType) = self._getBootFromFstab(fstab)
+        if bootDev and (bootDev in pool or not os.path.ismount(bootdir)):
+          mp = pool.acquire(bootDev, bootType, bootdir)
           if mp:
-            self._bootsMounted.append(mp)
+            acquired.append(bootDev)
             self.__debug("/boot mounted in " + mp)
       except:
         pass
 
-  def _mountPartitions(self, mountPointList):
+  def _mountPartition(self, dev):
     """
-    Fill a list of mount points for each partition
+    Return the mount point of the partition dev (like /dev/sda1), with its /boot mounted in, or None.
+    The partition stays mounted, for the next configuration or the installation, until it is released.
     """
-    if self._partitions:
-      partitionsToMount = [p for p in self._partitions if p[2] == "linux"]
-      self.__debug("mount partitions: " + unicode(partitionsToMount))
-      for p in partitionsToMount:
-        dev = os.path.join("/dev", p[0])
-        self.__debug("mount partition " + dev)
-        if slt.isMounted(dev):
-          mp = slt.getMountPoint(dev)
-        else:
-          mp = slt.mountDevice(dev)
-        self.__debug("mount partition " + dev + " => " + unicode(mp))
-        if mp:
-          mountPointList[p[0]] = mp
-          self._mountBootInPartition(mp)
-        else:
+    if dev in self._mounted:
+      return self._mounted[dev][0]
+    self.__debug("mount partition " + dev)
+    mp = pool.acquire(dev)
+    self.__debug("mount partition " + dev + " => " + unicode(mp))
+    if mp:
+      acquired = [dev]
+      self._mountBootInPartition(mp, acquired)
+      self._mounted[dev] = (mp, acquired)
+    return mp
+
+  def _releasePartition(self, dev):
+    (mp, acquired) = self._mounted.pop(dev)
+    for d in reversed(acquired):
+      self.__debug("release " + d)
+      pool.release(d)
+
+  def _getLinuxDevices(self):
+    devices = []
+    for p in self._partitions or []:
+      if p[2] == "linux" and p[0] not in devices:
+        devices.append(p[0])
+    return devices
+
+  def _readBootFiles(self, dev):
+    """
+    Return (kernelList, initrdList) of the partition dev (like /dev/sda1), read without mounting it,
+    with the paths they will have once mounted, or None if the partition has to be mounted to find them.
+    """
+    if dev in self._mounted or slt.isMounted(dev):
+      return None
+    try:
+      (bootDev, entries) = extfs.list_boot(dev)
+    except (EnvironmentError, ValueError) as e:
+      self.__debug("cannot read {0} without mounting it: {1}".format(dev, e))
+      return None
+    self._bootDevices[dev] = bootDev
+    if bootDev and (bootDev in pool or slt.isMounted(bootDev)):
+      return None
+    return _getBootFiles(os.path.join(pool.get_mount_point(dev), 'boot'), entries)
+
+  def _getKernelSetFingerprint(self, dev):
+    """
+    Return a value which changes when the kernels and initrds of the partition dev (like /dev/sda1) could have changed,
+    or None if it cannot be known without scanning its /boot.
+    A mounted partition is fingerprinted by its /boot directory, which is modified when a file is added, removed or renamed.
+    An unmounted ext partition is fingerprinted by its superblock, and the one of its separate /boot partition, as it cannot change without being mounted.
+    """
+    if dev in self._mounted:
+      mp = self._mounted[dev][0]
+    elif slt.isMounted(dev):
+      mp = slt.getMountPoint(dev)
+    else:
+      mp = None
+    if mp:
+      try:
+        st = os.stat(os.path.join(mp, 'boot'))
+      except OSError:
+        return None
+      return ('mounted', mp, st.st_dev, st.st_ino, st.st_mtime)
+    if dev not in self._bootDevices:
+      return None
+    indicators = tuple(change_indicator(d) for d in (dev, self._bootDevices[dev]) if d)
+    if not all(i and i.startswith('ext:') for i in indicators):
+      return None
+    return ('unmounted', pool.get_mount_point(dev)) + indicators
+
+  def _getSectionKey(self, partition, fingerprints):
+    """
+    Return the key of the sections of partition in the section cache, or None if they cannot be cached.
+    """
+    (d, fs, bootType, label) = partition[:4]
+    if bootType == 'linux':
+      fingerprint = fingerprints.get(d)
+      if fingerprint is None:
+        return None
+    else:
+      fingerprint = ()
+    return (d, fs, bootType, label, fingerprint)
+
+  @profiler.profiled('lilo.scanPartitions')
+  def _scanPartitions(self, mountPointList, devices):
+    """
+    Fill a list of mount points for each partition of devices, and the boot files of those which can be read without mounting them.
+    The other partitions are mounted.
+    """
+    self._bootFiles = {}
+    toMount = []
+    for d in devices:
+      dev = os.path.join("/dev", d)
+      bootFiles = self._readBootFiles(dev)
+      if bootFiles is None:
+        toMount.append(d)
+      else:
+        self.__debug("boot files of {0} read without mounting it".format(dev))
+        self._bootFiles[dev] = bootFiles
+        mountPointList[d] = pool.get_mount_point(dev)
+    self._mountPartitions(mountPointList, toMount)
+
+  @profiler.profiled('lilo.mountPartitions')
+  def _mountPartitions(self, mountPointList, devices=None):
+    """
+    Fill a list of mount points for each partition, or only for devices if specified.
+    Partitions mounted for the previous configuration are reused, the ones not selected anymore are released.
+    New partitions are mounted concurrently. If any of them cannot be mounted, the ones just mounted are released.
+    """
+    if devices is None:
+      devices = self._getLinuxDevices()
+    selected = set(os.path.join("/dev", d) for d in self._getLinuxDevices())
+    selected.add(self._bootPartition)
+    for dev in [dev for dev in self._mounted if dev not in selected]:
+      self._releasePartition(dev)
+    newDevices = [os.path.join("/dev", d) for d in devices if os.path.join("/dev", d) not in self._mounted]
+    self.__debug("mount partitions: " + unicode(newDevices))
+    try:
+      mountPoints = parallel_map(self._mountPartition, newDevices, self.workers)
+      for (dev, mp) in zip(newDevices, mountPoints):
+        if not mp:
           raise Exception("Cannot mount {d}".format(d=dev))
+    except:
+      for dev in newDevices:
+        if dev in self._mounted:
+          self._releasePartition(dev)
+      raise
+    for d in devices:
+      mountPointList[d] = self._mounted[os.path.join("/dev", d)][0]
 
-  def _umountAll(self, mountPoint, mountPointList):
+  @profiler.profiled('lilo.umountAll')
+  def _umountAll(self):
+    """
+    Release every partition acquired from the mount pool, which will unmount them once idle.
+    """
     self.__debug("umountAll")
-    if mountPoint:
-      for mp in self._bootsMounted:
-        self.__debug("umounting " + unicode(mp))
-        slt.umountDevice(mp, deleteMountPoint=False)
-      self._bootsMounted = []
-      if mountPointList:
-        self.__debug("umount other mount points: " + unicode(mountPointList))
-        for mp in mountPointList.values():
-          if mp == mountPoint:
-            continue  # skip it, will be unmounted just next
-          self.__debug("umount " + unicode(mp))
-          slt.umountDevice(mp)
-      if mountPoint != '/':
-        self.__debug("main mount point ≠ '/' → umount " + mountPoint)
-        slt.umountDevice(mountPoint)
+    for dev in list(self._mounted):
+      self._releasePartition(dev)
 
+  @profiler.profiled('lilo.createLiloSections')
   def _createLiloSections(self, mountPointList):
     """
     Return a list of lilo section string for each partition.
     There could be more section than partitions if there are multiple kernels.
+    The sections of a partition are taken from the section cache if its device, fs, boot type, label and kernel set did not change,
+    only the other partitions are scanned.
     """
     sections = []
+    cache = {}
     if self._partitions:
+      linuxDevices = self._getLinuxDevices()
+      fingerprints = dict((d, self._getKernelSetFingerprint(os.path.join("/dev", d))) for d in linuxDevices)
+      staleDevices = set(p[0] for p in self._partitions if self._getSectionKey(p, fingerprints) not in self._sectionCache)
+      staleDevices = [d for d in linuxDevices if d in staleDevices]
+      self.__debug("partitions to scan: " + unicode(staleDevices))
+      self._scanPartitions(mountPointList, staleDevices)
+      self._resolveUuids([os.path.join("/dev", d) for d in staleDevices])
+      for d in staleDevices:
+        fingerprints[d] = self._getKernelSetFingerprint(os.path.join("/dev", d))
       for p in self._partitions:
-        device = os.path.join("/dev", p[0])
-        fs = p[1]
-        bootType = p[2]
-        label = p[3]
-        if bootType == 'chain':
-          sections.append(self._getChainLiloSection(device, label))
-        elif bootType == 'linux':
-          mp = mountPointList[p[0]]
-          sections.extend(self._getLinuxLiloSections(device, fs, mp, label))
+        key = self._getSectionKey(p, fingerprints)
+        if key in self._sectionCache:
+          self.__debug("cached sections for " + unicode(p))
+          partitionSections = self._sectionCache[key]
         else:
-          sys.err.write("The boot type {type} is not supported.\n".format(type=bootType))
+          partitionSections = self._getPartitionLiloSections(p, mountPointList)
+        if key is not None:
+          cache[key] = partitionSections
+        sections.extend(partitionSections)
+    self._sectionCache = cache
     return sections
 
+  def _getPartitionLiloSections(self, partition, mountPointList):
+    """
+    Return the list of lilo section strings of partition.
+    """
+    device = os.path.join("/dev", partition[0])
+    fs = partition[1]
+    bootType = partition[2]
+    label = partition[3]
+    if bootType == 'chain':
+      return [self._getChainLiloSection(device, label)]
+    elif bootType == 'linux':
+      mp = mountPointList[partition[0]]
+      return self._getLinuxLiloSections(device, fs, mp, label)
+    else:
+      sys.err.write("The boot type {type} is not supported.\n".format(type=bootType))
+      return []
+
+  def _resolveUuids(self, devices):
+    """
+    Find the UUID of every device (like /dev/sda1) not resolved yet in this session,
+    by reading /dev/disk/by-uuid, then with a single blkid call for the ones not found there.
+    """
+    missing = [d for d in devices if d not in self._uuids]
+    if not missing:
+      return
+    uuidPerName = read_uuids(self.uuidDir)
+    for d in missing:
+      self._uuids[d] = uuidPerName.get(os.path.basename(d))
+    missing = [d for d in missing if not self._uuids[d]]
+    if missing:
+      self.__debug("blkid for " + unicode(missing))
+      try:
+        output = slt.execGetOutput(['/sbin/blkid', '-s', 'UUID'] + missing, shell=False)
+      except sp.CalledProcessError:
+        output = []  # blkid fails if no device has a UUID
+      for line in output:
+        m = re.match(r'^(\S+): UUID="([^"]*)"', line)
+        if m and m.group(1) in self._uuids:
+          self._uuids[m.group(1)] = m.group(2)
+
+  def _getUuid(self, device):
+    """
+    Return the UUID of device (like /dev/sda1), or None if it has none.
+    """
+    if device not in self._uuids:
+      self._resolveUuids([device])
+    return self._uuids[device]
+
   def _getChainLiloSection(self, device, label):
     """
     Returns a string for a chainloaded section
@@ -227,17 +631,16 @@ vga = {vga}
     """
     sections = []
     self.__debug("Section 'linux' for " + device + "/" + fs + ", mounted on " + mp + " with label: " + label)
-    kernelList = sorted(glob.glob("{mp}/boot/vmlinuz*".format(mp=mp)))
-    initrdList = sorted(glob.glob("{mp}/boot/initr*".format(mp=mp)))
-    for l in (kernelList, initrdList):
-      for el in l:
-        if os.path.isdir(el) or os.path.islink(el):
-          l.remove(el)
+    if device in self._bootFiles:
+      (kernelList, initrdList) = self._bootFiles[device]
+    else:
+      bootDir = os.path.join(mp, 'boot')
+      (kernelList, initrdList) = _getBootFiles(bootDir, _listDir(bootDir))
     self.__debug("kernelList: " + unicode(kernelList))
     self.__debug("initrdList: " + unicode(initrdList))
-    uuid = slt.execGetOutput(['/sbin/blkid', '-s', 'UUID', '-o', 'value', device], shell=False)
+    uuid = self._getUuid(device)
     if uuid:
-      rootDevice = "/dev/disk/by-uuid/{uuid}".format(uuid=uuid[0])
+      rootDevice = "/dev/disk/by-uuid/{uuid}".format(uuid=uuid)
     else:
       rootDevice = device
     self.__debug("rootDevice = " + rootDevice)
@@ -262,146 +665,48 @@ vga = {vga}
     return sections
 
   def _getKernelInitrdCouples(self, kernelList, initrdList, labelRef):
+    """
+    Return a list of (kernel, initrd or None, label), kernels being in natural version order.
+    An initrd is paired with the kernel of the same version, like vmlinuz-4.4.1 with initrd-4.4.1.gz.
+    """
     ret = []
     if kernelList:
+      initrdPerVersion = {}
+      for i in sorted(initrdList, key=_naturalKey):
+        initrdPerVersion.setdefault(_getVersion(i, _initrdPrefixes, _initrdExtensions), i)
       if len(kernelList) == 1:
-        initrd = None
-        if initrdList:
-          initrd = initrdList[0]  # assume the only initrd match the only kernel
-        ret.append([kernelList[0], initrd, labelRef])
+        initrd = initrdPerVersion.get(_getVersion(kernelList[0], _kernelPrefixes))
+        if not initrd and initrdList:
+          initrd = initrdList[0]  # assume it matches the only kernel, like initrd.gz for vmlinuz-huge-4.4.14
+        ret.append((kernelList[0], initrd, labelRef))
       else:
         labelBase = labelRef[0:15 - 2] + "-"
-        n = 0
-        for kernel in kernelList:
-          n += 1
-          kernelSuffix = os.path.basename(kernel).replace("vmlinuz", "")
-          initrd = None
-          for i in initrdList:
-            if kernelSuffix in i:  # find the matching initrd
-              initrd = i
-              break
+        kernels = sorted(kernelList, key=lambda k: _naturalKey(_getVersion(k, _kernelPrefixes)))
+        for (n, kernel) in enumerate(kernels, 1):
+          initrd = initrdPerVersion.get(_getVersion(kernel, _kernelPrefixes))
           ret.append((kernel, initrd, labelBase + unicode(n)))
     return ret
 
+  @profiler.profiled('lilo.getFrameBufferConf')
   def _getFrameBufferConf(self):
     """
-    Return the frame buffer configuration for this hardware.
+    Return the frame buffer configuration for this hardware, read from sysfs (fbSysfsDir).
     Format: (fb, label)
     """
-    try:
-      fbGeometry = slt.execGetOutput("/usr/sbin/fbset | grep -w geometry")
-    except CalledProcessError:
-      self.__debug("Impossible to determine frame buffer mode, default to text.")
-      fbGeometry = None
     mode = None
     label = None
-    if fbGeometry:
-      vesaModes = [
-          (320, 200, 4, None),
-          (640, 400, 4, None),
-          (640, 480, 4, None),
-          (800, 500, 4, None),
-          (800, 600, 4, 770),
-          (1024, 640, 4, None),
-          (896, 672, 4, None),
-          (1152, 720, 4, None),
-          (1024, 768, 4, 772),
-          (1440, 900, 4, None),
-          (1280, 1024, 4, 774),
-          (1400, 1050, 4, None),
-          (1600, 1200, 4, None),
-          (1920, 1200, 4, None),
-          (320, 200, 8, None),
-          (640, 400, 8, 768),
-          (640, 480, 8, 769),
-          (800, 500, 8, 879),
-          (800, 600, 8, 771),
-          (1024, 640, 8, 874),
-          (896, 672, 8, 815),
-          (1152, 720, 8, 869),
-          (1024, 768, 8, 773),
-          (1440, 900, 8, 864),
-          (1280, 1024, 8, 775),
-          (1400, 1050, 8, 835),
-          (1600, 1200, 8, 796),
-          (1920, 1200, 8, 893),
-          (320, 200, 15, 781),
-          (640, 400, 15, 801),
-          (640, 480, 15, 784),
-          (800, 500, 15, 880),
-          (800, 600, 15, 787),
-          (1024, 640, 15, 875),
-          (896, 672, 15, 816),
-          (1152, 720, 15, 870),
-          (1024, 768, 15, 790),
-          (1440, 900, 15, 865),
-          (1280, 1024, 15, 793),
-          (1400, 1050, 15, None),
-          (1600, 1200, 15, 797),
-          (1920, 1200, 15, None),
-          (320, 200, 16, 782),
-          (640, 400, 16, 802),
-          (640, 480, 16, 785),
-          (800, 500, 16, 881),
-          (800, 600, 16, 788),
-          (1024, 640, 16, 876),
-          (896, 672, 16, 817),
-          (1152, 720, 16, 871),
-          (1024, 768, 16, 791),
-          (1440, 900, 16, 866),
-          (1280, 1024, 16, 794),
-          (1400, 1050, 16, 837),
-          (1600, 1200, 16, 798),
-          (1920, 1200, 16, None),
-          (320, 200, 24, 783),
-          (640, 400, 24, 803),
-          (640, 480, 24, 786),
-          (800, 500, 24, 882),
-          (800, 600, 24, 789),
-          (1024, 640, 24, 877),
-          (896, 672, 24, 818),
-          (1152, 720, 24, 872),
-          (1024, 768, 24, 792),
-          (1440, 900, 24, 867),
-          (1280, 1024, 24, 795),
-          (1400, 1050, 24, 838),
-          (1600, 1200, 24, 799),
-          (1920, 1200, 24, None),
-          (320, 200, 32, None),
-          (640, 400, 32, 804),
-          (640, 480, 32, 809),
-          (800, 500, 32, 883),
-          (800, 600, 32, 814),
-          (1024, 640, 32, 878),
-          (896, 672, 32, 819),
-          (1152, 720, 32, 873),
-          (1024, 768, 32, 824),
-          (1440, 900, 32, 868),
-          (1280, 1024, 32, 829),
-          (1400, 1050, 32, None),
-          (1600, 1200, 32, 834),
-          (1920, 1200, 32, None),
-        ]
-      values = fbGeometry[0].strip().split(' ')
-      self.__debug("FB Values: " + unicode(values))
-      xRes = int(values[1])
-      yRes = int(values[2])
-      deep = int(values[-1])
-      xMax = None
-      yMax = None
-      dMax = None
-      # order the vesa modes by vertical size desc, horizontal size desc, color depth desc.
-      for vesaMode in sorted(vesaModes, key=itemgetter(1, 0, 2), reverse=True):
-        (x, y, d, m) = vesaMode
-        if m:
-          self.__debug("trying {0} for y, {1} for x and {2} for d".format(y, x, d))
-          if y <= yRes and x <= xRes and d <= deep:
-            xMax = x
-            yMax = y
-            dMax = d
-            mode = m
-            break
-      if mode:
+    try:
+      with codecs.open(os.path.join(self.fbSysfsDir, 'virtual_size'), 'r', 'utf-8') as f:
+        (xRes, yRes) = [int(v) for v in f.read().strip().split(',')]
+      with codecs.open(os.path.join(self.fbSysfsDir, 'bits_per_pixel'), 'r', 'utf-8') as f:
+        deep = int(f.read().strip())
+    except (EnvironmentError, ValueError):
+      self.__debug("Impossible to determine frame buffer mode, default to text.")
+    else:
+      self.__debug("FB Values: {0}x{1}x{2}".format(xRes, yRes, deep))
+      vesaMode = _findVesaMode(xRes, yRes, deep)
+      if vesaMode:
+        (xMax, yMax, dMax, mode) = vesaMode
         self.__debug("Max mode found: {x}×{y}×{d}".format(x=xMax, y=yMax, d=dMax))
         label = "{x}x{y}x{d}".format(x=xMax, y=yMax, d=dMax)
     if not mode:
@@ -409,26 +714,63 @@ vga = {vga}
       label = 'text'
     return (mode, label)
 
+  def _fileExists(self, path):
+    """
+    Return True if path exists, looking for it in the partition which will be mounted on its mount point if it is not mounted yet.
+    A file which cannot be looked for without mounting its partition is assumed to exist.
+    """
+    if os.path.exists(path):
+      return True
+    for d in self._getLinuxDevices():
+      dev = os.path.join("/dev", d)
+      if dev in self._mounted or slt.isMounted(dev):
+        continue
+      prefix = pool.get_mount_point(dev).rstrip('/') + '/'
+      if path.startswith(prefix):
+        relPath = path[len(prefix):]
+        if relPath.startswith('boot/') and self._bootDevices.get(dev):
+          (dev, relPath) = (self._bootDevices[dev], relPath[len('boot/'):])
+        try:
+          fs = extfs.ExtFs(dev)
+        except (EnvironmentError, ValueError):
+          return True
+        with fs:
+          try:
+            fs.lookup(relPath)
+          except EnvironmentError:
+            return False
+          except ValueError:
+            return True
+        return True
+    return False
+
+  @profiler.profiled('lilo.checkConfiguration')
+  def checkConfiguration(self):
+    """
+    Return the list of problems found in the configuration file, without running lilo, or an empty list if it looks valid.
+    The files it references are looked for in the partitions of the last configuration, even those not mounted.
+    """
+    with codecs.open(self.getConfigurationPath(), 'r', 'utf-8', 'replace') as f:
+      return liloconf.validate(f, self._fileExists)
+
+  @profiler.profiled('lilo.createConfiguration')
   def createConfiguration(self, mbrDevice, bootPartition, partitions):
     """
     partitions format: [device, filesystem, boot type, label]
+    Partitions are not mounted when their /boot can be read directly, the installation will mount them.
+    The other partitions are kept mounted for the installation: only the ones which selection changed will be mounted or released then.
+    Calling it again only scans the partitions whose sections are not in the section cache, e.g. after a label change.
     """
     self._mbrDevice = os.path.join("/dev", mbrDevice)
     self._bootPartition = os.path.join("/dev", bootPartition)
     self._partitions = partitions
-    self._bootsMounted = []
     self.__debug("partitions: " + unicode(self._partitions))
-    mp = None
-    mpList = None
     try:
-      mp = self._mountBootPartition()
-      if not mp:
-        raise Exception("Cannot mount the main boot partition.")
+      mp = pool.get_mount_point(self._bootPartition)
       self.__debug("mp = " + unicode(mp))
       mpList = {}
-      self._mountPartitions(mpList)
-      self.__debug("mount point lists: " + unicode(mpList))
       liloSections = self._createLiloSections(mpList)
+      self.__debug("mount point lists: " + unicode(mpList))
       self.__debug("lilo sections: " + unicode(liloSections))
       (fb, fbLabel) = self._getFrameBufferConf()
       self.__debug("frame buffer mode = " + unicode(fb) + " " + unicode(fbLabel))
@@ -438,17 +780,91 @@ vga = {vga}
         f.write(s)
         f.write("\n")
       f.close()
-    finally:
-      self._umountAll(mp, mpList)
+    except:
+      self._umountAll()
+      raise
+
+  def _getMountPoints(self):
+    """
+    Return a dict device → mount point of the partitions mounted for the configuration.
+    """
+    return dict((dev, mp) for (dev, (mp, acquired)) in self._mounted.items())
 
+  def _getFingerprints(self, cfg, mountPoints):
+    """
+    Return a dict normalized path → [size, mtime] of the files referenced by the configuration text cfg, None for a missing file.
+    """
+    (globalOptions, sections, errors) = liloconf.parse(cfg.splitlines())
+    paths = [o.value for o in globalOptions if o.key in _fingerprintedOptions]
+    for section in sections:
+      if section.kind == 'image':
+        paths.append(section.value)
+      paths.extend([o.value for o in section.options if o.key in _fingerprintedOptions])
+    fingerprints = {}
+    for path in [p for p in paths if p]:
+      try:
+        st = os.stat(path)
+        fingerprints[_normalizePaths(path, mountPoints)] = [st.st_size, int(st.st_mtime)]
+      except OSError:
+        fingerprints[_normalizePaths(path, mountPoints)] = None
+    return fingerprints
+
+  def _hasLiloBootSector(self):
+    """
+    Return True if the boot sector of the MBR device is still the one of LiLo.
+    """
+    try:
+      with io.open(self._mbrDevice, 'rb') as f:
+        sector = f.read(512)
+    except EnvironmentError:
+      return False
+    return b'LILO' in sector[2:10]
+
+  def _isInstalled(self, mp):
+    """
+    Return True if lilo has already been run with the current configuration from the boot partition mounted on mp:
+    the configuration, the files it references and the MBR device did not change since.
+    """
+    try:
+      with codecs.open(self.getConfigurationPath(), 'r', 'utf-8') as f:
+        cfg = f.read()
+      with codecs.open(os.path.join(mp, _installedConfigPath), 'r', 'utf-8') as f:
+        installedCfg = f.read()
+      with codecs.open(os.path.join(mp, _fingerprintsPath), 'r', 'utf-8') as f:
+        installed = json.load(f)
+    except (EnvironmentError, ValueError):
+      return False
+    if not isinstance(installed, dict) or installed.get('mbr') != self._mbrDevice:
+      return False
+    mountPoints = self._getMountPoints()
+    if _normalizePaths(cfg, mountPoints) != _normalizePaths(installedCfg, installed.get('mounts') or {}):
+      self.__debug("the configuration changed since the last installation")
+      return False
+    if self._getFingerprints(cfg, mountPoints) != installed.get('files'):
+      self.__debug("a kernel or an initrd changed since the last installation")
+      return False
+    return self._hasLiloBootSector()
+
+  def _saveFingerprints(self, mp):
+    """
+    Store next to the installed configuration what is needed to detect that it is already installed.
+    """
+    mountPoints = self._getMountPoints()
+    with codecs.open(self.getConfigurationPath(), 'r', 'utf-8') as f:
+      cfg = f.read()
+    installed = {'mbr': self._mbrDevice, 'mounts': mountPoints, 'files': self._getFingerprints(cfg, mountPoints)}
+    with codecs.open(os.path.join(mp, _fingerprintsPath), 'w', 'utf-8') as f:
+      f.write(json.dumps(installed, indent=2, sort_keys=True))
+
+  @profiler.profiled('lilo.install')
   def install(self):
     """
     Assuming that last configuration editing didn't modified mount point.
+    The partitions mounted by createConfiguration are reused, and released once done.
+    Return False if lilo has not been run because the configuration is already installed, True otherwise.
+    An exception is raised if lilo fails.
     """
     if self._mbrDevice:
-      self._bootsMounted = []
-      mp = None
-      mpList = None
       try:
         mp = self._mountBootPartition()
         if not mp:
@@ -457,19 +873,32 @@ vga = {vga}
         mpList = {}
         self._mountPartitions(mpList)
         self.__debug("mount point lists: " + unicode(mpList))
+        if self._isInstalled(mp):
+          self.__debug("lilo.conf and the files it references did not change since the last installation, lilo is not run")
+          return False
         # copy the configuration to the boot_partition
         try:
           self.__debug("create etc/bootsetup directory in " + mp)
           os.makedirs(os.path.join(mp, 'etc/bootsetup'))
         except os.error:
           pass
+        try:
+          os.remove(os.path.join(mp, _fingerprintsPath))
+        except OSError:
+          pass
         self.__debug("copy lilo.conf to etc/bootsetup")
-        shutil.copyfile(self.getConfigurationPath(), os.path.join(mp, '/etc/bootsetup/lilo.conf'))
+        shutil.copyfile(self.getConfigurationPath(), os.path.join(mp, _installedConfigPath))
         # run lilo
         if self.isTest:
           self.__debug('/sbin/lilo -t -v -C {mp}/etc/bootsetup/lilo.conf'.format(mp=mp))
           slt.execCall('/sbin/lilo -t -v -C {mp}/etc/bootsetup/lilo.conf'.format(mp=mp))
         else:
-          slt.execCall('/sbin/lilo -C {mp}/etc/bootsetup/lilo.conf'.format(mp=mp))
+          # run directly to get its exit code, libsalt does not give it
+          with profiler.phase('cmd:lilo'):
+            returnCode = sp.call('/sbin/lilo -C {mp}/etc/bootsetup/lilo.conf'.format(mp=mp), shell=True)
+          if returnCode != 0:
+            raise Exception("lilo failed with the exit code {0}.".format(returnCode))
+          self._saveFingerprints(mp)
+        return True
       finally:
-        self._umountAll(mp, mpList)
+        self._umountAll()
@@ -0,0 +1,237 @@
+#!/usr/bin/env python
+# coding: utf-8
+# vim:et:sta:sts=2:sw=2:ts=2:tw=0:
+"""
+lilo.conf parser and validator.
+It catches the common mistakes of a generated or hand-edited configuration without running lilo:
+unknown or misplaced options, missing values, invalid or duplicate labels and missing files.
+"""
+from __future__ import unicode_literals, print_function, division, absolute_import
+
+import os
+
+MAX_LABEL_LENGTH = 15
+
+# options only allowed before the first section
+GLOBAL_OPTIONS = frozenset([
+    'backup', 'bios', 'bios-passes-dl', 'bitmap', 'bmp-colors', 'bmp-retain', 'bmp-table', 'bmp-timer', 'boot',
+    'change-rules', 'compact', 'cylinders', 'default', 'delay', 'disk', 'disktab', 'el-torito-bootable-CD',
+    'fix-table', 'force-backup', 'geometric', 'heads', 'hidden', 'ignore-table', 'inaccessible', 'install',
+    'keytable', 'large-memory', 'lba32', 'linear', 'map', 'max-partitions', 'menu-scheme', 'menu-title', 'message',
+    'nodevcache', 'nokbdefault', 'noraid', 'normal', 'nowarn', 'prompt', 'raid-extra-boot', 'reset', 'sectors',
+    'serial', 'small-memory', 'static-bios-codes', 'suppress-boot-time-BIOS-data', 'timeout', 'type', 'unattended',
+    'verbose',
+  ])
+# options only allowed in an image or other section
+SECTION_OPTIONS = frozenset([
+    'activate', 'alias', 'automatic', 'boot-as', 'change', 'deactivate', 'fallback', 'label', 'literal', 'loader',
+    'lock', 'map-drive', 'master-boot', 'noinitrd', 'nokbdisable', 'partition', 'range', 'set', 'table', 'to',
+    'unsafe', 'vmdefault', 'vmdisable', 'vmwarn',
+  ])
+# options allowed in both places
+COMMON_OPTIONS = frozenset([
+    'addappend', 'append', 'bypass', 'initrd', 'mandatory', 'optional', 'password', 'ramdisk', 'read-only',
+    'read-write', 'restricted', 'root', 'single-key', 'vga',
+  ])
+# options without value
+FLAG_OPTIONS = frozenset([
+    'activate', 'automatic', 'bmp-retain', 'bypass', 'change', 'change-rules', 'compact', 'deactivate',
+    'el-torito-bootable-CD', 'fix-table', 'geometric', 'ignore-table', 'inaccessible', 'large-memory', 'lba32',
+    'linear', 'lock', 'mandatory', 'master-boot', 'nodevcache', 'noinitrd', 'nokbdefault', 'nokbdisable', 'noraid',
+    'nowarn', 'optional', 'prompt', 'read-only', 'read-write', 'reset', 'restricted', 'single-key', 'small-memory',
+    'static-bios-codes', 'suppress-boot-time-BIOS-data', 'unattended', 'unsafe', 'vmdefault', 'vmdisable', 'vmwarn',
+  ])
+# options which value is a file or a device that must exist
+PATH_OPTIONS = frozenset(['bitmap', 'boot', 'image', 'initrd', 'message', 'other'])
+# options which could be given for each disk and each of its partitions, for each type of a change-rules block
+# or for each drive of a map-drive swap
+REPEATABLE_OPTIONS = frozenset([
+    'bios', 'cylinders', 'disk', 'heads', 'hidden', 'inaccessible', 'map-drive', 'max-partitions', 'normal', 'partition',
+    'sectors', 'set', 'to', 'type',
+  ])
+SECTION_KINDS = ('image', 'other')
+
+
+class Option:
+  """
+  A key, its value (None for a flag) and the line where it is defined.
+  """
+  key = None
+  value = None
+  line = None
+
+  def __init__(self, key, value, line):
+    self.key = key
+    self.value = value
+    self.line = line
+
+
+class Section:
+  """
+  An image or other section, with its options.
+  """
+  kind = None
+  value = None
+  line = None
+  options = None
+
+  def __init__(self, kind, value, line):
+    self.kind = kind
+    self.value = value
+    self.line = line
+    self.options = []
+
+  def get(self, key):
+    """
+    Return the value of the option key, or None if it is not defined.
+    """
+    for option in self.options:
+      if option.key == key:
+        return option.value
+    return None
+
+  def get_labels(self):
+    """
+    Return the list of (label, line) of the section: its label, or the file name of its image, and its aliases.
+    """
+    labels = []
+    label = [o for o in self.options if o.key == 'label']
+    if label:
+      labels.append((label[0].value, label[0].line))
+    elif self.kind == 'image' and self.value:
+      labels.append((os.path.basename(self.value), self.line))
+    labels.extend([(o.value, o.line) for o in self.options if o.key == 'alias'])
+    return labels
+
+
+def tokenize(text):
+  """
+  Split a line without its comment into words, '=' and quoted strings, returned without their quotes.
+  ValueError is raised if a quote is not closed.
+  """
+  tokens = []
+  pos = 0
+  while pos < len(text):
+    c = text[pos]
+    if c.isspace():
+      pos += 1
+    elif c == '=':
+      tokens.append('=')
+      pos += 1
+    elif c == '"':
+      end = text.find('"', pos + 1)
+      if end == -1:
+        raise ValueError("unterminated quoted string")
+      tokens.append(text[pos + 1:end])
+      pos = end + 1
+    else:
+      end = pos
+      while end < len(text) and not text[end].isspace() and text[end] not in '="':
+        end += 1
+      tokens.append(text[pos:end])
+      pos = end
+  return tokens
+
+
+def _strip_comment(line):
+  quoted = False
+  for (pos, c) in enumerate(line):
+    if c == '"':
+      quoted = not quoted
+    elif c == '#' and not quoted:
+      return line[:pos]
+  return line
+
+
+def parse(lines):
+  """
+  Return (global options, sections, errors) of the lilo.conf lines.
+  errors is a list of (line number, message) for the lines that cannot be parsed.
+  """
+  globalOptions = []
+  sections = []
+  errors = []
+  for (number, line) in enumerate(lines, 1):
+    try:
+      tokens = tokenize(_strip_comment(line))
+    except ValueError as e:
+      errors.append((number, "{0}".format(e)))
+      continue
+    while tokens:
+      key = tokens.pop(0)
+      value = None
+      if key == '=':
+        errors.append((number, "'=' without option name"))
+        continue
+      if tokens and tokens[0] == '=':
+        tokens.pop(0)
+        if not tokens or tokens[0] == '=':
+          errors.append((number, "no value given to '{0}'".format(key)))
+          continue
+        value = tokens.pop(0)
+      if key in SECTION_KINDS:
+        sections.append(Section(key, value, number))
+      elif sections:
+        sections[-1].options.append(Option(key, value, number))
+      else:
+        globalOptions.append(Option(key, value, number))
+  return (globalOptions, sections, errors)
+
+
+def _check_options(options, allowed, place, file_exists):
+  errors = []
+  seen = set()
+  for option in options:
+    if option.key in allowed or option.key in COMMON_OPTIONS:
+      if option.key in FLAG_OPTIONS and option.value is not None:
+        errors.append((option.line, "'{0}' does not take a value".format(option.key)))
+      elif option.key not in FLAG_OPTIONS and option.value is None:
+        errors.append((option.line, "'{0}' needs a value".format(option.key)))
+      elif option.key in PATH_OPTIONS and not file_exists(option.value):
+        errors.append((option.line, "{0} not found".format(option.value)))
+      if option.key in seen and option.key not in REPEATABLE_OPTIONS and option.key != 'alias':
+        errors.append((option.line, "'{0}' is defined more than once".format(option.key)))
+      seen.add(option.key)
+    elif option.key in GLOBAL_OPTIONS or option.key in SECTION_OPTIONS:
+      errors.append((option.line, "'{0}' is not allowed {1}".format(option.key, place)))
+    else:
+      errors.append((option.line, "unknown option '{0}'".format(option.key)))
+  return errors
+
+
+def validate(lines, file_exists=os.path.exists):
+  """
+  Return the list of problems found in the lilo.conf lines, as 'line N: message' strings, empty if it looks valid.
+  file_exists is called to check the files and devices referenced by the configuration.
+  """
+  lines = list(lines)
+  (globalOptions, sections, errors) = parse(lines)
+  errors.extend(_check_options(globalOptions, GLOBAL_OPTIONS, "in the global section", file_exists))
+  if not [o for o in globalOptions if o.key == 'boot']:
+    errors.append((1, "no 'boot' option in the global section"))
+  if not sections:
+    errors.append((len(lines), "no image nor other section"))
+  labels = {}
+  for section in sections:
+    if section.value is None:
+      errors.append((section.line, "'{0}' needs a value".format(section.kind)))
+    elif not file_exists(section.value):
+      errors.append((section.line, "{0} not found".format(section.value)))
+    errors.extend(_check_options(section.options, SECTION_OPTIONS, "in an image or other section", file_exists))
+    if section.kind == 'other' and not section.get('label'):
+      errors.append((section.line, "the other section of {0} has no label".format(section.value)))
+    for (label, line) in section.get_labels():
+      if not label:
+        continue
+      if len(label) > MAX_LABEL_LENGTH:
+        errors.append((line, "the label '{0}' is more than {1} characters long".format(label, MAX_LABEL_LENGTH)))
+      if ' ' in label:
+        errors.append((line, "the label '{0}' contains spaces".format(label)))
+      if label in labels:
+        errors.append((line, "the label '{0}' is already used line {1}".format(label, labels[label])))
+      else:
+        labels[label] = line
+  for option in globalOptions:
+    if option.key == 'default' and option.value and option.value not in labels:
+      errors.append((option.line, "the default label '{0}' does not exist".format(option.value)))
+  return ["line {0}: {1}".format(line, message) for (line, message) in sorted(errors, key=lambda e: e[0])]
@@ -0,0 +1,289 @@
+#!/usr/bin/env python
+# coding: utf-8
+# vim:et:sta:sts=2:sw=2:ts=2:tw=0:
+"""
+Session-wide pool of mounted partitions.
+A partition is mounted on its first acquisition and then shared: a reference count tracks its users.
+When it is not used anymore, it is kept mounted until the idle timeout or the end of the session,
+so acquiring the same partition again costs nothing.
+"""
+from __future__ import unicode_literals, print_function, division, absolute_import
+
+import os
+import tempfile
+import threading
+from contextlib import contextmanager
+import libsalt as slt
+
+
+def plan_teardown(mountPoints):
+  """
+  Return the mount points as a list of batches to unmount in order.
+  A mount point comes in a later batch than every mount point inside it,
+  so the mount points of a batch are independent and could be unmounted at once.
+  """
+  heights = {}
+  for mp in sorted(set(mountPoints), key=len, reverse=True):
+    prefix = mp.rstrip('/') + '/'
+    heights[mp] = max([heights[other] + 1 for other in heights if other.startswith(prefix)] or [0])
+  batches = [[] for n in range(max(heights.values()) + 1)] if heights else []
+  for mp in sorted(heights):
+    batches[heights[mp]].append(mp)
+  return batches
+
+
+def umount_all(mountPoints):
+  """
+  Unmount the mount points, with one umount invocation per batch of independent mount points.
+  A mount point still mounted after its batch is unmounted on its own.
+  """
+  for batch in plan_teardown(mountPoints):
+    try:
+      slt.execCall(['umount'] + batch, shell=False)
+    except Exception:
+      pass
+    for mp in batch:
+      if os.path.ismount(mp):
+        try:
+          slt.umountDevice(mp, deleteMountPoint=False)
+        except Exception:
+          pass
+
+
+class Mount:
+  """
+  A partition in the pool.
+  owned is False if the partition was already mounted outside the pool: it is then never unmounted.
+  unmounting is an event set once the partition is unmounted, None if it is not being unmounted.
+  """
+  device = None
+  mount_point = None
+  owned = False
+  nested = False
+  refs = 0
+  lock = None
+  timer = None
+  unmounting = None
+
+  def __init__(self, device):
+    self.device = device
+    self.lock = threading.Lock()
+
+
+class MountPool:
+  """
+  Reference-counted mounts, unmounted idle_timeout seconds after their last release (never if None)
+  or when the pool is closed.
+  """
+  idle_timeout = 30
+  _mounts = None
+  _order = None
+  _lock = None
+  _tmp = None
+
+  def __init__(self, idle_timeout=30):
+    self.idle_timeout = idle_timeout
+    self._mounts = {}
+    self._order = []
+    self._lock = threading.Lock()
+
+  def __contains__(self, device):
+    with self._lock:
+      return device in self._mounts
+
+  def _get_temp_mount_point(self, device):
+    if not self._tmp:
+      self._tmp = tempfile.mkdtemp(prefix='bootsetup.mounts-')
+    mp = os.path.join(self._tmp, os.path.basename(device))
+    if not os.path.isdir(mp):
+      os.makedirs(mp)
+    return mp
+
+  def get_mount_point(self, device):
+    """
+    Return where device is mounted, or where acquire will mount it, without mounting it.
+    """
+    with self._lock:
+      mount = self._mounts.get(device)
+      if mount and mount.mount_point:
+        return mount.mount_point
+    if slt.isMounted(device):
+      return slt.getMountPoint(device)
+    return self._get_temp_mount_point(device)
+
+  def acquire(self, device, fsType=None, mountPoint=None):
+    """
+    Return the mount point of device (like /dev/sda1), mounting it if needed, or None if it cannot be mounted.
+    mountPoint could be given to mount device on a specific directory, like the /boot of another mounted partition.
+    If device is already in the pool somewhere else, it is moved to mountPoint, or None is returned if it cannot be moved.
+    Each successful acquisition must be followed by a release.
+    If device is being unmounted, wait for it to be unmounted before mounting it again.
+    """
+    while True:
+      with self._lock:
+        mount = self._mounts.get(device)
+        if not mount or not mount.unmounting:
+          if not mount:
+            mount = self._mounts[device] = Mount(device)
+          mount.refs += 1
+          if mount.timer:
+            mount.timer.cancel()
+            mount.timer = None
+          break
+        unmounting = mount.unmounting
+      unmounting.wait()
+    with mount.lock:
+      if not mount.mount_point:
+        try:
+          if slt.isMounted(device):
+            mount.mount_point = slt.getMountPoint(device)
+            mount.owned = False
+          else:
+            mount.nested = mountPoint is not None
+            mount.mount_point = slt.mountDevice(device, fsType=fsType, mountPoint=mountPoint or self._get_temp_mount_point(device))
+            mount.owned = True
+        except Exception:
+          mount.mount_point = None
+        if mount.mount_point:
+          with self._lock:
+            self._order.append(mount)
+      mp = mount.mount_point
+      if mp and mountPoint and os.path.realpath(mp) != os.path.realpath(mountPoint):
+        mp = self._move(mount, mountPoint)
+    if not mp:
+      self.release(device)
+    return mp
+
+  def _move(self, mount, mountPoint):
+    """
+    Move the mount to mountPoint and return it, or None if it cannot be moved:
+    it is used by someone else, it was not mounted by the pool or other partitions are mounted inside.
+    The lock of mount must be held.
+    """
+    prefix = mount.mount_point.rstrip('/') + '/'
+    with self._lock:
+      if mount.refs > 1 or not mount.owned or [m for m in self._order if m.mount_point.startswith(prefix)]:
+        return None
+    try:
+      slt.execCall(['mount', '--move', mount.mount_point, mountPoint], shell=False)
+    except Exception:
+      return None
+    if os.path.realpath(slt.getMountPoint(mount.device) or '') != os.path.realpath(mountPoint):
+      return None
+    if not mount.nested:
+      try:
+        os.rmdir(mount.mount_point)
+      except OSError:
+        pass
+    mount.mount_point = mountPoint
+    mount.nested = True
+    with self._lock:  # it is now inside the partition mounted on mountPoint, so it has to be unmounted before
+      self._order.remove(mount)
+      self._order.append(mount)
+    return mountPoint
+
+  def release(self, device):
+    """
+    Give back device. It is unmounted later, once it is idle.
+    """
+    with self._lock:
+      mount = self._mounts.get(device)
+      if not mount or mount.refs <= 0:
+        return
+      mount.refs -= 1
+      if mount.refs:
+        return
+      if not mount.mount_point:
+        del self._mounts[device]
+      elif self.idle_timeout is not None:
+        mount.timer = threading.Timer(self.idle_timeout, self._expire, [mount])
+        mount.timer.daemon = True
+        mount.timer.start()
+
+  @contextmanager
+  def mounted(self, device, fsType=None, mountPoint=None):
+    """
+    Context manager giving the mount point of device, or None if it cannot be mounted.
+    """
+    mp = self.acquire(device, fsType, mountPoint)
+    try:
+      yield mp
+    finally:
+      if mp:
+        self.release(device)
+
+  def _expire(self, mount):
+    with self._lock:
+      if mount.refs or mount.unmounting or self._mounts.get(mount.device) is not mount:
+        return
+      if mount.owned:
+        prefix = mount.mount_point.rstrip('/') + '/'
+        for m in self._order:
+          if m.mount_point.startswith(prefix) and m.refs:  # something mounted inside is still used, try later
+            mount.timer = threading.Timer(self.idle_timeout, self._expire, [mount])
+            mount.timer.daemon = True
+            mount.timer.start()
+            return
+        mounts = [m for m in reversed(self._order) if m is mount or m.mount_point.startswith(prefix)]
+      else:
+        mounts = [mount]
+      self._detach(mounts)
+    self._umount(mounts)
+    self._drop(mounts)
+
+  def _detach(self, mounts):
+    """
+    Mark the mounts as being unmounted. They stay in the pool until dropped, so that acquire waits for them.
+    The pool lock must be held.
+    """
+    for m in mounts:
+      if m.timer:
+        m.timer.cancel()
+        m.timer = None
+      m.unmounting = threading.Event()
+      self._order.remove(m)
+
+  def _drop(self, mounts):
+    """
+    Remove the detached mounts from the pool, once unmounted.
+    """
+    with self._lock:
+      for m in mounts:
+        if self._mounts.get(m.device) is m:
+          del self._mounts[m.device]
+    for m in mounts:
+      m.unmounting.set()
+
+  def _umount(self, mounts):
+    mounts = [m for m in mounts if m.owned]
+    umount_all([m.mount_point for m in mounts])
+    for m in mounts:
+      if not m.nested:
+        try:
+          os.rmdir(m.mount_point)
+        except OSError:
+          pass
+
+  def close(self):
+    """
+    Unmount every partition mounted by the pool, the most recent first, whether it is still used or not.
+    """
+    with self._lock:
+      mounts = list(reversed(self._order))
+      self._detach(mounts)
+      pending = [m.unmounting for m in self._mounts.values() if m.unmounting and m not in mounts]
+    self._umount(mounts)
+    self._drop(mounts)
+    for unmounting in pending:  # unmounted by an idle timer
+      unmounting.wait()
+    if self._tmp:
+      # never remove recursively: a partition could have failed to unmount
+      for path in [os.path.join(self._tmp, name) for name in os.listdir(self._tmp)] + [self._tmp]:
+        try:
+          os.rmdir(path)
+        except OSError:
+          pass
+      self._tmp = None
+
+
+pool = MountPool()
@@ -0,0 +1,124 @@
+#!/usr/bin/env python
+# coding: utf-8
+# vim:et:sta:sts=2:sw=2:ts=2:tw=0:
+"""
+Persistent cache of the os-prober results, per partition.
+An entry is keyed by the partition UUID and a cheap change indicator, so it is reused only if the filesystem has not been touched since.
+"""
+from __future__ import unicode_literals, print_function, division, absolute_import
+
+import os
+import io
+import codecs
+import json
+import struct
+
+EXT_SUPERBLOCK_OFFSET = 1024
+EXT_MAGIC = 0xEF53
+
+
+def read_uuids(uuid_dir='/dev/disk/by-uuid'):
+  """
+  Return a dict device name → UUID, by reading the by-uuid symlinks.
+  """
+  uuids = {}
+  try:
+    names = os.listdir(uuid_dir)
+  except EnvironmentError:
+    return uuids
+  for uuid in names:
+    target = os.path.realpath(os.path.join(uuid_dir, uuid))
+    uuids[os.path.basename(target)] = uuid
+  return uuids
+
+
+def change_indicator(device_path):
+  """
+  Return a string that changes each time the filesystem on device_path is modified.
+  For ext2/3/4, the superblock write time and mount count are used.
+  Return None if the device cannot be read or holds another filesystem, so that it is probed each time.
+  """
+  try:
+    with io.open(device_path, 'rb') as f:
+      f.seek(EXT_SUPERBLOCK_OFFSET)
+      sb = f.read(64)
+  except EnvironmentError:
+    return None
+  if len(sb) == 64:
+    (mtime, wtime, mnt_count, max_mnt_count, magic) = struct.unpack_from('<IIHhH', sb, 44)
+    if magic == EXT_MAGIC:
+      return "ext:{0}:{1}".format(wtime, mnt_count)
+  return None
+
+
+class ProbeCache:
+  """
+  Store os-prober lines per partition in a JSON file.
+  """
+  cache_dir = None
+  uuid_dir = None
+  _entries = None
+  _uuids = None
+  _dirty = False
+
+  def __init__(self, cache_dir='/var/cache/bootsetup', uuid_dir='/dev/disk/by-uuid'):
+    self.cache_dir = cache_dir
+    self.uuid_dir = uuid_dir
+    self._entries = {}
+    self._uuids = read_uuids(uuid_dir)
+    self._dirty = False
+    try:
+      with codecs.open(self.get_cache_path(), 'r', 'utf-8') as f:
+        entries = json.load(f)
+      if isinstance(entries, dict):
+        self._entries = entries
+    except (EnvironmentError, ValueError):
+      pass
+
+  def get_cache_path(self):
+    return os.path.join(self.cache_dir, 'probes.json')
+
+  def get_key(self, device):
+    """
+    Return the cache key of the device (like sda1) or None if it cannot be cached.
+    """
+    uuid = self._uuids.get(device)
+    if not uuid:
+      return None
+    indicator = change_indicator(os.path.join('/dev', device))
+    if not indicator:
+      return None
+    return "{0}:{1}".format(uuid, indicator)
+
+  def get(self, device):
+    """
+    Return the cached list of probe lines of the device, or None if there is no valid entry.
+    """
+    key = self.get_key(device)
+    if key and key in self._entries:
+      return list(self._entries[key])
+    return None
+
+  def set(self, device, probes):
+    key = self.get_key(device)
+    if key:
+      uuid = self._uuids[device]
+      for old_key in [k for k in self._entries if k.startswith(uuid + ':')]:
+        del self._entries[old_key]
+      self._entries[key] = list(probes)
+      self._dirty = True
+
+  def save(self):
+    """
+    Write the cache on disk if it changed. Errors (like a read-only filesystem) are ignored.
+    """
+    if not self._dirty:
+      return
+    try:
+      if not os.path.isdir(self.cache_dir):
+        os.makedirs(self.cache_dir)
+      with codecs.open(self.get_cache_path(), 'w', 'utf-8') as f:
+        json.dump(self._entries, f, indent=1, sort_keys=True)
+      self._dirty = False
+    except EnvironmentError:
+      pass
@@ -0,0 +1,125 @@
+#!/usr/bin/env python
+# coding: utf-8
+# vim:et:sta:sts=2:sw=2:ts=2:tw=0:
+"""
+Phase timing for BootSetup.
+When enabled (--profile), every phase and external command is timed and a JSON report is written on exit.
+When disabled, timing a phase costs a single test.
+"""
+from __future__ import unicode_literals, print_function, division, absolute_import
+
+import os
+import time
+import json
+import codecs
+import threading
+import functools
+from contextlib import contextmanager
+
+_libsaltFunctions = ('getDisks', 'getDiskInfo', 'getPartitions', 'getPartitionInfo', 'getFsType', 'isMounted', 'getMountPoint', 'mountDevice', 'umountDevice')
+_libsaltCommands = ('execCall', 'execGetOutput')
+
+
+def command_name(cmd):
+  """
+  Return a short name for an external command, given as a string or a list: the program base name.
+  """
+  if isinstance(cmd, (list, tuple)):
+    cmd = cmd[0] if cmd else ''
+  words = "{0}".format(cmd).split()
+  return os.path.basename(words[0]) if words else ''
+
+
+class Profiler:
+  """
+  Accumulate the wall time and the number of calls per phase name.
+  Phases could be timed from several threads and nested: each phase is accounted on its own,
+  so the wall time of a phase run concurrently is the sum of its calls and could exceed the total.
+  """
+  enabled = False
+  _phases = None
+  _lock = None
+  _start = None
+
+  def __init__(self):
+    self._phases = {}
+    self._lock = threading.Lock()
+    self._start = time.time()
+
+  def enable(self):
+    self.enabled = True
+    self._start = time.time()
+
+  def record(self, name, duration):
+    with self._lock:
+      stats = self._phases.setdefault(name, {'calls': 0, 'wall_time': 0.0})
+      stats['calls'] += 1
+      stats['wall_time'] += duration
+
+  @contextmanager
+  def phase(self, name):
+    if not self.enabled:
+      yield
+      return
+    start = time.time()
+    try:
+      yield
+    finally:
+      self.record(name, time.time() - start)
+
+  def wrap(self, fct, name):
+    """
+    Return fct, timed under name.
+    """
+    @functools.wraps(fct)
+    def wrapper(*args, **kwargs):
+      with self.phase(name):
+        return fct(*args, **kwargs)
+    return wrapper
+
+  def profiled(self, name):
+    """
+    Decorator timing a function or a method under name.
+    """
+    def decorator(fct):
+      @functools.wraps(fct)
+      def wrapper(*args, **kwargs):
+        if not self.enabled:
+          return fct(*args, **kwargs)
+        with self.phase(name):
+          return fct(*args, **kwargs)
+      return wrapper
+    return decorator
+
+  def instrument_libsalt(self, slt):
+    """
+    Time the libsalt helpers, and each external command run through libsalt under 'cmd:<program>'.
+    """
+    for fctName in _libsaltFunctions:
+      if hasattr(slt, fctName):
+        setattr(slt, fctName, self.wrap(getattr(slt, fctName), 'libsalt.' + fctName))
+    for fctName in _libsaltCommands:
+      if hasattr(slt, fctName):
+        setattr(slt, fctName, self.wrap_command(getattr(slt, fctName)))
+
+  def wrap_command(self, fct):
+    """
+    Return fct, which first argument is a command, timed under 'cmd:<program>'.
+    """
+    @functools.wraps(fct)
+    def wrapper(cmd, *args, **kwargs):
+      with self.phase('cmd:' + command_name(cmd)):
+        return fct(cmd, *args, **kwargs)
+    return wrapper
+
+  def report(self):
+    with self._lock:
+      phases = dict((name, dict(stats)) for (name, stats) in self._phases.items())
+    return {'total_wall_time': time.time() - self._start, 'phases': phases}
+
+  def write(self, path):
+    with codecs.open(path, 'w', 'utf-8') as f:
+      json.dump(self.report(), f, indent=2, sort_keys=True)
+
+
+profiler = Profiler()
@@ -0,0 +1,108 @@
+#!/usr/bin/env python
+# coding: utf-8
+# vim:et:sta:sts=2:sw=2:ts=2:tw=0:
+"""
+Block devices inventory read directly from /sys, /proc and the udev database.
+It gives the same information as libsalt but without spawning a process per device.
+"""
+from __future__ import unicode_literals, print_function, division, absolute_import
+
+import os
+import codecs
+
+SECTOR_SIZE = 512
+_ignoredDiskPrefixes = ('loop', 'ram', 'zram', 'sr', 'fd', 'md', 'dm-')
+_partitionTableTypes = {'dos': 'msdos'}
+
+
+def _read(path):
+  try:
+    with codecs.open(path, 'r', 'utf-8') as f:
+      return f.read().strip()
+  except EnvironmentError:
+    return None
+
+
+def human_size(size):
+  """
+  Format a size in bytes as a short human readable string, like 20GB.
+  """
+  for unit in ('B', 'KB', 'MB', 'GB', 'TB'):
+    if size < 1000 or unit == 'TB':
+      break
+    size /= 1000
+  if size < 10 and size != int(size):
+    return "{0:.1f}{1}".format(size, unit)
+  else:
+    return "{0}{1}".format(int(round(size)), unit)
+
+
+def _read_proc_partitions(root):
+  """
+  Return a list of (name, major, minor) in the /proc/partitions order.
+  """
+  content = _read(os.path.join(root, 'proc/partitions'))
+  if content is None:
+    raise EnvironmentError("{0} cannot be read".format(os.path.join(root, 'proc/partitions')))
+  devices = []
+  for line in content.splitlines():
+    fields = line.split()
+    if len(fields) == 4 and fields[0].isdigit():
+      devices.append((fields[3], fields[0], fields[1]))
+  return devices
+
+
+def _read_udev_properties(root, major, minor):
+  """
+  Return the udev properties (E: lines) of the block device as a dict.
+  """
+  props = {}
+  content = _read(os.path.join(root, 'run/udev/data', 'b{0}:{1}'.format(major, minor)))
+  if content:
+    for line in content.splitlines():
+      if line.startswith('E:') and '=' in line:
+        (key, value) = line[2:].split('=', 1)
+        props[key] = value
+  return props
+
+
+def _device_size(root, name):
+  size = _read(os.path.join(root, 'sys/class/block', name, 'size'))
+  try:
+    return int(size) * SECTOR_SIZE
+  except (TypeError, ValueError):
+    return 0
+
+
+def get_inventory(root='/'):
+  """
+  Return (disks, partitions) with the same rows as Config.disks and Config.partitions:
+    disks: [device, partition table type, "model (size)"]
+    partitions: [device, filesystem type, "label (size)"]
+  root is the directory where sys, proc and run are looked for.
+  Raise EnvironmentError if the block devices cannot be listed.
+  """
+  blockDir = os.path.join(root, 'sys/block')
+  diskNames = set(name for name in os.listdir(blockDir) if not name.startswith(_ignoredDiskPrefixes) and os.path.exists(os.path.join(blockDir, name, 'device')))
+  disks = []
+  partitions = []
+  partitionsPerDisk = dict((name, []) for name in diskNames)
+  for (name, major, minor) in _read_proc_partitions(root):
+    props = _read_udev_properties(root, major, minor)
+    size = _device_size(root, name)
+    if name in diskNames:
+      model = _read(os.path.join(blockDir, name, 'device/model')) or props.get('ID_MODEL', '')
+      ptType = props.get('ID_PART_TABLE_TYPE', '')
+      disks.append([name, _partitionTableTypes.get(ptType, ptType), "{0} ({1})".format(model, human_size(size))])
+    elif os.path.exists(os.path.join(root, 'sys/class/block', name, 'partition')):
+      disk = None
+      for d in diskNames:
+        if os.path.exists(os.path.join(blockDir, d, name)):
+          disk = d
+          break
+      # skip extended partitions, they are only 1 KiB long, and swap partitions, like libsalt
+      if disk and size > 2 * SECTOR_SIZE and props.get('ID_FS_TYPE') != 'swap':
+        partitionsPerDisk[disk].append([name, props.get('ID_FS_TYPE', ''), "{0} ({1})".format(props.get('ID_FS_LABEL', ''), human_size(size))])
+  for d in disks:
+    partitions.extend(partitionsPerDisk[d[0]])
+  return (disks, partitions)
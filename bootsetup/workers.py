@@ -0,0 +1,56 @@
+#!/usr/bin/env python
+# coding: utf-8
+# vim:et:sta:sts=2:sw=2:ts=2:tw=0:
+"""
+Bounded thread pool helpers for BootSetup.
+Most of the slow operations (disk inventory, probing, mounting) are spent waiting for external processes,
+so threads are enough to run them concurrently.
+"""
+from __future__ import unicode_literals, print_function, division, absolute_import
+
+import sys
+import threading
+
+DEFAULT_WORKERS = 8
+
+
+def parallel_map(fct, items, max_workers=DEFAULT_WORKERS):
+  """
+  Call fct on each item of items using at most max_workers threads.
+  Return the list of results in the same order as items.
+  If any call raises an exception, the first one (in items order) is raised again once all workers are done.
+  """
+  items = list(items)
+  results = [None] * len(items)
+  errors = [None] * len(items)
+  if not max_workers or max_workers < 1:
+    max_workers = 1
+  if max_workers == 1 or len(items) <= 1:
+    for i, item in enumerate(items):
+      results[i] = fct(item)
+    return results
+  lock = threading.Lock()
+  indexes = iter(range(len(items)))
+
+  def worker():
+    while True:
+      with lock:
+        try:
+          i = next(indexes)
+        except StopIteration:
+          return
+      try:
+        results[i] = fct(items[i])
+      except Exception:
+        errors[i] = sys.exc_info()
+
+  threads = [threading.Thread(target=worker) for n in range(min(max_workers, len(items)))]
+  for t in threads:
+    t.daemon = True
+    t.start()
+  for t in threads:
+    t.join()
+  for error in errors:
+    if error:
+      raise error[1]
+  return results
@@ -0,0 +1,12 @@
+# coding: utf-8
+# vim:et:sta:sts=2:sw=2:ts=2:tw=0:
+"""
+BootSetup tests, run from the top directory with: python -m unittest discover -s tests -t .
+libsalt is only available on SaLT systems, so a fake one is registered before any bootsetup module is imported.
+"""
+from __future__ import unicode_literals, print_function, division, absolute_import
+
+import sys
+from . import fakesalt
+
+sys.modules['libsalt'] = fakesalt
@@ -0,0 +1,39 @@
+#!/bin/sh
+# Create the ext image fixtures of test_extfs.py, with e2fsprogs.
+set -e
+cd $(dirname "$0")
+tmp=$(mktemp -d)
+trap 'rm -rf "$tmp"' EXIT
+export E2FSPROGS_FAKE_TIME=1500000000
+root=$tmp/root
+mkdir -p $root/boot/grub $root/etc
+yes vmlinuz-4.4.1 | head -c 20000 > $root/boot/vmlinuz-4.4.1
+yes initrd-4.4.1 | head -c 3000 > $root/boot/initrd-4.4.1.gz
+echo 'CONFIG_EXT4_FS=y' > $root/boot/config-4.4.1
+ln -s vmlinuz-4.4.1 $root/boot/vmlinuz
+echo '/dev/sda1 / ext4 defaults 1 1' > $root/etc/fstab
+mkimage() {
+  name=$1
+  size=$2
+  shift 2
+  rm -f $tmp/$name.img
+  mke2fs -q -F -b 1024 -U 01234567-89ab-cdef-0123-456789abcdef -E root_owner=0:0,hash_seed=01234567-89ab-cdef-0123-456789abcdef "$@" $tmp/$name.img $size
+  gzip -9 -n -c $tmp/$name.img > $name.img.gz
+}
+# extents, 64-bit group descriptors and flex_bg
+mkimage ext4 4M -t ext4 -O 64bit,metadata_csum -d $root
+# block-mapped, with an indirect block for vmlinuz, and directory entries without file type
+mkimage ext2 2M -t ext2 -O ^filetype -d $root
+# small files and directories stored in their inode
+mkimage inline 4M -t ext4 -I 256 -O inline_data -d $root
+# a journal to replay
+cp $tmp/ext4.img $tmp/recover.img
+debugfs -w -R 'feature needs_recovery' $tmp/recover.img > /dev/null 2>&1
+gzip -9 -n -c $tmp/recover.img > recover.img.gz
+# /boot on a separate partition, which UUID is in the fstab of the root partition
+sep=$tmp/sep
+mkdir -p $sep/root/boot $sep/root/etc $sep/boot
+printf '/dev/sda1 / ext4 defaults 1 1\nUUID=76543210-89ab-cdef-0123-456789abcdef /boot ext2 defaults 1 2\n' > $sep/root/etc/fstab
+cp $root/boot/vmlinuz-4.4.1 $root/boot/initrd-4.4.1.gz $sep/boot/
+mkimage separate-root 2M -t ext4 -d $sep/root
+mkimage separate-boot 2M -t ext2 -U 76543210-89ab-cdef-0123-456789abcdef -d $sep/boot
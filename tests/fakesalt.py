@@ -0,0 +1,93 @@
+# coding: utf-8
+# vim:et:sta:sts=2:sw=2:ts=2:tw=0:
+"""
+Fake libsalt for the tests: mounts are only recorded and commands are not run.
+The devices in unmountable cannot be mounted.
+The mount points are created, so the tests could put files in them.
+"""
+from __future__ import unicode_literals, print_function, division, absolute_import
+
+import os
+import tempfile
+import threading
+
+
+class mounting:
+  _tempMountDir = None
+
+
+mounts = {}
+commands = []
+unmountable = set()
+_lock = threading.Lock()
+
+
+def reset():
+  """
+  Forget every mount and command.
+  """
+  with _lock:
+    mounts.clear()
+    del commands[:]
+    unmountable.clear()
+
+
+def isMounted(device):
+  with _lock:
+    return device in mounts
+
+
+def getMountPoint(device):
+  with _lock:
+    return mounts.get(device)
+
+
+def mountDevice(device, fsType=None, mountPoint=None):
+  if device in unmountable:
+    raise Exception("cannot mount " + device)
+  if not mountPoint:
+    mountPoint = tempfile.mkdtemp(prefix='bootsetup.fakesalt-')
+  elif not os.path.isdir(mountPoint):
+    os.makedirs(mountPoint)
+  with _lock:
+    mounts[device] = mountPoint
+  return mountPoint
+
+
+def _unmount(mountPoint):
+  with _lock:
+    for (device, mp) in list(mounts.items()):
+      if mp == mountPoint:
+        del mounts[device]
+
+
+def umountDevice(mountPoint, deleteMountPoint=True):
+  _unmount(mountPoint)
+  if deleteMountPoint:
+    try:
+      os.rmdir(mountPoint)
+    except OSError:
+      pass
+
+
+def execCall(cmd, shell=True, env=None):
+  with _lock:
+    commands.append(cmd)
+  if isinstance(cmd, (list, tuple)) and cmd and cmd[0] == 'umount':
+    for mp in cmd[1:]:
+      _unmount(mp)
+  elif isinstance(cmd, (list, tuple)) and list(cmd[:2]) == ['mount', '--move']:
+    with _lock:
+      for (device, mp) in list(mounts.items()):
+        if mp == cmd[2]:
+          mounts[device] = cmd[3]
+  elif isinstance(cmd, (list, tuple)) and cmd and cmd[0] == 'mount' and cmd[-2] not in unmountable:  # mount [-o options] device mountpoint
+    with _lock:
+      mounts[cmd[-2]] = cmd[-1]
+  return True
+
+
+def execGetOutput(cmd, shell=True):
+  with _lock:
+    commands.append(cmd)
+  return []
@@ -0,0 +1,92 @@
+#!/usr/bin/env python
+# coding: utf-8
+# vim:et:sta:sts=2:sw=2:ts=2:tw=0:
+"""
+Tests of the probes and the boot partitions of the configuration.
+"""
+from __future__ import unicode_literals, print_function, division, absolute_import
+
+import os
+import stat
+import shutil
+import tempfile
+import unittest
+from bootsetup.config import Config
+from . import fakesalt
+
+
+class FakeCache:
+  entries = None
+
+  def __init__(self):
+    self.entries = {}
+
+  def get(self, device):
+    return self.entries.get(device)
+
+  def set(self, device, probes):
+    self.entries[device] = list(probes)
+
+
+class ProbeDevicesTest(unittest.TestCase):
+  tmp = None
+  cfg = None
+
+  def setUp(self):
+    fakesalt.reset()
+    self.tmp = tempfile.mkdtemp(prefix='bootsetup.test-')
+    os.mkdir(os.path.join(self.tmp, 'mounted'))
+    test = os.path.join(self.tmp, 'mounted', '90linux-distro')
+    with open(test, 'w') as f:
+      f.write('#!/bin/sh\necho "$1:Linux:Linux:linux"\n')
+    os.chmod(test, stat.S_IRWXU)
+    self.cfg = Config(None, None, False, False, gather=False)
+    self.cfg.os_probes_dirs = (self.tmp,)
+    self.cfg.rescan = False
+    self.cfg._set_disks_and_partitions([['sda', 'msdos', 'disk']], [['sda1', 'ext4', 'root'], ['sda2', 'ext4', 'home'], ['sda3', 'swap', 'swap']])
+
+  def tearDown(self):
+    shutil.rmtree(self.tmp, True)
+
+  def test_probed_and_cached(self):
+    cache = FakeCache()
+    self.assertEqual(self.cfg._probe_devices(['sda1', 'sda3'], cache, False), ['/dev/sda1:Linux:Linux:linux'])
+    self.assertEqual(cache.entries, {'sda1': ['/dev/sda1:Linux:Linux:linux'], 'sda3': []})
+    self.assertEqual(fakesalt.mounts, {})
+    self.assertEqual(fakesalt.commands[0][:4], ['mount', '-o', 'ro,noload', '/dev/sda1'])
+
+  def test_cache_hit(self):
+    cache = FakeCache()
+    cache.entries['sda1'] = ['/dev/sda1:Cached Linux:Cached:linux']
+    self.assertEqual(self.cfg._probe_devices(['sda1'], cache, False), ['/dev/sda1:Cached Linux:Cached:linux'])
+    self.assertEqual(fakesalt.commands, [])
+
+  def test_mount_failure_not_cached(self):
+    fakesalt.unmountable.add('/dev/sda2')
+    cache = FakeCache()
+    self.assertEqual(self.cfg._probe_devices(['sda1', 'sda2'], cache, False), ['/dev/sda1:Linux:Linux:linux'])
+    self.assertEqual(sorted(cache.entries), ['sda1'])
+    fakesalt.unmountable.clear()
+    self.assertEqual(self.cfg._probe_devices(['sda1', 'sda2'], cache, False), ['/dev/sda1:Linux:Linux:linux', '/dev/sda2:Linux:Linux:linux'])
+
+
+class NumberLabelsTest(unittest.TestCase):
+
+  def _labels(self, labels):
+    cfg = Config(None, None, False, False, gather=False)
+    cfg._set_boot_partitions([['sda{0}'.format(n), 'ntfs', 'chain', 'OS', label] for (n, label) in enumerate(labels, 1)])
+    return [bp.label for bp in cfg.boot_partitions]
+
+  def test_unique(self):
+    self.assertEqual(self._labels(['Windows', 'Salix', 'Win10']), ['Windows', 'Salix', 'Win10'])
+
+  def test_duplicates(self):
+    self.assertEqual(self._labels(['Windows', 'Salix', 'Windows']), ['Windows', 'Salix', 'Windows1'])
+
+  def test_numbered_again(self):
+    # concurrent tests and the probe cache give numbers out of order
+    self.assertEqual(self._labels(['Windows1', 'Windows', 'Windows1']), ['Windows', 'Windows1', 'Windows2'])
+
+
+if __name__ == '__main__':
+  unittest.main()
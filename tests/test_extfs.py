@@ -0,0 +1,118 @@
+#!/usr/bin/env python
+# coding: utf-8
+# vim:et:sta:sts=2:sw=2:ts=2:tw=0:
+"""
+Tests of the ext2/3/4 reader, against the images created by data/make-images.sh.
+"""
+from __future__ import unicode_literals, print_function, division, absolute_import
+
+import os
+import io
+import gzip
+import shutil
+import tempfile
+import unittest
+from bootsetup import extfs
+
+DATA_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'data')
+BOOT_ENTRIES = [
+    ('config-4.4.1', extfs.FILE),
+    ('grub', extfs.DIRECTORY),
+    ('initrd-4.4.1.gz', extfs.FILE),
+    ('vmlinuz', extfs.SYMLINK),
+    ('vmlinuz-4.4.1', extfs.FILE),
+  ]
+
+
+def _content(line, size):
+  data = b''
+  while len(data) < size:
+    data += line + b'\n'
+  return data[:size]
+
+
+class ExtFsTest(unittest.TestCase):
+  tmp = None
+  deviceSpecDirs = None
+
+  def setUp(self):
+    self.tmp = tempfile.mkdtemp(prefix='bootsetup.test-')
+    self.deviceSpecDirs = extfs._deviceSpecDirs
+
+  def tearDown(self):
+    extfs._deviceSpecDirs = self.deviceSpecDirs
+    shutil.rmtree(self.tmp, True)
+
+  def _image(self, name):
+    path = os.path.join(self.tmp, name + '.img')
+    with gzip.open(os.path.join(DATA_DIR, name + '.img.gz'), 'rb') as src:
+      with io.open(path, 'wb') as dst:
+        shutil.copyfileobj(src, dst)
+    return path
+
+  def _checkBoot(self, name):
+    with extfs.ExtFs(self._image(name)) as fs:
+      self.assertEqual(fs.block_size, 1024)
+      self.assertEqual(sorted(fs.list_dir('boot')), BOOT_ENTRIES)
+      self.assertEqual(fs.read_file('boot/vmlinuz-4.4.1'), _content(b'vmlinuz-4.4.1', 20000))
+      self.assertEqual(fs.read_file('/boot/initrd-4.4.1.gz'), _content(b'initrd-4.4.1', 3000))
+      self.assertEqual(fs.read_file('etc/fstab'), b'/dev/sda1 / ext4 defaults 1 1\n')
+      self.assertEqual(fs.lookup('boot/grub')[1], extfs.DIRECTORY)
+      self.assertRaises(EnvironmentError, fs.lookup, 'boot/missing')
+      self.assertRaises(ValueError, fs.read_file, 'boot/grub')
+      self.assertRaises(ValueError, fs.list_dir, 'boot/vmlinuz-4.4.1')
+
+  def test_extents(self):
+    self._checkBoot('ext4')
+
+  def test_block_mapped_without_file_type(self):
+    self._checkBoot('ext2')
+
+  def test_inline_data(self):
+    with extfs.ExtFs(self._image('inline')) as fs:
+      self.assertEqual(sorted(fs.list_dir('boot')), BOOT_ENTRIES)
+      self.assertEqual(fs.read_file('boot/config-4.4.1'), b'CONFIG_EXT4_FS=y\n')
+      self.assertEqual(fs.read_file('boot/vmlinuz-4.4.1'), _content(b'vmlinuz-4.4.1', 20000))
+      # inline directories are not supported
+      self.assertRaises(ValueError, fs.list_dir, 'boot/grub')
+
+  def test_journal_to_replay(self):
+    self.assertRaises(ValueError, extfs.ExtFs, self._image('recover'))
+
+  def test_not_ext(self):
+    path = os.path.join(self.tmp, 'zero.img')
+    with io.open(path, 'wb') as f:
+      f.write(b'\0' * 4096)
+    self.assertRaises(ValueError, extfs.ExtFs, path)
+    self.assertRaises(EnvironmentError, extfs.ExtFs, os.path.join(self.tmp, 'missing.img'))
+
+  def test_list_boot(self):
+    self.assertEqual(sorted(extfs.list_boot(self._image('ext4'))[1]), BOOT_ENTRIES)
+    self.assertEqual(extfs.list_boot(self._image('ext2'))[0], None)
+    self.assertRaises(ValueError, extfs.list_boot, self._image('inline'))
+
+  def test_list_boot_separate(self):
+    root = self._image('separate-root')
+    boot = self._image('separate-boot')
+    os.mkdir(os.path.join(self.tmp, 'by-uuid'))
+    os.symlink(boot, os.path.join(self.tmp, 'by-uuid', '76543210-89ab-cdef-0123-456789abcdef'))
+    extfs._deviceSpecDirs = {'UUID': os.path.join(self.tmp, 'by-uuid')}
+    (bootDevice, entries) = extfs.list_boot(root)
+    self.assertEqual(bootDevice, boot)
+    self.assertEqual(sorted(entries), [('initrd-4.4.1.gz', extfs.FILE), ('lost+found', extfs.DIRECTORY), ('vmlinuz-4.4.1', extfs.FILE)])
+
+  def test_find_boot_entry(self):
+    self.assertEqual(extfs.find_boot_entry(['# /dev/sda2 /boot ext2', '/dev/sda1 / ext4 defaults 1 1']), (None, None))
+    self.assertEqual(extfs.find_boot_entry(['LABEL=boot /boot/ ext2 defaults 1 2']), ('LABEL=boot', 'ext2'))
+
+  def test_resolve_device(self):
+    os.mkdir(os.path.join(self.tmp, 'by-label'))
+    os.symlink('../sdb2', os.path.join(self.tmp, 'by-label', 'boot'))
+    extfs._deviceSpecDirs = {'LABEL': os.path.join(self.tmp, 'by-label')}
+    self.assertEqual(extfs.resolve_device('LABEL="boot"'), os.path.join(self.tmp, 'sdb2'))
+    self.assertEqual(extfs.resolve_device('/dev/sda2'), '/dev/sda2')
+    self.assertEqual(extfs.resolve_device('tmpfs'), 'tmpfs')
+
+
+if __name__ == '__main__':
+  unittest.main()
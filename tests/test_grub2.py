@@ -0,0 +1,100 @@
+#!/usr/bin/env python
+# coding: utf-8
+# vim:et:sta:sts=2:sw=2:ts=2:tw=0:
+"""
+Tests of the detection of an already installed Grub2 core image.
+"""
+from __future__ import unicode_literals, print_function, division, absolute_import
+
+import os
+import io
+import shutil
+import struct
+import random
+import tempfile
+import unittest
+
+from bootsetup.grub2 import Grub2
+
+SECTOR_SIZE = 512
+# offsets in the second sector of core.img, see include/grub/offsets.h of grub
+REED_SOLOMON_REDUNDANCY = 0x10
+NO_REED_SOLOMON_LENGTH = 0x14
+
+
+def _randomBytes(rand, size):
+  return bytes(bytearray(rand.randrange(256) for i in range(size)))
+
+
+def _embed(bootImg, coreImg, sectors, rand):
+  """
+  Return a disk image booting coreImg, patched the way grub-bios-setup embeds it after the MBR:
+  the blocklist of boot.img and of the first sector of core.img are set, the redundancy length field is set
+  and the reed-solomon parity is appended after core.img, up to the end of the embedding area.
+  """
+  mbr = bytearray(bootImg)
+  mbr[0x5C:0x68] = _randomBytes(rand, 0x68 - 0x5C)  # kernel sector, boot drive and drive check
+  mbr[0x1B8:] = _randomBytes(rand, SECTOR_SIZE - 0x1B8)  # disk signature and partition table
+  core = bytearray(coreImg)
+  core[0x1F4:SECTOR_SIZE] = _randomBytes(rand, SECTOR_SIZE - 0x1F4)  # blocklist of diskboot.img
+  redundancy = sectors * SECTOR_SIZE - len(coreImg)
+  core[SECTOR_SIZE + REED_SOLOMON_REDUNDANCY:SECTOR_SIZE + REED_SOLOMON_REDUNDANCY + 4] = struct.pack(str('<I'), redundancy)
+  parity = _randomBytes(rand, redundancy)
+  return bytes(mbr) + bytes(core) + parity + b'\0' * SECTOR_SIZE * 4
+
+
+class CoreImageTest(unittest.TestCase):
+  grub2 = None
+  tmp = None
+  grubDir = None
+  bootImg = None
+  coreImg = None
+  rand = None
+
+  def setUp(self):
+    self.rand = random.Random(0)
+    self.tmp = tempfile.mkdtemp(prefix='bootsetup.test-')
+    self.grubDir = os.path.join(self.tmp, 'i386-pc')
+    os.mkdir(self.grubDir)
+    self.bootImg = _randomBytes(self.rand, SECTOR_SIZE)
+    core = bytearray(_randomBytes(self.rand, 60 * SECTOR_SIZE + 123))
+    core[SECTOR_SIZE + REED_SOLOMON_REDUNDANCY:SECTOR_SIZE + NO_REED_SOLOMON_LENGTH + 4] = struct.pack(str('<II'), 0, 0x1000)
+    self.coreImg = bytes(core)
+    with io.open(os.path.join(self.grubDir, 'boot.img'), 'wb') as f:
+      f.write(self.bootImg)
+    with io.open(os.path.join(self.grubDir, 'core.img'), 'wb') as f:
+      f.write(self.coreImg)
+    self.grub2 = Grub2(False)
+
+  def tearDown(self):
+    del self.grub2
+    shutil.rmtree(self.tmp, True)
+
+  def _writeDisk(self, disk):
+    path = os.path.join(self.tmp, 'disk.img')
+    with io.open(path, 'wb') as f:
+      f.write(disk)
+    return path
+
+  def test_embedded_core_image(self):
+    disk = self._writeDisk(_embed(self.bootImg, self.coreImg, 63, self.rand))
+    self.assertTrue(self.grub2._isCoreImageInstalled(disk, self.grubDir))
+
+  def test_other_core_image(self):
+    disk = bytearray(_embed(self.bootImg, self.coreImg, 63, self.rand))
+    disk[3 * SECTOR_SIZE] ^= 0xFF
+    self.assertFalse(self.grub2._isCoreImageInstalled(self._writeDisk(bytes(disk)), self.grubDir))
+
+  def test_other_boot_code(self):
+    disk = bytearray(_embed(self.bootImg, self.coreImg, 63, self.rand))
+    disk[0x100] ^= 0xFF
+    self.assertFalse(self.grub2._isCoreImageInstalled(self._writeDisk(bytes(disk)), self.grubDir))
+
+  def test_not_embedded(self):
+    disk = _embed(self.bootImg, self.coreImg, 63, self.rand)
+    disk = disk[:SECTOR_SIZE] + b'\0' * (len(disk) - SECTOR_SIZE)
+    self.assertFalse(self.grub2._isCoreImageInstalled(self._writeDisk(disk), self.grubDir))
+
+
+if __name__ == '__main__':
+  unittest.main()
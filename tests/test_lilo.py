@@ -0,0 +1,187 @@
+#!/usr/bin/env python
+# coding: utf-8
+# vim:et:sta:sts=2:sw=2:ts=2:tw=0:
+"""
+Tests of the LiLo configuration.
+"""
+from __future__ import unicode_literals, print_function, division, absolute_import
+
+import os
+import shutil
+import tempfile
+import unittest
+import libsalt as slt
+from bootsetup import extfs
+from bootsetup.lilo import Lilo, _findVesaMode, _getVersion, _naturalKey, _kernelPrefixes, _initrdPrefixes, _initrdExtensions
+from bootsetup.mountpool import pool
+from . import fakesalt
+
+
+class KernelVersionTest(unittest.TestCase):
+
+  def _kernel(self, name):
+    return _getVersion('/boot/' + name, _kernelPrefixes)
+
+  def _initrd(self, name):
+    return _getVersion('/boot/' + name, _initrdPrefixes, _initrdExtensions)
+
+  def test_salix(self):
+    self.assertEqual(self._kernel('vmlinuz-4.4.1-smp'), '4.4.1-smp')
+    self.assertEqual(self._initrd('initrd-4.4.1-smp.gz'), '4.4.1-smp')
+    self.assertEqual(self._kernel('vmlinuz'), '')
+    self.assertEqual(self._initrd('initrd.gz'), '')
+
+  def test_debian(self):
+    self.assertEqual(self._kernel('vmlinuz-4.9.0-3-amd64'), '4.9.0-3-amd64')
+    self.assertEqual(self._initrd('initrd.img-4.9.0-3-amd64'), '4.9.0-3-amd64')
+
+  def test_fedora(self):
+    self.assertEqual(self._kernel('vmlinuz-4.11.8-300.fc26.x86_64'), '4.11.8-300.fc26.x86_64')
+    self.assertEqual(self._initrd('initramfs-4.11.8-300.fc26.x86_64.img'), '4.11.8-300.fc26.x86_64')
+
+  def test_arch(self):
+    self.assertEqual(self._kernel('vmlinuz-linux'), 'linux')
+    self.assertEqual(self._initrd('initramfs-linux.img'), 'linux')
+    self.assertEqual(self._initrd('initramfs-linux-fallback.img'), 'linux-fallback')
+
+  def test_natural_order(self):
+    self.assertEqual(sorted(['4.4.10', '4.4.9', '4.4', '4.10.1'], key=_naturalKey), ['4.4', '4.4.9', '4.4.10', '4.10.1'])
+
+
+class KernelInitrdCouplesTest(unittest.TestCase):
+
+  def _couples(self, kernels, initrds, label='Salix'):
+    couples = Lilo(False)._getKernelInitrdCouples(['/boot/' + k for k in kernels], ['/boot/' + i for i in initrds], label)
+    return [(os.path.basename(k), i and os.path.basename(i), l) for (k, i, l) in couples]
+
+  def test_single_kernel(self):
+    self.assertEqual(self._couples(['vmlinuz-huge-4.4.14'], ['initrd.gz']), [('vmlinuz-huge-4.4.14', 'initrd.gz', 'Salix')])
+    self.assertEqual(self._couples(['vmlinuz'], []), [('vmlinuz', None, 'Salix')])
+    self.assertEqual(self._couples([], ['initrd.gz']), [])
+
+  def test_single_kernel_matching_initrd(self):
+    self.assertEqual(self._couples(['vmlinuz-linux'], ['initramfs-linux-fallback.img', 'initramfs-linux.img'], 'Arch'),
+                     [('vmlinuz-linux', 'initramfs-linux.img', 'Arch')])
+
+  def test_same_prefix(self):
+    self.assertEqual(self._couples(['vmlinuz-4.4.1', 'vmlinuz-4.4'], ['initrd-4.4.1.gz']), [
+        ('vmlinuz-4.4', None, 'Salix-1'),
+        ('vmlinuz-4.4.1', 'initrd-4.4.1.gz', 'Salix-2'),
+      ])
+
+  def test_natural_order(self):
+    self.assertEqual(self._couples(['vmlinuz-4.4.10', 'vmlinuz-4.4.9'], ['initrd-4.4.9.gz', 'initrd-4.4.10.gz']), [
+        ('vmlinuz-4.4.9', 'initrd-4.4.9.gz', 'Salix-1'),
+        ('vmlinuz-4.4.10', 'initrd-4.4.10.gz', 'Salix-2'),
+      ])
+
+  def test_debian_and_fedora(self):
+    self.assertEqual(self._couples(['vmlinuz-4.9.0-3-amd64', 'vmlinuz-4.9.0-4-amd64'], ['initrd.img-4.9.0-4-amd64', 'initrd.img-4.9.0-3-amd64'], 'Debian'), [
+        ('vmlinuz-4.9.0-3-amd64', 'initrd.img-4.9.0-3-amd64', 'Debian-1'),
+        ('vmlinuz-4.9.0-4-amd64', 'initrd.img-4.9.0-4-amd64', 'Debian-2'),
+      ])
+    self.assertEqual(self._couples(['vmlinuz-4.11.8-300.fc26.x86_64', 'vmlinuz-0-rescue'], ['initramfs-4.11.8-300.fc26.x86_64.img', 'initramfs-0-rescue.img'], 'Fedora'), [
+        ('vmlinuz-0-rescue', 'initramfs-0-rescue.img', 'Fedora-1'),
+        ('vmlinuz-4.11.8-300.fc26.x86_64', 'initramfs-4.11.8-300.fc26.x86_64.img', 'Fedora-2'),
+      ])
+
+  def test_long_label(self):
+    # the labels stay within the 15 characters allowed by lilo
+    self.assertEqual([l for (k, i, l) in self._couples(['vmlinuz-4.4.1', 'vmlinuz-4.4.2'], [], 'SalixLinux14.2')], ['SalixLinux14.-1', 'SalixLinux14.-2'])
+
+
+class FrameBufferTest(unittest.TestCase):
+  lilo = None
+  tmp = None
+
+  def setUp(self):
+    self.tmp = tempfile.mkdtemp(prefix='bootsetup.test-')
+    self.lilo = Lilo(False)
+    self.lilo.fbSysfsDir = self.tmp
+
+  def tearDown(self):
+    shutil.rmtree(self.tmp, True)
+
+  def _writeFb(self, virtualSize, bitsPerPixel):
+    with open(os.path.join(self.tmp, 'virtual_size'), 'w') as f:
+      f.write(virtualSize)
+    with open(os.path.join(self.tmp, 'bits_per_pixel'), 'w') as f:
+      f.write(bitsPerPixel)
+
+  def test_find_vesa_mode(self):
+    self.assertEqual(_findVesaMode(1024, 768, 32), (1024, 768, 32, 824))
+    # the highest mode first, even with less colors
+    self.assertEqual(_findVesaMode(1920, 1080, 32), (1400, 1050, 24, 838))
+    self.assertEqual(_findVesaMode(1024, 768, 16), (1024, 768, 16, 791))
+    self.assertEqual(_findVesaMode(300, 200, 32), None)
+
+  def test_mode(self):
+    self._writeFb('1024,768\n', '32\n')
+    self.assertEqual(self.lilo._getFrameBufferConf(), (824, '1024x768x32'))
+
+  def test_biggest_fitting_mode(self):
+    self._writeFb('1366,768\n', '24\n')
+    self.assertEqual(self.lilo._getFrameBufferConf(), (792, '1024x768x24'))
+
+  def test_missing(self):
+    self.assertEqual(self.lilo._getFrameBufferConf(), ('normal', 'text'))
+    with open(os.path.join(self.tmp, 'virtual_size'), 'w') as f:
+      f.write('1024,768\n')
+    self.assertEqual(self.lilo._getFrameBufferConf(), ('normal', 'text'))
+
+  def test_malformed(self):
+    self._writeFb('1024x768\n', '32\n')
+    self.assertEqual(self.lilo._getFrameBufferConf(), ('normal', 'text'))
+    self._writeFb('1024,768\n', '\n')
+    self.assertEqual(self.lilo._getFrameBufferConf(), ('normal', 'text'))
+
+  def test_too_small(self):
+    self._writeFb('300,200\n', '32\n')
+    self.assertEqual(self.lilo._getFrameBufferConf(), ('normal', 'text'))
+
+
+class MountBootTest(unittest.TestCase):
+  tmp = None
+  deviceSpecDirs = None
+
+  def setUp(self):
+    fakesalt.reset()
+    self.tmp = tempfile.mkdtemp(prefix='bootsetup.test-')
+    self.deviceSpecDirs = extfs._deviceSpecDirs
+    extfs._deviceSpecDirs = {'UUID': os.path.join(self.tmp, 'by-uuid')}
+    os.makedirs(os.path.join(self.tmp, 'by-uuid'))
+    os.symlink('../sdb1', os.path.join(self.tmp, 'by-uuid', '0123-4567'))
+
+  def tearDown(self):
+    pool.close()
+    extfs._deviceSpecDirs = self.deviceSpecDirs
+    shutil.rmtree(self.tmp, True)
+
+  def _createRoot(self, bootSpec):
+    root = os.path.join(self.tmp, 'sda1')
+    os.makedirs(os.path.join(root, 'etc'))
+    os.makedirs(os.path.join(root, 'boot'))
+    with open(os.path.join(root, 'etc', 'fstab'), 'w') as f:
+      f.write("/dev/sda1 / ext4 defaults 1 1\n{0} /boot ext2 defaults 1 2\n".format(bootSpec))
+    return root
+
+  def test_uuid_resolved(self):
+    root = self._createRoot('UUID=0123-4567')
+    bootDev = os.path.join(self.tmp, 'sdb1')
+    self.assertEqual(Lilo(False)._getBootFromFstab(os.path.join(root, 'etc', 'fstab')), (bootDev, 'ext2'))
+    # already in the pool, like after reading the /boot of another partition
+    pool.acquire(bootDev)
+    pool.release(bootDev)
+    acquired = []
+    Lilo(False)._mountBootInPartition(root, acquired)
+    self.assertEqual(acquired, [bootDev])
+    self.assertEqual(slt.getMountPoint(bootDev), os.path.join(root, 'boot'))
+    pool.release(bootDev)
+
+  def test_no_boot_partition(self):
+    root = self._createRoot('#')
+    self.assertEqual(Lilo(False)._getBootFromFstab(os.path.join(root, 'etc', 'fstab')), (None, None))
+
+
+if __name__ == '__main__':
+  unittest.main()
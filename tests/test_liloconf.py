@@ -0,0 +1,193 @@
+#!/usr/bin/env python
+# coding: utf-8
+# vim:et:sta:sts=2:sw=2:ts=2:tw=0:
+"""
+Tests of the lilo.conf parser and validator.
+"""
+from __future__ import unicode_literals, print_function, division, absolute_import
+
+import shutil
+import tempfile
+import unittest
+from bootsetup import liloconf
+from bootsetup.lilo import Lilo
+
+
+def _validate(text, file_exists=lambda path: True):
+  return liloconf.validate(text.splitlines(), file_exists)
+
+
+class TokenizeTest(unittest.TestCase):
+
+  def test_words_and_equal(self):
+    self.assertEqual(liloconf.tokenize('boot=/dev/sda'), ['boot', '=', '/dev/sda'])
+    self.assertEqual(liloconf.tokenize('  timeout = 50'), ['timeout', '=', '50'])
+
+  def test_quoted(self):
+    self.assertEqual(liloconf.tokenize('append = "vt.default_utf8=1 quiet"'), ['append', '=', 'vt.default_utf8=1 quiet'])
+
+  def test_unterminated_quote(self):
+    self.assertRaises(ValueError, liloconf.tokenize, 'append = "quiet')
+
+
+class ParseTest(unittest.TestCase):
+
+  def test_sections(self):
+    (globalOptions, sections, errors) = liloconf.parse([
+        'boot = /dev/sda  # the MBR',
+        'prompt',
+        'image = /boot/vmlinuz',
+        '  label = "Linux"',
+        'other = /dev/sda1 label = Windows',
+      ])
+    self.assertEqual(errors, [])
+    self.assertEqual([(o.key, o.value, o.line) for o in globalOptions], [('boot', '/dev/sda', 1), ('prompt', None, 2)])
+    self.assertEqual([(s.kind, s.value, s.line) for s in sections], [('image', '/boot/vmlinuz', 3), ('other', '/dev/sda1', 5)])
+    self.assertEqual(sections[0].get('label'), 'Linux')
+    self.assertEqual(sections[1].get('label'), 'Windows')
+
+  def test_comment_in_quotes(self):
+    (globalOptions, sections, errors) = liloconf.parse(['menu-title = "Salix #1" # title'])
+    self.assertEqual([(o.key, o.value) for o in globalOptions], [('menu-title', 'Salix #1')])
+
+  def test_errors(self):
+    (globalOptions, sections, errors) = liloconf.parse(['boot =', '= /dev/sda', 'append = "quiet'])
+    self.assertEqual([n for (n, message) in errors], [1, 2, 3])
+
+  def test_labels(self):
+    (globalOptions, sections, errors) = liloconf.parse(['image = /boot/vmlinuz-4.4.1', '  alias = l', 'image = /boot/vmlinuz', '  label = Linux'])
+    self.assertEqual(sections[0].get_labels(), [('vmlinuz-4.4.1', 1), ('l', 2)])
+    self.assertEqual(sections[1].get_labels(), [('Linux', 4)])
+
+
+class ValidateTest(unittest.TestCase):
+
+  def test_generated(self):
+    lilo = Lilo(False)
+    tmp = tempfile.mkdtemp(prefix='bootsetup.test-')
+    try:
+      lilo.uuidDir = tmp
+      lilo._bootFiles['/dev/sda2'] = (['/mnt/sda2/boot/vmlinuz-4.4.9', '/mnt/sda2/boot/vmlinuz-4.4.10'], ['/mnt/sda2/boot/initrd-4.4.10.gz'])
+      cfg = lilo._cfgTemplate.format(boot='/dev/sda', mp='/mnt/sda2', vga='normal # text')
+      cfg += lilo._getChainLiloSection('/dev/sda1', 'Windows') + '\n'
+      cfg += '\n'.join(lilo._getLinuxLiloSections('/dev/sda2', 'ext4', '/mnt/sda2', 'Salix'))
+    finally:
+      shutil.rmtree(tmp, True)
+    self.assertEqual(_validate(cfg), [])
+
+  def test_change_rules(self):
+    self.assertEqual(_validate("""boot = /dev/sda
+change-rules
+  reset
+  type = DOS12
+    normal = 0x01
+    hidden = 0x11
+  type = DOS16_small
+    normal = 0x04
+    hidden = 0x14
+other = /dev/sda1
+  label = dos
+  change
+    partition = /dev/sda1
+      set = DOS12_normal
+    partition = /dev/sda2
+      set = DOS16_small_hidden
+"""), [])
+
+  def test_disk(self):
+    self.assertEqual(_validate("""boot = /dev/sda
+disk = /dev/sda
+  bios = 0x80
+  sectors = 63
+  heads = 255
+disk = /dev/sdb
+  bios = 0x81
+  inaccessible
+image = /boot/vmlinuz
+  label = linux
+"""), [])
+
+  def test_map_drive(self):
+    self.assertEqual(_validate("""boot = /dev/sda
+other = /dev/sdb1
+  label = windows
+  map-drive = 0x80
+    to = 0x81
+  map-drive = 0x81
+    to = 0x80
+"""), [])
+
+  def test_duplicate_label(self):
+    self.assertEqual(_validate("""boot = /dev/sda
+image = /boot/vmlinuz
+  label = linux
+image = /boot/vmlinuz-old
+  label = linux
+"""), ["line 5: the label 'linux' is already used line 3"])
+
+  def test_image_name_as_label(self):
+    self.assertEqual(_validate("""boot = /dev/sda
+image = /boot/vmlinuz
+image = /mnt/boot/vmlinuz
+"""), ["line 3: the label 'vmlinuz' is already used line 2"])
+
+  def test_long_label(self):
+    self.assertEqual(_validate("""boot = /dev/sda
+image = /boot/vmlinuz
+  label = Salix-14.2-kernel
+"""), ["line 3: the label 'Salix-14.2-kernel' is more than 15 characters long"])
+
+  def test_label_with_space(self):
+    self.assertEqual(_validate("""boot = /dev/sda
+other = /dev/sda1
+  label = "Windows 10"
+"""), ["line 3: the label 'Windows 10' contains spaces"])
+
+  def test_duplicate_option(self):
+    self.assertEqual(_validate("""boot = /dev/sda
+timeout = 50
+timeout = 100
+image = /boot/vmlinuz
+  label = linux
+"""), ["line 3: 'timeout' is defined more than once"])
+
+  def test_misplaced_and_unknown(self):
+    self.assertEqual(_validate("""boot = /dev/sda
+label = linux
+image = /boot/vmlinuz
+  label = linux
+  timeout = 50
+  colour = blue
+"""), [
+        "line 2: 'label' is not allowed in the global section",
+        "line 5: 'timeout' is not allowed in an image or other section",
+        "line 6: unknown option 'colour'",
+      ])
+
+  def test_flags_and_values(self):
+    self.assertEqual(_validate("""boot = /dev/sda
+prompt = yes
+image = /boot/vmlinuz
+  label
+"""), ["line 2: 'prompt' does not take a value", "line 4: 'label' needs a value"])
+
+  def test_missing_files(self):
+    self.assertEqual(_validate("""boot = /dev/sda
+image = /boot/vmlinuz
+  label = linux
+  initrd = /boot/initrd.gz
+""", lambda path: path != '/boot/initrd.gz'), ["line 4: /boot/initrd.gz not found"])
+
+  def test_default(self):
+    self.assertEqual(_validate("""boot = /dev/sda
+default = windows
+image = /boot/vmlinuz
+  label = linux
+"""), ["line 2: the default label 'windows' does not exist"])
+
+  def test_no_boot_nor_section(self):
+    self.assertEqual(_validate("prompt\n"), ["line 1: no 'boot' option in the global section", "line 1: no image nor other section"])
+
+
+if __name__ == '__main__':
+  unittest.main()
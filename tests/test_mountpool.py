@@ -0,0 +1,74 @@
+#!/usr/bin/env python
+# coding: utf-8
+# vim:et:sta:sts=2:sw=2:ts=2:tw=0:
+"""
+Tests of the mount pool.
+"""
+from __future__ import unicode_literals, print_function, division, absolute_import
+
+import os
+import shutil
+import tempfile
+import unittest
+import libsalt as slt
+from bootsetup.mountpool import MountPool, plan_teardown
+from . import fakesalt
+
+
+class PlanTeardownTest(unittest.TestCase):
+
+  def test_nested_first(self):
+    self.assertEqual(plan_teardown(['/mnt/a', '/mnt/a/boot', '/mnt/b']), [['/mnt/a/boot', '/mnt/b'], ['/mnt/a']])
+
+
+class MountPoolTest(unittest.TestCase):
+  pool = None
+  tmp = None
+
+  def setUp(self):
+    fakesalt.reset()
+    self.pool = MountPool(idle_timeout=None)
+    self.tmp = tempfile.mkdtemp(prefix='bootsetup.test-')
+
+  def tearDown(self):
+    self.pool.close()
+    shutil.rmtree(self.tmp, True)
+
+  def _acquireRoot(self):
+    mp = self.pool.acquire('/dev/sda1', 'ext4', os.path.join(self.tmp, 'sda1'))
+    os.mkdir(os.path.join(mp, 'boot'))
+    return mp
+
+  def test_shared(self):
+    mp = self.pool.acquire('/dev/sdb1')
+    self.assertEqual(self.pool.acquire('/dev/sdb1'), mp)
+    self.assertEqual(slt.getMountPoint('/dev/sdb1'), mp)
+    self.assertTrue('/dev/sdb1' in self.pool)
+
+  def test_mounted_elsewhere_is_moved(self):
+    mp = self.pool.acquire('/dev/sdb1')
+    self.pool.release('/dev/sdb1')
+    bootDir = os.path.join(self._acquireRoot(), 'boot')
+    self.assertEqual(self.pool.acquire('/dev/sdb1', 'ext4', bootDir), bootDir)
+    self.assertEqual(slt.getMountPoint('/dev/sdb1'), bootDir)
+    self.assertEqual(self.pool.get_mount_point('/dev/sdb1'), bootDir)
+    self.assertFalse(os.path.exists(mp))
+
+  def test_used_elsewhere_is_not_moved(self):
+    mp = self.pool.acquire('/dev/sdb1')
+    bootDir = os.path.join(self._acquireRoot(), 'boot')
+    self.assertEqual(self.pool.acquire('/dev/sdb1', 'ext4', bootDir), None)
+    self.assertEqual(slt.getMountPoint('/dev/sdb1'), mp)
+    self.pool.release('/dev/sdb1')
+    self.assertEqual(self.pool.acquire('/dev/sdb1', 'ext4', bootDir), bootDir)
+
+  def test_close(self):
+    bootDir = os.path.join(self._acquireRoot(), 'boot')
+    self.pool.acquire('/dev/sdb1', 'ext4', bootDir)
+    self.pool.close()
+    self.assertEqual(fakesalt.mounts, {})
+    self.assertEqual(fakesalt.commands[-1], ['umount', os.path.join(self.tmp, 'sda1')])
+
+
+if __name__ == '__main__':
+  unittest.main()
@@ -0,0 +1,57 @@
+#!/usr/bin/env python
+# coding: utf-8
+# vim:et:sta:sts=2:sw=2:ts=2:tw=0:
+"""
+Tests of the change indicator of the probe cache.
+"""
+from __future__ import unicode_literals, print_function, division, absolute_import
+
+import os
+import io
+import shutil
+import struct
+import tempfile
+import unittest
+from bootsetup.probecache import change_indicator, EXT_SUPERBLOCK_OFFSET, EXT_MAGIC
+
+
+class ChangeIndicatorTest(unittest.TestCase):
+  tmp = None
+
+  def setUp(self):
+    self.tmp = tempfile.mkdtemp(prefix='bootsetup.test-')
+
+  def tearDown(self):
+    shutil.rmtree(self.tmp, True)
+
+  def _writeDevice(self, superblock):
+    path = os.path.join(self.tmp, 'device')
+    with io.open(path, 'wb') as f:
+      f.write(b'\0' * EXT_SUPERBLOCK_OFFSET + superblock + b'\0' * 4096)
+    return path
+
+  def _extSuperblock(self, wtime, mntCount):
+    return b'\0' * 44 + struct.pack(str('<IIHhH'), 0, wtime, mntCount, -1, EXT_MAGIC) + b'\0' * 1024
+
+  def test_ext(self):
+    self.assertEqual(change_indicator(self._writeDevice(self._extSuperblock(1500000000, 3))), 'ext:1500000000:3')
+    self.assertEqual(change_indicator(self._writeDevice(self._extSuperblock(1500000060, 4))), 'ext:1500000060:4')
+
+  def test_other_filesystem(self):
+    path = os.path.join(self.tmp, 'device')
+    with io.open(path, 'wb') as f:
+      f.write(b'\xebR\x90NTFS    ' + b'\0' * 8192)  # the size never changes, it cannot tell if the filesystem did
+    self.assertEqual(change_indicator(path), None)
+
+  def test_too_short(self):
+    path = os.path.join(self.tmp, 'device')
+    with io.open(path, 'wb') as f:
+      f.write(b'\0' * 512)
+    self.assertEqual(change_indicator(path), None)
+
+  def test_missing(self):
+    self.assertEqual(change_indicator(os.path.join(self.tmp, 'missing')), None)
+
+
+if __name__ == '__main__':
+  unittest.main()
@@ -0,0 +1,94 @@
+#!/usr/bin/env python
+# coding: utf-8
+# vim:et:sta:sts=2:sw=2:ts=2:tw=0:
+"""
+Tests of the sysfs inventory, against a fake sys, proc and run tree.
+"""
+from __future__ import unicode_literals, print_function, division, absolute_import
+
+import os
+import codecs
+import shutil
+import tempfile
+import unittest
+from bootsetup import sysfs
+
+
+class InventoryTest(unittest.TestCase):
+  root = None
+  _partitions = None
+
+  def setUp(self):
+    self.root = tempfile.mkdtemp(prefix='bootsetup.test-')
+    self._partitions = []
+
+  def tearDown(self):
+    shutil.rmtree(self.root, True)
+
+  def _write(self, path, content):
+    path = os.path.join(self.root, path)
+    if not os.path.isdir(os.path.dirname(path)):
+      os.makedirs(os.path.dirname(path))
+    with codecs.open(path, 'w', 'utf-8') as f:
+      f.write(content)
+
+  def _addDevice(self, name, major, minor, sectors, udev=None, disk=None, isDisk=False, model=None):
+    self._partitions.append("{0:>4} {1:>7} {2:>10} {3}".format(major, minor, sectors // 2, name))
+    self._write('sys/class/block/{0}/size'.format(name), "{0}\n".format(sectors))
+    if isDisk:
+      os.makedirs(os.path.join(self.root, 'sys/block', name, 'device'))
+      if model is not None:
+        self._write('sys/block/{0}/device/model'.format(name), model + "\n")
+    elif disk:
+      self._write('sys/class/block/{0}/partition'.format(name), "1\n")
+      os.makedirs(os.path.join(self.root, 'sys/block', disk, name))
+    if udev is not None:
+      self._write('run/udev/data/b{0}:{1}'.format(major, minor), "".join("E:{0}={1}\n".format(k, v) for (k, v) in sorted(udev.items())))
+
+  def _writePartitions(self):
+    self._write('proc/partitions', "major minor  #blocks  name\n\n" + "\n".join(self._partitions) + "\n")
+
+  def test_inventory(self):
+    self._addDevice('sda', 8, 0, 976773168, {'ID_PART_TABLE_TYPE': 'dos', 'ID_MODEL': 'udev_model'}, isDisk=True, model='ST500DM002  ')
+    self._addDevice('sda1', 8, 1, 41943040, {'ID_FS_TYPE': 'ext4', 'ID_FS_LABEL': 'Salix'}, disk='sda')
+    self._addDevice('sda2', 8, 2, 2, {}, disk='sda')  # extended
+    self._addDevice('sda5', 8, 5, 4194304, {'ID_FS_TYPE': 'swap'}, disk='sda')
+    self._addDevice('sda6', 8, 6, 209715200, {'ID_FS_TYPE': 'ntfs'}, disk='sda')
+    self._addDevice('nvme0n1', 259, 0, 500118192, {'ID_PART_TABLE_TYPE': 'gpt', 'ID_MODEL': 'Samsung SSD'}, isDisk=True)
+    self._addDevice('nvme0n1p1', 259, 1, 1048576, {'ID_FS_TYPE': 'vfat', 'ID_FS_LABEL': 'EFI'}, disk='nvme0n1')
+    self._addDevice('nvme0n1p2', 259, 2, 20971520, None, disk='nvme0n1')  # no udev data
+    self._addDevice('loop0', 7, 0, 204800, {'ID_FS_TYPE': 'squashfs'}, isDisk=True)
+    self._addDevice('sr0', 11, 0, 2097152, {}, isDisk=True)
+    self._writePartitions()
+    (disks, partitions) = sysfs.get_inventory(self.root)
+    self.assertEqual(disks, [
+        ['sda', 'msdos', 'ST500DM002 (500GB)'],
+        ['nvme0n1', 'gpt', 'Samsung SSD (256GB)'],
+      ])
+    self.assertEqual(partitions, [
+        ['sda1', 'ext4', 'Salix (21GB)'],
+        ['sda6', 'ntfs', ' (107GB)'],
+        ['nvme0n1p1', 'vfat', 'EFI (537MB)'],
+        ['nvme0n1p2', '', ' (11GB)'],
+      ])
+
+  def test_missing_udev_data(self):
+    self._addDevice('sdb', 8, 16, 15633408, None, isDisk=True)
+    self._addDevice('sdb1', 8, 17, 15631360, None, disk='sdb')
+    self._writePartitions()
+    self.assertEqual(sysfs.get_inventory(self.root), ([['sdb', '', ' (8.0GB)']], [['sdb1', '', ' (8.0GB)']]))
+
+  def test_no_proc(self):
+    os.makedirs(os.path.join(self.root, 'sys/block'))
+    self.assertRaises(EnvironmentError, sysfs.get_inventory, self.root)
+    self.assertRaises(EnvironmentError, sysfs.get_inventory, os.path.join(self.root, 'missing'))
+
+  def test_human_size(self):
+    self.assertEqual(sysfs.human_size(512), '512B')
+    self.assertEqual(sysfs.human_size(1500), '1.5KB')
+    self.assertEqual(sysfs.human_size(20 * 1000 ** 3), '20GB')
+    self.assertEqual(sysfs.human_size(3 * 1000 ** 5), '3000TB')
+
+
+if __name__ == '__main__':
+  unittest.main()